@@ -0,0 +1,264 @@
+"""
+Headless HTTP API for GraphRAG.
+
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+Queries and indexing run on the process-wide rag_pool, so every request for a
+dataset shares the same initialized LightRAG/RAGAnything instances. At most
+SERVER_MAX_CONCURRENCY queries (SERVER_MAX_INDEX_JOBS index runs) execute at once;
+further requests wait in a bounded queue and are rejected with 503 and a
+Retry-After header when the queue is full or the wait exceeds SERVER_QUEUE_TIMEOUT.
+GET /metrics exposes the per-stage latency histograms in the OpenMetrics format.
+The RAG_HOT_DATASETS are loaded at startup; GET /health lists the warm datasets.
+"""
+import os
+import re
+import time
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import Optional
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel
+from utils.rag import rag_pool, search, make_index, preload_hot_datasets, DATA_DIR
+from utils.config import RagConfig, ModalType, SEARCH_MODES, get_graph_storage, get_vector_storage
+from utils.ingest import list_text_files
+from utils.graph_store import load_graph
+from utils.tracing import Trace, openmetrics
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+SERVER_MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", 8))
+SERVER_MAX_QUEUE = int(os.getenv("SERVER_MAX_QUEUE", 64))
+SERVER_QUEUE_TIMEOUT = float(os.getenv("SERVER_QUEUE_TIMEOUT", 30))
+SERVER_MAX_INDEX_JOBS = int(os.getenv("SERVER_MAX_INDEX_JOBS", 1))
+SERVER_MAX_INDEX_QUEUE = int(os.getenv("SERVER_MAX_INDEX_QUEUE", 4))
+SERVER_MAX_GRAPH_NODES = int(os.getenv("SERVER_MAX_GRAPH_NODES", 500))
+SERVER_LANGUAGE = os.getenv("SERVER_LANGUAGE", "Japanese")
+GRAPH_FILE = "graph_chunk_entity_relation.graphml"
+# データセット名はワーキングディレクトリ名になるため、パスを含む名前は受け付けない
+DATASET_PATTERN = re.compile(r"^\w[\w.-]*$")
+
+
+class AdmissionQueue:
+    """
+    Bounded admission for one kind of request: `max_running` run at once and
+    at most `max_waiting` wait for a slot. Requests beyond that, or waiting
+    longer than `timeout` seconds, get 503 with Retry-After.
+    """
+
+    def __init__(self, name, max_running, max_waiting, timeout=SERVER_QUEUE_TIMEOUT):
+        self.name = name
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(max_running)
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _reject(self, reason):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=503,
+            detail=f"The {self.name} queue {reason}. Retry later.",
+            headers={"Retry-After": str(max(1, round(self.timeout)))},
+        )
+
+    async def acquire(self):
+        """Wait for a slot and return an idempotent function that releases it."""
+        if not self._slots.locked():
+            # 空きがあればその場で確保する（待ち行列を経由しない）
+            await self._slots.acquire()
+        elif self.waiting >= self.max_waiting:
+            self._reject("is full")
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self._reject(f"wait exceeded {self.timeout:g} seconds")
+            finally:
+                self.waiting -= 1
+        self.running += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.running -= 1
+                self.completed += 1
+                self._slots.release()
+        return release
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "max_running": self.max_running,
+            "max_waiting": self.max_waiting,
+        }
+
+
+class QueryRequest(BaseModel):
+    dataset: str
+    query: str
+    mode: str = "hybrid"
+    modal: str = ModalType.TEXT_ONLY.value
+    language: str = SERVER_LANGUAGE
+    img_base64: Optional[str] = None
+    stream: bool = False
+
+
+class IndexRequest(BaseModel):
+    dataset: str
+    language: str = SERVER_LANGUAGE
+
+
+# 起動時にホットデータセットの読み込みを始める（完了を待たずにリクエストを受け付ける）
+@asynccontextmanager
+async def lifespan(app):
+    preload_hot_datasets(SERVER_LANGUAGE)
+    yield
+
+app = FastAPI(title="GraphRAG Demo API", lifespan=lifespan)
+query_queue = AdmissionQueue("query", SERVER_MAX_CONCURRENCY, SERVER_MAX_QUEUE)
+index_queue = AdmissionQueue("index", SERVER_MAX_INDEX_JOBS, SERVER_MAX_INDEX_QUEUE)
+_index_locks = {}
+
+def _working_dir(dataset, must_exist=True):
+    if not DATASET_PATTERN.match(dataset):
+        raise HTTPException(status_code=400, detail=f"Invalid dataset name: {dataset}")
+    if must_exist and not os.path.isdir(dataset):
+        raise HTTPException(status_code=404, detail=f"Dataset `{dataset}` has no index. POST /index first.")
+    return dataset
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+@app.post("/query")
+async def query(request: QueryRequest):
+    """Answer a query. With `stream` the answer is sent as plain-text chunks."""
+    working_dir = _working_dir(request.dataset)
+    if request.mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {SEARCH_MODES}")
+    try:
+        modal = ModalType(request.modal)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"modal must be one of {[modal.value for modal in ModalType]}")
+    if modal == ModalType.MULTIMODAL_INPUT and not request.img_base64:
+        raise HTTPException(status_code=400, detail="img_base64 is required for Multimodal Input mode")
+
+    config = RagConfig(working_dir, request.language, get_graph_storage())
+    args = (config, request.mode, request.query, modal, request.img_base64)
+    retrieval = {}
+    release = await query_queue.acquire()
+    if request.stream:
+        chunks = _stream_answer(args, retrieval, release)
+        # 送信が始まる前に切断された場合もスロットを返す
+        weakref.finalize(chunks, release)
+        return StreamingResponse(chunks, media_type="text/plain; charset=utf-8")
+    start = time.perf_counter()
+    trace = Trace()
+    try:
+        answer = await search(*args, retrieval=retrieval, trace=trace)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {e}")
+    finally:
+        release()
+    return {
+        "answer": answer,
+        "mode": retrieval.get("mode", request.mode),
+        "entities": retrieval.get("entities", []),
+        "latency_ms": _elapsed_ms(start),
+        "trace_id": trace.trace_id,
+        "stages": trace.stage_rows(),
+    }
+
+async def _stream_answer(args, retrieval, release):
+    try:
+        async for chunk in await search(*args, stream=True, retrieval=retrieval):
+            yield chunk
+    except Exception as e:
+        yield f"Search failed: {e}"
+    finally:
+        release()
+
+@app.post("/index")
+async def index(request: IndexRequest):
+    """Index data/<dataset>.txt and data/<dataset>/ (only changed files are processed)."""
+    working_dir = _working_dir(request.dataset, must_exist=False)
+    if not list_text_files(DATA_DIR, request.dataset):
+        raise HTTPException(status_code=404, detail=f"No text files in `{DATA_DIR}/{request.dataset}.txt` or `{DATA_DIR}/{request.dataset}/`")
+    lock = _index_locks.setdefault(working_dir, asyncio.Lock())
+    if lock.locked():
+        raise HTTPException(status_code=409, detail=f"Dataset `{request.dataset}` is already being indexed")
+    release = await index_queue.acquire()
+    start = time.perf_counter()
+    trace = Trace()
+    try:
+        async with lock:
+            os.makedirs(working_dir, exist_ok=True)
+            summary = await make_index(RagConfig(working_dir, request.language, get_graph_storage()), request.dataset, trace=trace)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Indexing failed: {e}")
+    finally:
+        release()
+    return {
+        "dataset": request.dataset,
+        **summary,
+        "latency_ms": _elapsed_ms(start),
+        "trace_id": trace.trace_id,
+        "stages": trace.stage_rows(),
+    }
+
+# グラフの概要、またはエンティティのkホップ近傍（node-link形式）
+def _graph_payload(graphml_file, entities, hops, max_nodes):
+    graph = load_graph(graphml_file)
+    payload = {"sha256": graph.sha256, "n_nodes": graph.n_nodes, "n_edges": graph.n_edges, "directed": graph.directed}
+    if not entities:
+        return payload
+    seeds, missing = [], []
+    for entity in entities:
+        index = graph.find_node(entity)
+        if index is None:
+            missing.append(entity)
+        else:
+            seeds.append(index)
+    nodes = graph.k_hop(seeds, hops, max_nodes) if seeds else []
+    return {**payload, "missing": missing, **graph.node_link_data(nodes)}
+
+@app.get("/graph/{dataset}")
+async def graph(
+    dataset: str,
+    entity: list[str] = Query(default=[]),
+    hops: int = Query(default=1, ge=1, le=3),
+    max_nodes: int = Query(default=SERVER_MAX_GRAPH_NODES, ge=1),
+):
+    """Graph statistics, or the `hops`-hop neighborhood of the given entities."""
+    graphml_file = os.path.join(_working_dir(dataset), GRAPH_FILE)
+    if not os.path.exists(graphml_file):
+        raise HTTPException(status_code=404, detail=f"Dataset `{dataset}` has no NetworkX graph (graph storage: {get_graph_storage()})")
+    return await asyncio.to_thread(_graph_payload, graphml_file, entity, hops, min(max_nodes, SERVER_MAX_GRAPH_NODES))
+
+@app.get("/metrics")
+async def metrics():
+    """Per-stage latency histograms and token counters of the finished queries and index runs."""
+    return PlainTextResponse(openmetrics(), media_type="application/openmetrics-text; version=1.0.0; charset=utf-8")
+
+@app.get("/health")
+async def health():
+    return {
+        "graph_storage": get_graph_storage(),
+        "vector_storage": get_vector_storage(),
+        "queues": {"query": query_queue.stats(), "index": index_queue.stats()},
+        "rag_pool": rag_pool.stats(),
+    }
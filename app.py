@@ -4,8 +4,8 @@ import nest_asyncio
 import streamlit as st
 import streamlit.components.v1 as components
 from dotenv import load_dotenv
-from utils.graph_visualize import visualize_graphml, show_hierarchy_graph
-from utils.rag import make_index, search
+from utils.graph_visualize import visualize_graphml, visualize_neighborhood, show_hierarchy_graph
+from utils.ui import make_index, search, show_timing, show_warm_datasets
 from utils.common import select_dataset, select_language, select_graph_storage, check_storage, select_search_mode, select_modal, upload_image, ModalType
 
 nest_asyncio.apply()
@@ -35,6 +35,10 @@ def initialize_session_state():
         st.session_state.language = ""
     if "working_dir" not in st.session_state:
         st.session_state.working_dir = ""
+    if "retrieved_entities" not in st.session_state:
+        st.session_state.retrieved_entities = []
+    if "last_trace" not in st.session_state:
+        st.session_state.last_trace = None
 
 # 知識グラフの表示
 def display_knowledge_graph(graph_storage, filename):
@@ -46,13 +50,34 @@ def display_knowledge_graph(graph_storage, filename):
         """, unsafe_allow_html=True)
     else:
         filepath = f"./visualize/knowledge_graph_{filename}.html"
-        if not os.path.exists(filepath):
-            visualize_graphml(filename, filepath)
+        # グラフが更新されたときだけHTMLを作り直す
+        visualize_graphml(filename, filepath)
         with open(filepath, "r") as f:
             components.html(f.read(), height=500)
         df = show_hierarchy_graph(filename)
         st.dataframe(df)
 
+# エンティティの近傍グラフの表示（エンティティ名が空欄の場合は直前の検索で取得したエンティティを使う）
+def display_neighborhood_graph(graph_storage, filename):
+    if graph_storage == "Neo4JStorage":
+        return
+    with st.expander("Neighborhood Graph"):
+        entity = st.text_input("Entity", key="neighborhood_entity", help="空欄の場合は直前の検索で取得したエンティティの近傍を表示します。")
+        hops = st.number_input("Hops", min_value=1, max_value=3, value=1, key="neighborhood_hops")
+        if not st.button("View Neighborhood", help="エンティティの周辺の知識グラフだけを表示する"):
+            return
+        entities = [entity] if entity else st.session_state.retrieved_entities
+        if not entities:
+            st.warning("エンティティ名を入力するか、先に質問をしてください。")
+            return
+        if not os.path.exists(f"./{filename}/graph_chunk_entity_relation.graphml"):
+            st.warning("知識グラフがありません。先にインデックスを作成してください。")
+            return
+        html, missing = visualize_neighborhood(filename, entities, int(hops))
+        if missing:
+            st.warning(f"知識グラフに見つからないエンティティ: {', '.join(missing)}")
+        components.html(html, height=500)
+
 # チャット履歴の初期化
 def initialize_chat_history():
     if "messages" not in st.session_state:
@@ -68,6 +93,17 @@ def display_chat_history():
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+            show_timing(message.get("trace"))
+
+# 回答をストリーミング表示
+async def stream_answer(placeholder, mode, modal, prompt, img_base64=None):
+    msg = ""
+    placeholder.markdown("Assistant is thinking...")
+    async for chunk in await search(mode, query=prompt, modal=modal, img_base64=img_base64, stream=True):
+        msg += chunk
+        placeholder.markdown(msg + "▌")
+    placeholder.markdown(msg)
+    return msg
 
 # ユーザー入力に反応
 def handle_user_input(mode, modal, img_base64=None):
@@ -78,12 +114,11 @@ def handle_user_input(mode, modal, img_base64=None):
         st.session_state.messages.append({"role": "user", "content": prompt})
         # アシスタントメッセージの表示
         with st.chat_message("assistant"):
-            with st.spinner("Assistant is thinking..."):
-                placeholder = st.empty()
-                msg = asyncio.run(search(mode, query=prompt, modal=modal, img_base64=img_base64))
-                placeholder.markdown(msg)
-                # アシスタントメッセージをチャット履歴に追加
-                st.session_state.messages.append({"role": "assistant", "content": msg})
+            placeholder = st.empty()
+            msg = asyncio.run(stream_answer(placeholder, mode, modal, prompt, img_base64))
+            show_timing(st.session_state.last_trace)
+            # アシスタントメッセージをチャット履歴に追加
+            st.session_state.messages.append({"role": "assistant", "content": msg, "trace": st.session_state.last_trace})
 
 # メイン関数の定義
 async def main():
@@ -92,6 +127,7 @@ async def main():
 
     st.title("GraphRAG Demo")
     st.write("GraphRAGの威力を体感できるデモアプリです。")
+    show_warm_datasets()
 
     DATASET = select_dataset()
     st.session_state.working_dir = DATASET
@@ -109,6 +145,7 @@ async def main():
             await make_index(filename)
     if st.button("View Knowledge Graph", help="知識グラフを確認する"):
         display_knowledge_graph(graph_storage, filename)
+    display_neighborhood_graph(graph_storage, filename)
 
     mode = select_search_mode()
     modal = select_modal()
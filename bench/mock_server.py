@@ -0,0 +1,194 @@
+import re
+import json
+import time
+import base64
+import hashlib
+import argparse
+import functools
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# LightRAGのエンティティ抽出プロンプトで使われる区切り文字
+TUPLE_DELIMITER = "<|#|>"
+COMPLETION_DELIMITER = "<|COMPLETE|>"
+ENTITY_PATTERN = re.compile(r"\b[A-Z][A-Za-z0-9]+(?: [A-Z][A-Za-z0-9]+)*")
+INPUT_TEXT_PATTERN = re.compile(r"<Input Text>\s*```\s*(.*?)```", re.S)
+USER_QUERY_PATTERN = re.compile(r"User Query:\s*(.*?)\n\s*---", re.S)
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def _seed(text):
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+
+@functools.lru_cache(maxsize=65536)
+def _word_vector(word, dim):
+    return np.random.default_rng(_seed(word)).standard_normal(dim).astype(np.float32)
+
+# 単語ごとのランダムベクトルの和（共通の単語が多いテキストほど類似度が高くなる決定的な埋め込み）
+def mock_embedding(text, dim):
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in WORD_PATTERN.findall(text.lower()) or [text]:
+        vector += _word_vector(word, dim)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+def _message_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content") if message else None
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(item.get("text", "") for item in content if isinstance(item, dict))
+    return "\n".join(parts)
+
+# エンティティ抽出プロンプトへの応答（入力テキスト中の固有名詞らしき語を使う）
+def mock_extraction(prompt, max_entities=8):
+    # プロンプト内の例示ではなく、最後に現れる実データの入力テキストを使う
+    matches = INPUT_TEXT_PATTERN.findall(prompt)
+    text = matches[-1] if matches else prompt
+    entities = list(dict.fromkeys(ENTITY_PATTERN.findall(text)))[:max_entities]
+    lines = [
+        f"entity{TUPLE_DELIMITER}{name}{TUPLE_DELIMITER}category{TUPLE_DELIMITER}{name} appears in the benchmark corpus."
+        for name in entities
+    ]
+    lines.extend(
+        f"relation{TUPLE_DELIMITER}{source}{TUPLE_DELIMITER}{target}{TUPLE_DELIMITER}co-occurrence"
+        f"{TUPLE_DELIMITER}{source} is mentioned together with {target}."
+        for source, target in zip(entities, entities[1:])
+    )
+    lines.append(COMPLETION_DELIMITER)
+    return "\n".join(lines)
+
+def mock_keywords(prompt):
+    match = USER_QUERY_PATTERN.search(prompt)
+    words = list(dict.fromkeys(ENTITY_PATTERN.findall(match.group(1) if match else prompt)))
+    return json.dumps({"high_level_keywords": words, "low_level_keywords": words})
+
+def mock_answer(prompt, words):
+    rng = np.random.default_rng(_seed(prompt))
+    vocabulary = ["graph", "entity", "relation", "context", "answer", "summary", "document", "community"]
+    return " ".join(vocabulary[i] for i in rng.integers(0, len(vocabulary), size=words))
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible /chat/completions and /embeddings with deterministic output."""
+
+    protocol_version = "HTTP/1.1"
+    config = {"llm_latency": 0.0, "embedding_latency": 0.0, "dim": 768, "answer_words": 64}
+    counters = {"chat": 0, "embeddings": 0, "embedded_texts": 0}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.endswith("/embeddings"):
+            self._embeddings(body)
+        elif self.path.endswith("/chat/completions"):
+            self._chat(body)
+        else:
+            self._send_json({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    def _send_json(self, data, status=200):
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _embeddings(self, body):
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        self._count("embeddings")
+        self._count("embedded_texts", len(texts))
+        time.sleep(self.config["embedding_latency"])
+        dim = body.get("dimensions") or self.config["dim"]
+        data = []
+        for index, text in enumerate(texts):
+            vector = mock_embedding(text, dim)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(text) for text in texts)
+        self._send_json({
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "mock-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _chat(self, body):
+        self._count("chat")
+        time.sleep(self.config["llm_latency"])
+        prompt = _message_text(body.get("messages", []))
+        if body.get("response_format"):
+            content = mock_keywords(prompt)
+        elif "<Input Text>" in prompt and TUPLE_DELIMITER in prompt or "Extract entities" in prompt:
+            content = mock_extraction(prompt)
+        elif "missed or incorrectly formatted" in prompt:
+            content = COMPLETION_DELIMITER
+        else:
+            content = mock_answer(prompt, self.config["answer_words"])
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": f"mock-{_seed(prompt)}", "created": int(time.time()), "model": body.get("model", "mock-llm")}
+        if body.get("stream"):
+            self._stream(base, content, usage)
+            return
+        self._send_json({
+            **base,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    # Server-Sent Eventsでトークンを1語ずつ返す
+    def _stream(self, base, content, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        words = content.split(" ")
+        for index, word in enumerate(words):
+            delta = {"content": word if index == 0 else f" {word}"}
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        final = {**base, "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.close_connection = True
+
+
+def start_mock_server(port=0, llm_latency_ms=0, embedding_latency_ms=0, dim=768, answer_words=64):
+    """Start the mock server in a daemon thread and return (server, port)."""
+    MockOpenAIHandler.config = {
+        "llm_latency": llm_latency_ms / 1000,
+        "embedding_latency": embedding_latency_ms / 1000,
+        "dim": dim,
+        "answer_words": answer_words,
+    }
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockOpenAIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server, server.server_address[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI-compatible stub for offline benchmarks")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--llm-latency-ms", type=float, default=0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=0)
+    parser.add_argument("--dim", type=int, default=768)
+    args = parser.parse_args()
+    server, port = start_mock_server(args.port, args.llm_latency_ms, args.embedding_latency_ms, args.dim)
+    print(f"Mock OpenAI server listening on http://127.0.0.1:{port}/v1")
+    threading.Event().wait()
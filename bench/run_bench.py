@@ -0,0 +1,197 @@
+"""
+Offline benchmark for indexing and search.
+
+Starts the deterministic OpenAI-compatible stub in bench/mock_server.py, points
+utils.rag at it and measures make_index throughput plus search latency for
+every search mode and modal on synthetic corpora of increasing size. No API
+key or Neo4j is needed (NetworkXStorage is always used); without network
+access the tiktoken encodings must already be in TIKTOKEN_CACHE_DIR.
+
+    python -m bench.run_bench --sizes 50 200 1000 --queries 5 --output bench_results.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import contextlib
+import numpy as np
+from dotenv import load_dotenv
+from bench.mock_server import MockOpenAIHandler, start_mock_server
+
+# 環境変数をロード（EMBEDDING_DIMなどをutils.ragと揃える）
+load_dotenv()
+
+# 1x1ピクセルのPNG（Multimodal Inputモード用）
+SAMPLE_IMAGE_BASE64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+PEOPLE = ["Alice", "Bob", "Carol", "Dave", "Erin", "Frank", "Grace", "Heidi", "Ivan", "Judy"]
+PLACES = ["London", "Paris", "Tokyo", "Berlin", "Madrid", "Osaka", "Boston", "Lisbon"]
+TOPICS = ["trade", "music", "science", "politics", "medicine", "railways"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 1000], help="paragraphs per corpus")
+    parser.add_argument("--queries", type=int, default=5, help="distinct queries per mode and modal")
+    parser.add_argument("--modes", nargs="+", default=None, help="search modes (default: all)")
+    parser.add_argument("--modals", nargs="+", default=None, help="ModalType values (default: all)")
+    parser.add_argument("--language", default="English")
+    parser.add_argument("--llm-latency-ms", type=float, default=20)
+    parser.add_argument("--embedding-latency-ms", type=float, default=5)
+    parser.add_argument("--workdir", default=None, help="keep corpora and indexes here instead of a temp dir")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="show LightRAG logs and printed answers")
+    return parser.parse_args()
+
+
+# 固有名詞を含む段落からなる合成コーパス（乱数シード固定）
+def generate_corpus(path, paragraphs, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for index in range(paragraphs):
+            person = f"{rng.choice(PEOPLE)}{rng.randrange(paragraphs // 5 + 1)}"
+            other = f"{rng.choice(PEOPLE)}{rng.randrange(paragraphs // 5 + 1)}"
+            place = rng.choice(PLACES)
+            topic = rng.choice(TOPICS)
+            f.write(
+                f"In chapter {index}, {person} travelled to {place} to meet {other}. "
+                f"They discussed {topic} for many hours, and {person} wrote a long letter about it. "
+                f"Later {other} shared the letter with friends in {place}.\n\n"
+            )
+    return os.path.getsize(path)
+
+def peak_rss_mb():
+    # Linuxではキロバイト、macOSではバイト単位
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1024 * 1024)
+
+def latency_summary(latencies):
+    values = np.array(latencies) * 1000
+    return {
+        "count": len(latencies),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+        "qps": round(len(latencies) / sum(latencies), 2) if sum(latencies) else None,
+    }
+
+
+async def bench_dataset(rag, modes, modals, root, size, args):
+    from utils.config import RagConfig
+
+    name = f"bench{size}"
+    data_dir = os.path.join(root, "data")
+    config = RagConfig(os.path.join(root, name), args.language, "NetworkXStorage")
+    corpus_bytes = generate_corpus(os.path.join(data_dir, f"{name}.txt"), size)
+    result = {"paragraphs": size, "corpus_bytes": corpus_bytes}
+
+    # 初回作成と、変更がない場合の再実行を計測する
+    for label in ["index", "reindex_unchanged"]:
+        start = time.perf_counter()
+        summary = await rag.make_index(config, name, data_dir=data_dir)
+        elapsed = time.perf_counter() - start
+        result[label] = {
+            "seconds": round(elapsed, 3),
+            "bytes_per_second": round(corpus_bytes / elapsed, 1),
+            "summary": summary,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+
+    result["search"] = {}
+    for mode in modes:
+        for modal in modals:
+            img_base64 = SAMPLE_IMAGE_BASE64 if modal.name == "MULTIMODAL_INPUT" else None
+            latencies, errors = [], 0
+            # LightRAGのLLMキャッシュに当たらないよう、モード/モーダルごとに異なる質問にする
+            queries = [f"How is {PEOPLE[i % len(PEOPLE)]}{i} related to {PLACES[i % len(PLACES)]}? ({mode}, {modal.value})"
+                       for i in range(args.queries)]
+            for query in queries:
+                start = time.perf_counter()
+                try:
+                    await rag.search(config, mode, query, modal, img_base64)
+                except Exception as e:
+                    errors += 1
+                    print(f"[{mode}/{modal.value}] {type(e).__name__}: {e}", file=sys.stderr)
+                    continue
+                latencies.append(time.perf_counter() - start)
+            entry = {"errors": errors}
+            if latencies:
+                entry["cold"] = latency_summary(latencies)
+                # 同じ質問をもう一度投げて回答キャッシュのヒット時のレイテンシを測る
+                start = time.perf_counter()
+                await rag.search(config, mode, queries[0], modal, img_base64)
+                entry["cached_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            result["search"][f"{mode}/{modal.value}"] = entry
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return result
+
+
+async def run(args, root):
+    # utils.rag は環境変数を読み込むので、モックサーバーの設定後にインポートする
+    from utils import rag
+    from utils.common import SEARCH_MODES, ModalType
+
+    if not args.verbose:
+        logging.getLogger("lightrag").setLevel(logging.WARNING)
+    modes = args.modes or SEARCH_MODES
+    modals = [ModalType(value) for value in args.modals] if args.modals else list(ModalType)
+    datasets = []
+    try:
+        for size in args.sizes:
+            print(f"Benchmarking corpus of {size} paragraphs...", file=sys.stderr)
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+                datasets.append(await bench_dataset(rag, modes, modals, root, size, args))
+    finally:
+        pool_stats = rag.rag_pool.stats()
+        rag.rag_pool.close()
+    return {
+        "datasets": datasets,
+        "embedding_cache": rag.embedding_cache.stats(),
+        "answer_cache": rag.answer_cache.stats(),
+        "llm_client": rag.llm_client.stats(),
+        "rag_pool": pool_stats,
+    }
+
+
+def main():
+    args = parse_args()
+    server, port = start_mock_server(
+        llm_latency_ms=args.llm_latency_ms,
+        embedding_latency_ms=args.embedding_latency_ms,
+        dim=int(os.getenv("EMBEDDING_DIM", 768)),
+    )
+    root = args.workdir or tempfile.mkdtemp(prefix="graphrag-bench-")
+    os.environ.update({
+        "API_HOST": f"http://127.0.0.1:{port}/v1",
+        "API_KEY": "bench",
+        "ANSWER_CACHE_PATH": os.path.join(root, "cache", "answer_cache.sqlite3"),
+        "EMBEDDING_CACHE_DIR": os.path.join(root, "cache", "embeddings"),
+    })
+    try:
+        results = asyncio.run(run(args, root))
+    finally:
+        server.shutdown()
+    results["settings"] = {
+        "llm_latency_ms": args.llm_latency_ms,
+        "embedding_latency_ms": args.embedding_latency_ms,
+        "workdir": root,
+    }
+    results["mock_requests"] = dict(MockOpenAIHandler.counters)
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from api import AdmissionQueue
+
+
+def test_requests_beyond_the_waiting_limit_are_rejected():
+    queue = AdmissionQueue("query", max_running=2, max_waiting=1, timeout=5)
+
+    async def scenario():
+        first = await queue.acquire()
+        second = await queue.acquire()
+        waiter = asyncio.create_task(queue.acquire())
+        await asyncio.sleep(0)
+        assert queue.stats()["waiting"] == 1
+        with pytest.raises(HTTPException) as rejected:
+            await queue.acquire()
+        first()
+        first()
+        third = await waiter
+        assert queue.stats()["running"] == 2
+        second()
+        third()
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert rejected.headers == {"Retry-After": "5"}
+    assert "is full" in rejected.detail
+    assert queue.stats() == {"running": 0, "waiting": 0, "completed": 3, "rejected": 1, "max_running": 2, "max_waiting": 1}
+
+
+def test_waiting_longer_than_the_timeout_is_rejected():
+    queue = AdmissionQueue("index", max_running=1, max_waiting=4, timeout=0.05)
+
+    async def scenario():
+        release = await queue.acquire()
+        with pytest.raises(HTTPException) as rejected:
+            await queue.acquire()
+        release()
+        # 待ちきれなかった要求は枠を消費しない
+        again = await asyncio.wait_for(queue.acquire(), 1)
+        again()
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert rejected.headers == {"Retry-After": "1"}
+    assert "wait exceeded 0.05 seconds" in rejected.detail
+    assert queue.stats()["waiting"] == 0 and queue.stats()["running"] == 0
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from lightrag.kg.shared_storage import initialize_share_data
+from lightrag.utils import EmbeddingFunc
+from utils.ann_storage import AnnVectorDBStorage, rebuild
+
+DIM = 32
+
+
+def vector(text):
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).normal(size=DIM).astype(np.float32)
+
+
+async def embed(texts, **kwargs):
+    return np.stack([vector(text) for text in texts])
+
+
+def make_storage(tmp_path, namespace="chunks"):
+    initialize_share_data()
+    return AnnVectorDBStorage(
+        namespace=namespace,
+        workspace="",
+        global_config={
+            "working_dir": str(tmp_path),
+            "embedding_batch_num": 8,
+            "vector_db_storage_cls_kwargs": {"cosine_better_than_threshold": 0.0},
+        },
+        embedding_func=EmbeddingFunc(embedding_dim=DIM, func=embed),
+        meta_fields={"content", "src_id", "tgt_id"},
+    )
+
+
+def data(count):
+    return {f"chunk-{i}": {"content": f"paragraph {i}"} for i in range(count)}
+
+
+def top_id(storage, text):
+    results = asyncio.run(storage.query(text, top_k=3, query_embedding=vector(text).tolist()))
+    return results[0]["id"] if results else None
+
+
+def test_upsert_query_and_reload(tmp_path):
+    storage = make_storage(tmp_path)
+
+    async def scenario():
+        await storage.initialize()
+        await storage.upsert(data(20))
+        assert await storage.index_done_callback()
+    asyncio.run(scenario())
+    assert top_id(storage, "paragraph 7") == "chunk-7"
+
+    reloaded = make_storage(tmp_path)
+    asyncio.run(reloaded.initialize())
+    assert len(reloaded.client_storage["data"]) == 20
+    assert top_id(reloaded, "paragraph 7") == "chunk-7"
+    assert asyncio.run(reloaded.get_by_id("chunk-7"))["content"] == "paragraph 7"
+    stored = asyncio.run(reloaded.get_vectors_by_ids(["chunk-7"]))["chunk-7"]
+    expected = vector("paragraph 7") / np.linalg.norm(vector("paragraph 7"))
+    assert np.allclose(stored, expected, atol=1e-5)
+
+
+def test_upsert_replaces_existing_id(tmp_path):
+    storage = make_storage(tmp_path)
+
+    async def scenario():
+        await storage.initialize()
+        await storage.upsert(data(10))
+        await storage.upsert({"chunk-3": {"content": "rewritten"}})
+    asyncio.run(scenario())
+    assert len(storage.client_storage["data"]) == 10
+    assert top_id(storage, "rewritten") == "chunk-3"
+    assert top_id(storage, "paragraph 3") != "chunk-3"
+
+
+def test_delete_skips_and_compacts(tmp_path):
+    storage = make_storage(tmp_path)
+
+    async def scenario():
+        await storage.initialize()
+        await storage.upsert(data(20))
+        # 1件の削除は検索時に除外するだけで、インデックスは作り直さない
+        await storage.delete(["chunk-7"])
+        assert storage._index.ntotal == 20
+        assert storage._deleted
+        # 削除済みがANN_COMPACT_RATIOを超えるとインデックスを作り直す
+        await storage.delete([f"chunk-{i}" for i in range(10, 16)])
+        assert storage._index.ntotal == 13
+        assert not storage._deleted
+        assert await storage.index_done_callback()
+    asyncio.run(scenario())
+    assert top_id(storage, "paragraph 7") != "chunk-7"
+    assert top_id(storage, "paragraph 4") == "chunk-4"
+    assert asyncio.run(storage.get_by_id("chunk-12")) is None
+
+
+def test_delete_entity_relation(tmp_path):
+    storage = make_storage(tmp_path, "relationships")
+    relations = {
+        "rel-1": {"content": "scrooge marley", "src_id": "SCROOGE", "tgt_id": "MARLEY"},
+        "rel-2": {"content": "scrooge bob", "src_id": "SCROOGE", "tgt_id": "BOB"},
+        "rel-3": {"content": "bob tim", "src_id": "BOB", "tgt_id": "TIM"},
+    }
+
+    async def scenario():
+        await storage.initialize()
+        await storage.upsert(relations)
+        await storage.delete_entity_relation("SCROOGE")
+    asyncio.run(scenario())
+    assert [row["__id__"] for row in storage.client_storage["data"]] == ["rel-3"]
+
+
+def test_rebuild_keeps_ids_and_rows(tmp_path):
+    storage = make_storage(tmp_path)
+
+    async def scenario():
+        await storage.initialize()
+        await storage.upsert(data(20))
+        await storage.delete(["chunk-0"])
+        assert await storage.index_done_callback()
+    asyncio.run(scenario())
+
+    source, kind, count = rebuild(str(tmp_path), "chunks")
+    assert (source, kind, count) == ("hnsw", "hnsw", 19)
+    assert rebuild(str(tmp_path), "entities") == (None, None, 0)
+
+    rebuilt = make_storage(tmp_path)
+    asyncio.run(rebuilt.initialize())
+    assert not rebuilt._deleted
+    assert rebuilt._index.ntotal == 19
+    assert top_id(rebuilt, "paragraph 5") == "chunk-5"
+    assert top_id(rebuilt, "paragraph 0") != "chunk-0"
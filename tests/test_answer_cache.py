@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from utils import answer_cache
+from utils.answer_cache import AnswerCache, normalize_query, NO_CONTEXT_MARKER
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(answer_cache.time, "time", clock)
+    return clock
+
+
+def args(query, **overrides):
+    return {"dataset": "dickens", "mode": "hybrid", "modal": "Text Only", "query": query, "version": "1", **overrides}
+
+
+def test_normalize_query():
+    assert normalize_query("  Who is  SCROOGE？ ") == normalize_query("who is scrooge")
+    assert normalize_query("スクルージとは。") == "スクルージとは"
+
+
+def test_exact_hits_are_scoped(tmp_path, clock):
+    cache = AnswerCache(tmp_path / "answers.sqlite3")
+    cache.put(answer="A miser.", entities=["SCROOGE"], **args("Who is Scrooge?"))
+    assert cache.get(**args("who is scrooge")) == "A miser."
+    assert cache.entities(**args("Who is Scrooge?")) == ["SCROOGE"]
+    assert cache.get(**args("Who is Scrooge?", mode="naive")) is None
+    assert cache.get(**args("Who is Scrooge?", version="2")) is None
+    cache.invalidate("dickens")
+    assert cache.get(**args("Who is Scrooge?")) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_failed_answers_are_not_cached(tmp_path, clock):
+    cache = AnswerCache(tmp_path / "answers.sqlite3")
+    cache.put(answer="", **args("a"))
+    cache.put(answer=f"Sorry.{NO_CONTEXT_MARKER}", **args("b"))
+    assert cache.stats()["entries"] == 0
+
+
+def test_ttl(tmp_path, clock):
+    cache = AnswerCache(tmp_path / "answers.sqlite3", ttl_seconds=100)
+    cache.put(answer="A miser.", **args("Who is Scrooge?"))
+    assert cache.get(**args("Who is Scrooge?")) == "A miser."
+    clock.now += 100
+    assert cache.get(**args("Who is Scrooge?")) is None
+    # 期限切れのエントリは次の保存時に削除される
+    cache.put(answer="Marley's ghost.", **args("Who visits Scrooge?"))
+    assert cache.stats()["entries"] == 1
+
+
+def test_lru_eviction(tmp_path, clock):
+    cache = AnswerCache(tmp_path / "answers.sqlite3", max_entries=2)
+    cache.put(answer="1", **args("one"))
+    cache.put(answer="2", **args("two"))
+    assert cache.get(**args("one")) == "1"
+    cache.put(answer="3", **args("three"))
+    # 最も長く使われていない"two"が削除される
+    assert cache.get(**args("two")) is None
+    assert cache.get(**args("one")) == "1"
+    assert cache.get(**args("three")) == "3"
+
+
+def test_similar_queries(tmp_path, clock):
+    cache = AnswerCache(tmp_path / "answers.sqlite3", similarity=0.9)
+    cache.put(answer="A miser.", embedding=np.array([1.0, 0.0, 0.0]), **args("Who is Scrooge?"))
+    cache.put(answer="A ghost.", embedding=np.array([0.0, 1.0, 0.0]), **args("Who is Marley?"))
+    assert cache.get(embedding=np.array([0.95, 0.1, 0.0]), **args("Tell me about Scrooge")) == "A miser."
+    assert cache.get(embedding=np.array([0.7, 0.7, 0.0]), **args("Scrooge and Marley")) is None
+    assert cache.get(embedding=np.array([0.95, 0.1, 0.0]), **args("Tell me about Scrooge", mode="naive")) is None
+    stats = cache.stats()
+    assert (stats["similar_hits"], stats["misses"]) == (1, 2)
@@ -0,0 +1,52 @@
+import io
+import json
+import asyncio
+from utils import batch_query
+
+
+def run(monkeypatch, tmp_path, records, window=1000):
+    calls = []
+
+    async def search(config, mode, query, modal, img_base64, retrieval=None, trace=None):
+        calls.append(query)
+        if query == "fail":
+            raise RuntimeError("boom")
+        retrieval["entities"] = ["SCROOGE"]
+        return f"answer to {query}"
+
+    monkeypatch.setattr(batch_query, "search", search)
+    monkeypatch.setattr(batch_query, "BATCH_DEDUP_WINDOW", window)
+    defaults = {"dataset": str(tmp_path), "language": "English", "mode": "hybrid", "modal": "Text Only"}
+    output = io.StringIO()
+    lines = [json.dumps(record) if isinstance(record, dict) else record for record in records]
+    summary = asyncio.run(batch_query.run_batch(lines, output, defaults, concurrency=2))
+    rows = sorted((json.loads(line) for line in output.getvalue().splitlines()), key=lambda row: row["line"])
+    return summary, rows, calls
+
+
+def test_duplicates_errors_and_summary(monkeypatch, tmp_path):
+    records = [{"query": "a"}, {"query": "b", "id": 7}, {"query": "a"}, "not json", {"query": "fail"}, "", {"query": "a", "mode": "naive"}]
+    summary, rows, calls = run(monkeypatch, tmp_path, records)
+    assert sorted(calls) == ["a", "a", "b", "fail"]
+    assert [row["line"] for row in rows] == [1, 2, 3, 4, 5, 7]
+    assert rows[0]["answer"] == "answer to a" and rows[0]["entities"] == ["SCROOGE"]
+    assert rows[1]["id"] == 7
+    assert rows[2]["duplicate_of"] == 1 and rows[2]["answer"] == "answer to a"
+    assert rows[3]["error"].startswith("Invalid record")
+    assert rows[4]["error"] == "RuntimeError: boom"
+    assert "duplicate_of" not in rows[5]
+    assert summary["records"] == 6
+    assert summary["unique"] == 4
+    assert summary["deduplicated"] == 1
+    assert summary["errors"] == 2
+    assert summary["p50_ms"] is not None
+
+
+def test_dedup_window_only_keeps_recent_queries(monkeypatch, tmp_path):
+    records = [{"query": "a"}, {"query": "b"}, {"query": "c"}, {"query": "a"}, {"query": "c"}]
+    summary, rows, calls = run(monkeypatch, tmp_path, records, window=2)
+    # aは窓から外れているので検索し直し、cは直前の回答を使う
+    assert calls.count("a") == 2
+    assert calls.count("c") == 1
+    assert rows[4]["duplicate_of"] == 3
+    assert summary["unique"] == 4
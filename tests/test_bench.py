@@ -0,0 +1,81 @@
+import json
+import base64
+import urllib.request
+import numpy as np
+import pytest
+from bench.mock_server import start_mock_server, mock_embedding, mock_extraction, TUPLE_DELIMITER, COMPLETION_DELIMITER
+from bench.run_bench import generate_corpus, latency_summary
+
+
+@pytest.fixture
+def server():
+    server, port = start_mock_server(port=0, dim=16, answer_words=5)
+    yield f"http://127.0.0.1:{port}/v1"
+    server.shutdown()
+
+
+def post(url, body):
+    request = urllib.request.Request(url, json.dumps(body).encode("utf-8"), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return response.headers.get("Content-Type"), response.read().decode("utf-8")
+
+
+def test_mock_embedding_is_deterministic_and_normalized():
+    vector = mock_embedding("Scrooge counts his money", 32)
+    assert np.allclose(vector, mock_embedding("Scrooge counts his money", 32))
+    assert np.isclose(np.linalg.norm(vector), 1.0)
+    # 共通の単語が多いテキストほど類似度が高い
+    assert vector @ mock_embedding("Scrooge counts coins", 32) > vector @ mock_embedding("Tiny Tim sings", 32)
+
+
+def test_mock_extraction_uses_the_last_input_text():
+    prompt = "<Input Text>\n```\nExample Person met Someone\n```\n...\n<Input Text>\n```\nScrooge met Marley in London.\n```"
+    lines = mock_extraction(prompt).splitlines()
+    assert lines[0] == f"entity{TUPLE_DELIMITER}Scrooge{TUPLE_DELIMITER}category{TUPLE_DELIMITER}Scrooge appears in the benchmark corpus."
+    assert [line.split(TUPLE_DELIMITER)[1] for line in lines if line.startswith("entity")] == ["Scrooge", "Marley", "London"]
+    assert sum(line.startswith("relation") for line in lines) == 2
+    assert lines[-1] == COMPLETION_DELIMITER
+
+
+def test_embeddings_endpoint(server):
+    _, body = post(f"{server}/embeddings", {"input": ["Scrooge", "Marley"], "model": "mock"})
+    data = json.loads(body)["data"]
+    assert [item["index"] for item in data] == [0, 1]
+    assert np.allclose(data[0]["embedding"], mock_embedding("Scrooge", 16))
+    _, body = post(f"{server}/embeddings", {"input": "Scrooge", "encoding_format": "base64"})
+    encoded = json.loads(body)["data"][0]["embedding"]
+    assert np.allclose(np.frombuffer(base64.b64decode(encoded), dtype=np.float32), mock_embedding("Scrooge", 16))
+
+
+def test_chat_completion_and_stream(server):
+    messages = [{"role": "user", "content": "Who is Scrooge?"}]
+    _, body = post(f"{server}/chat/completions", {"messages": messages})
+    answer = json.loads(body)["choices"][0]["message"]["content"]
+    assert len(answer.split(" ")) == 5
+
+    content_type, body = post(f"{server}/chat/completions", {"messages": messages, "stream": True})
+    assert content_type == "text/event-stream"
+    events = [line[len("data: "):] for line in body.split("\n\n") if line]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    assert "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks) == answer
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+
+
+def test_keyword_extraction_response(server):
+    messages = [{"role": "user", "content": "User Query: How is Scrooge related to London?\n---"}]
+    _, body = post(f"{server}/chat/completions", {"messages": messages, "response_format": {"type": "json_object"}})
+    keywords = json.loads(json.loads(body)["choices"][0]["message"]["content"])
+    assert keywords["low_level_keywords"] == ["How", "Scrooge", "London"]
+
+
+def test_generate_corpus_and_latency_summary(tmp_path):
+    first = tmp_path / "a" / "bench.txt"
+    second = tmp_path / "b" / "bench.txt"
+    assert generate_corpus(str(first), 20) == generate_corpus(str(second), 20)
+    assert first.read_text(encoding="utf-8") == second.read_text(encoding="utf-8")
+    assert first.read_text(encoding="utf-8").count("\n\n") == 20
+    summary = latency_summary([0.1, 0.2, 0.3, 0.4])
+    assert summary["count"] == 4
+    assert summary["p50_ms"] == 250.0
+    assert summary["qps"] == 4.0
@@ -0,0 +1,79 @@
+import pandas as pd
+import networkx as nx
+from graphrag.index.operations.cluster_graph import cluster_graph
+from utils import community_cache
+from utils.community_cache import GRAPH_FILE, load_communities
+
+STRATEGY = {"type": "leiden", "max_cluster_size": 4, "use_lcc": False, "seed": 0xDEADBEEF, "levels": None}
+
+
+def ring(graph, prefix, size):
+    for i in range(size):
+        graph.add_edge(f"{prefix}{i}", f"{prefix}{(i + 1) % size}", weight=1.0 + i % 3)
+
+
+def write(graph, working_dir):
+    nx.write_graphml(graph, working_dir / GRAPH_FILE)
+
+
+def count_clustering(monkeypatch):
+    calls = []
+    cluster_component = community_cache.cluster_component
+
+    def counted(edges, strategy):
+        calls.append(edges)
+        return cluster_component(edges, strategy)
+    monkeypatch.setattr(community_cache, "cluster_component", counted)
+    return calls
+
+
+def groups(communities):
+    return sorted((level, community, parent, tuple(sorted(titles)))
+                  for (level, community, parent), titles in communities.groupby(["level", "community", "parent"])["title"])
+
+
+def test_only_changed_components_are_clustered_again(monkeypatch, tmp_path):
+    calls = count_clustering(monkeypatch)
+    graph = nx.Graph()
+    ring(graph, "A", 12)
+    ring(graph, "B", 8)
+    write(graph, tmp_path)
+    first = load_communities(tmp_path, STRATEGY)
+    assert len(calls) == 2
+    assert set(first["title"]) == set(graph.nodes)
+
+    # グラフが変わらなければ保存した結果を返す
+    assert groups(load_communities(tmp_path, STRATEGY)) == groups(first)
+    assert len(calls) == 2
+
+    graph.add_edge("B0", "B4", weight=2.0)
+    write(graph, tmp_path)
+    changed = load_communities(tmp_path, STRATEGY)
+    assert len(calls) == 3
+    assert set(calls[-1][0][:2]) <= {f"B{i}" for i in range(8)}
+    assert [group for group in groups(changed) if group[3][0].startswith("A")] == \
+        [group for group in groups(first) if group[3][0].startswith("A")]
+
+    # 別の戦略は別のキャッシュに保存する
+    load_communities(tmp_path, {**STRATEGY, "max_cluster_size": 6})
+    assert len(calls) == 5
+
+
+def test_use_lcc_matches_graphrag(tmp_path):
+    graph = nx.Graph()
+    ring(graph, "A", 12)
+    ring(graph, "B", 8)
+    # 正規化すると同じ名前になるノードでAの環とBの環がつながる
+    graph.add_edge("a0 ", "b&amp;", weight=1.0)
+    graph.add_edge("B&", "B0", weight=1.0)
+    write(graph, tmp_path)
+    communities = load_communities(tmp_path, {**STRATEGY, "use_lcc": True})
+
+    edges = pd.DataFrame(
+        [(source, target, data["weight"]) for source, target, data in graph.edges(data=True)],
+        columns=["source", "target", "weight"],
+    )
+    expected = cluster_graph(edges, STRATEGY["max_cluster_size"], use_lcc=True, seed=STRATEGY["seed"])
+    assert groups(communities) == sorted((level, community, parent, tuple(sorted(titles)))
+                                         for level, community, parent, titles in expected)
+    assert "B&" in set(communities["title"]) and "a0 " not in set(communities["title"])
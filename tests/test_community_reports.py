@@ -0,0 +1,79 @@
+import asyncio
+import networkx as nx
+from utils import community_reports
+from utils.community_cache import GRAPH_FILE
+from utils.community_reports import _parse_points, select_reports, refresh_reports, fresh_reports
+
+
+def test_parse_points_reads_json_inside_text():
+    response = 'Here you go:\n```json\n{"points": [{"description": "Scrooge is a miser", "score": 80}, {"description": "", "score": 10}, {"description": "Marley", "score": "5"}]}\n```'
+    assert _parse_points(response) == [
+        {"description": "Scrooge is a miser", "score": 80.0},
+        {"description": "Marley", "score": 5.0},
+    ]
+
+
+def test_parse_points_falls_back_to_the_whole_answer():
+    assert _parse_points("Scrooge changes his ways.") == [{"description": "Scrooge changes his ways.", "score": 50.0}]
+    assert _parse_points('{"answer": "no points key"}') == [{"description": '{"answer": "no points key"}', "score": 50.0}]
+    assert _parse_points('{"points": []}') == []
+    assert _parse_points("  ") == []
+    assert _parse_points(None) == []
+
+
+def report(level, rank):
+    return {"level": level, "rank": rank, "title": f"{level}-{rank}"}
+
+
+def test_select_reports_uses_the_deepest_level_up_to_the_requested_one(monkeypatch):
+    reports = {"reports": [report(1, 5), report(0, 1), report(0, 9), report(2, 7), report(0, 3)]}
+    monkeypatch.setattr(community_reports, "GLOBAL_MAX_REPORTS", 2)
+    assert [item["title"] for item in select_reports(reports, level=0)] == ["0-9", "0-3"]
+    assert [item["title"] for item in select_reports(reports, level=1)] == ["1-5"]
+    # 存在しないレベルはそれ以下で最も深いレベル、それもなければ最上位を使う
+    assert [item["title"] for item in select_reports(reports, level=5)] == ["2-7"]
+    assert [item["title"] for item in select_reports({"reports": [report(1, 2)]}, level=0)] == ["1-2"]
+
+
+def write_graph(working_dir):
+    graph = nx.Graph()
+    for group in range(3):
+        names = [f"PERSON_{group}_{i}" for i in range(5)]
+        for name in names:
+            graph.add_node(name, entity_type="person", description=f"{name} lives in town {group}")
+        for i, source in enumerate(names):
+            for target in names[i + 1:]:
+                graph.add_edge(source, target, description=f"{source} knows {target}", keywords="friends", weight=1.0)
+    graph.add_edge("PERSON_0_0", "PERSON_1_0", description="met once", weight=0.1)
+    graph.add_edge("PERSON_1_0", "PERSON_2_0", description="met once", weight=0.1)
+    nx.write_graphml(graph, working_dir / GRAPH_FILE)
+
+
+def test_failed_reports_are_retried_on_the_next_refresh(tmp_path):
+    write_graph(tmp_path)
+    calls = []
+    failing = {"enabled": True}
+
+    async def llm(prompt, system_prompt=None, **kwargs):
+        calls.append(prompt)
+        if failing["enabled"] and "PERSON_1_" in prompt:
+            raise RuntimeError("rate limited")
+        return f"# Report {len(calls)}\nSummary."
+
+    first = asyncio.run(refresh_reports(str(tmp_path), llm, "English"))
+    assert first["failed"] >= 1
+    assert first["generated"] + first["failed"] == first["communities"]
+    partial = fresh_reports(str(tmp_path), "English")
+    assert partial is not None and len(partial["reports"]) == first["generated"]
+
+    failing["enabled"] = False
+    calls.clear()
+    second = asyncio.run(refresh_reports(str(tmp_path), llm, "English"))
+    # グラフは同じでも、失敗したコミュニティだけを作り直す
+    assert second == {"communities": first["communities"], "generated": first["failed"], "reused": first["generated"], "failed": 0}
+    assert len(calls) == first["failed"]
+
+    calls.clear()
+    third = asyncio.run(refresh_reports(str(tmp_path), llm, "English"))
+    assert third["generated"] == 0 and third["reused"] == first["communities"]
+    assert calls == []
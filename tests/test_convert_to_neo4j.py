@@ -0,0 +1,176 @@
+import json
+import threading
+import networkx as nx
+import pytest
+from utils import convert_to_neo4j
+from utils.convert_to_neo4j import LoadState, relation_type, node_rows, edge_rows, _load_batches
+from utils.graph_store import load_graph
+
+
+class FakeResult:
+    def consume(self):
+        pass
+
+
+class FakeTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, rows):
+        if self.driver.fail and self.driver.fail(rows):
+            raise RuntimeError("write failed")
+        with self.driver.lock:
+            self.driver.writes.append(rows)
+        return FakeResult()
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query):
+        return FakeResult()
+
+    def execute_write(self, work):
+        return work(FakeTransaction(self.driver))
+
+
+class FakeDriver:
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.writes = []
+        self.lock = threading.Lock()
+
+    def session(self):
+        return FakeSession(self)
+
+
+def test_relation_type():
+    assert relation_type("company leadership, employs") == "lead"
+    assert relation_type('"employs", partners') == "employs"
+    assert relation_type("") == "related"
+    assert relation_type('""') == "related"
+
+
+def test_rows_strip_quotes_and_default_the_label(tmp_path):
+    graph = nx.Graph()
+    graph.add_node('"SCROOGE"', entity_type='"person"', description='"A miser"')
+    graph.add_node("LONDON")
+    graph.add_edge('"SCROOGE"', "LONDON", keywords='"home, located in"', weight=1.5)
+    path = str(tmp_path / "graph_chunk_entity_relation.graphml")
+    nx.write_graphml(graph, path)
+    snapshot = load_graph(path)
+
+    nodes = {row["id"]: row for row in node_rows(snapshot, 0, snapshot.n_nodes)}
+    assert nodes["SCROOGE"]["label"] == "person"
+    assert nodes["SCROOGE"]["description"] == "A miser"
+    assert nodes["LONDON"]["label"] == "UNKNOWN"
+    [edge] = edge_rows(snapshot, 0, snapshot.n_edges)
+    assert {edge["source"], edge["target"]} == {"SCROOGE", "LONDON"}
+    assert (edge["type"], edge["keywords"], edge["weight"]) == ("located", "home, located in", 1.5)
+
+
+def write_state(tmp_path, **state):
+    (tmp_path / convert_to_neo4j.LOAD_STATE_FILE).write_text(json.dumps(state), encoding="utf-8")
+
+
+def test_load_state_resumes_from_a_partial_file(tmp_path):
+    sizes = {"nodes": 2, "edges": 3}
+    write_state(tmp_path, graph_sha256="abc", batch_sizes=sizes, done={"nodes": [2, 0]})
+    state = LoadState(tmp_path, "abc", sizes)
+    assert state.done("nodes") == {0, 2}
+    assert state.done("edges") == set()
+    assert not state.data["completed"]
+
+    state.commit("edges", 1)
+    assert LoadState(tmp_path, "abc", sizes).done("edges") == {1}
+
+
+@pytest.mark.parametrize("graph_hash, sizes, restart", [
+    ("changed", {"nodes": 2, "edges": 3}, False),
+    ("abc", {"nodes": 4, "edges": 3}, False),
+    ("abc", {"nodes": 2, "edges": 3}, True),
+])
+def test_load_state_starts_over(tmp_path, graph_hash, sizes, restart):
+    write_state(tmp_path, graph_sha256="abc", batch_sizes={"nodes": 2, "edges": 3},
+                done={"nodes": [0, 1], "edges": [0]}, completed=True)
+    state = LoadState(tmp_path, graph_hash, sizes, restart)
+    assert state.done("nodes") == state.done("edges") == set()
+    assert not state.data["completed"]
+
+
+def load(driver, state, total_rows=10, batch_size=3, workers=2):
+    def make_rows(start, stop):
+        return list(range(start, min(stop, total_rows)))
+    return _load_batches(driver, state, "nodes", "query", make_rows, total_rows, batch_size, workers,
+                         lambda *args: None)
+
+
+def test_load_batches_partitions_rows_and_skips_committed_batches(tmp_path):
+    state = LoadState(tmp_path, "abc", {"nodes": 3})
+    state.commit("nodes", 1)
+    driver = FakeDriver()
+    assert load(driver, state) == 7
+    assert sorted(driver.writes) == [[0, 1, 2], [6, 7, 8], [9]]
+    assert state.done("nodes") == {0, 1, 2, 3}
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_failed_batch_is_written_again_on_resume(tmp_path, workers):
+    state = LoadState(tmp_path, "abc", {"nodes": 3})
+    driver = FakeDriver(fail=lambda rows: 6 in rows)
+    with pytest.raises(RuntimeError):
+        load(driver, state, workers=workers)
+    # 書き込めたバッチだけがコミット済みとして記録される
+    assert state.done("nodes") == {rows[0] // 3 for rows in driver.writes}
+    assert 2 not in state.done("nodes")
+
+    driver = FakeDriver()
+    load(driver, LoadState(tmp_path, "abc", {"nodes": 3}), workers=workers)
+    assert [6, 7, 8] in driver.writes
+    assert all(rows[0] // 3 not in state.done("nodes") for rows in driver.writes)
+
+
+def snapshot_of(tmp_path, name, nodes, edges):
+    graph = nx.Graph()
+    for node_id, entity_type in nodes:
+        graph.add_node(node_id, entity_type=entity_type)
+    for source, target, keywords in edges:
+        graph.add_edge(source, target, keywords=keywords)
+    (tmp_path / name).mkdir()
+    path = str(tmp_path / name / "graph_chunk_entity_relation.graphml")
+    nx.write_graphml(graph, path)
+    return load_graph(path)
+
+
+def test_diff_graph(tmp_path):
+    before = snapshot_of(tmp_path, "before",
+                         [("SCROOGE", "person"), ("MARLEY", "person"), ("LONDON", "geo"), ("FEZZIWIG", "person")],
+                         [("SCROOGE", "MARLEY", "partners"), ("SCROOGE", "LONDON", "lives"),
+                          ("FEZZIWIG", "SCROOGE", "employs")])
+    previous, _, _ = convert_to_neo4j.diff_graph(before, {})
+    # LONDONを先に追加し、SCROOGEとLONDONの辺を逆向きに保存する
+    after = snapshot_of(tmp_path, "after",
+                        [("LONDON", "geo"), ("SCROOGE", "miser"), ("MARLEY", "person"), ("TINY TIM", "person")],
+                        [("LONDON", "SCROOGE", "lives"), ("SCROOGE", "MARLEY", "partners, located"),
+                         ("MARLEY", "TINY TIM", "haunts")])
+    assert [(row["source"], row["target"]) for row in edge_rows(after, 0, after.n_edges)
+            if "LONDON" in (row["source"], row["target"])] == [("LONDON", "SCROOGE")]
+
+    digests, changed, removed = convert_to_neo4j.diff_graph(after, previous)
+    assert sorted(row["id"] for row in changed["nodes"]) == ["SCROOGE", "TINY TIM"]
+    assert removed["nodes"] == ["FEZZIWIG"]
+    assert sorted((row["source"], row["target"]) for row in changed["edges"]) == [("MARLEY", "SCROOGE"), ("MARLEY", "TINY TIM")]
+    assert removed["edges"] == ["FEZZIWIG\tSCROOGE"]
+    assert digests["graph_sha256"] == after.sha256
+
+    # 差分を反映した後は変更なし
+    _, changed, removed = convert_to_neo4j.diff_graph(after, digests)
+    assert changed == {"nodes": [], "edges": []}
+    assert removed == {"nodes": [], "edges": []}
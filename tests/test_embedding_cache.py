@@ -0,0 +1,148 @@
+import os
+import asyncio
+import multiprocessing
+import numpy as np
+import pytest
+from utils.embedding_cache import EmbeddingStore, EmbeddingCache, text_hash
+
+DIM = 4
+
+
+def vector_for(text):
+    seed = int(text_hash(text)[:8], 16)
+    return np.random.default_rng(seed).random(DIM, dtype=np.float32)
+
+
+def put_texts(store, texts):
+    store.put_many([text_hash(text) for text in texts], [vector_for(text) for text in texts])
+
+
+def assert_vectors(store, texts):
+    found = store.get_many({text_hash(text) for text in texts})
+    assert len(found) == len(texts)
+    for text in texts:
+        np.testing.assert_array_equal(found[text_hash(text)], vector_for(text))
+
+
+def test_round_trip_and_reopen(tmp_path):
+    store = EmbeddingStore(tmp_path, "text-embedding-004", DIM)
+    put_texts(store, ["a", "b", "c"])
+    put_texts(store, ["b", "d"])
+    assert len(store) == 4
+    assert_vectors(store, ["a", "b", "c", "d"])
+
+    sizes = {name: os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path)}
+    reopened = EmbeddingStore(tmp_path, "text-embedding-004", DIM)
+    assert len(reopened) == 4
+    assert_vectors(reopened, ["a", "b", "c", "d"])
+    # 開くだけではファイルを書き換えない
+    assert {name: os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path)} == sizes
+
+
+def test_two_writers_share_a_directory(tmp_path):
+    first = EmbeddingStore(tmp_path, "model", DIM)
+    second = EmbeddingStore(tmp_path, "model", DIM)
+    put_texts(first, ["a", "b"])
+    put_texts(second, ["c", "d", "a"])
+    put_texts(first, ["e"])
+    for store in [first, second, EmbeddingStore(tmp_path, "model", DIM)]:
+        assert_vectors(store, ["a", "b", "c", "d", "e"])
+    assert os.path.getsize(tmp_path / "model_4.f32") == 5 * 4 * DIM
+
+
+def _write_from_process(cache_dir, worker):
+    store = EmbeddingStore(cache_dir, "model", DIM)
+    for batch in range(20):
+        put_texts(store, [f"{worker}-{batch}-{i}" for i in range(5)] + [f"shared-{batch}"])
+
+
+def test_concurrent_processes(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_write_from_process, args=(str(tmp_path), worker)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    texts = [f"{worker}-{batch}-{i}" for worker in range(4) for batch in range(20) for i in range(5)]
+    texts += [f"shared-{batch}" for batch in range(20)]
+    store = EmbeddingStore(tmp_path, "model", DIM)
+    assert len(store) == len(texts)
+    assert_vectors(store, texts)
+
+
+def test_interrupted_write_is_ignored_and_overwritten(tmp_path):
+    store = EmbeddingStore(tmp_path, "model", DIM)
+    put_texts(store, ["a", "b"])
+    # ベクトルの途中と索引の途中で中断された書き込み
+    with open(tmp_path / "model_4.f32", "ab") as f:
+        f.write(b"\0" * 6)
+    with open(tmp_path / "model_4.idx", "ab") as f:
+        f.write(text_hash("x").encode("ascii") + b" 0000")
+
+    reopened = EmbeddingStore(tmp_path, "model", DIM)
+    assert len(reopened) == 2
+    put_texts(reopened, ["c"])
+    for current in [reopened, EmbeddingStore(tmp_path, "model", DIM)]:
+        assert len(current) == 3
+        assert_vectors(current, ["a", "b", "c"])
+    assert current.get_many({text_hash("x")}) == {}
+
+
+def test_cache_coalesces_concurrent_requests(tmp_path):
+    batches = []
+
+    async def embed(texts):
+        batches.append(list(texts))
+        return np.stack([vector_for(text) for text in texts])
+
+    cache = EmbeddingCache(embed, "model", DIM, cache_dir=tmp_path, batch_size=8, batch_wait_ms=5)
+
+    async def scenario():
+        results = await asyncio.gather(cache.embed(["a", "b"]), cache.embed(["b", "c"]), cache.embed([]))
+        again = await cache.embed(["c", "a"])
+        return results, again
+
+    (first, second, empty), again = asyncio.run(scenario())
+    assert batches == [["a", "b", "c"]]
+    np.testing.assert_array_equal(first, np.stack([vector_for("a"), vector_for("b")]))
+    np.testing.assert_array_equal(second, np.stack([vector_for("b"), vector_for("c")]))
+    np.testing.assert_array_equal(again, np.stack([vector_for("c"), vector_for("a")]))
+    assert empty.shape == (0, DIM)
+    assert cache.stats()["hits"] == 2
+
+
+def test_short_result_fails_every_waiting_call(tmp_path):
+    async def embed(texts):
+        return np.stack([vector_for(text) for text in texts[:-1]])
+
+    cache = EmbeddingCache(embed, "model", DIM, cache_dir=tmp_path, batch_wait_ms=0)
+
+    async def scenario():
+        return await asyncio.wait_for(asyncio.gather(cache.embed(["a"]), cache.embed(["b"]), return_exceptions=True), 1)
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    # 件数の合わない結果はキャッシュしない
+    assert len(cache.store) == 0 and not cache._pending
+
+
+def test_cancelled_batch_does_not_leave_callers_waiting(tmp_path):
+    started = []
+
+    async def embed(texts):
+        started.append(texts)
+        await asyncio.sleep(10)
+
+    cache = EmbeddingCache(embed, "model", DIM, cache_dir=tmp_path, batch_wait_ms=0)
+
+    async def scenario():
+        call = asyncio.ensure_future(cache.embed(["a", "b"]))
+        while not started:
+            await asyncio.sleep(0)
+        for task in cache._tasks:
+            task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(call, 1)
+    asyncio.run(scenario())
+    assert not cache._pending
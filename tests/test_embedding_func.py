@@ -0,0 +1,18 @@
+import asyncio
+from bench.mock_server import start_mock_server
+from utils import rag
+
+
+def test_remote_embedding_uses_the_configured_dimension(monkeypatch):
+    server, port = start_mock_server(port=0, dim=768)
+    try:
+        monkeypatch.setattr(rag, "API_KEY", "mock")
+        monkeypatch.setattr(rag, "BASE_URL", f"http://127.0.0.1:{port}/v1")
+        monkeypatch.setattr(rag, "EMBEDDING_DIM", 768)
+        # 切り詰め（tiktokenのエンコーディングのダウンロードが必要）は行わない
+        monkeypatch.setattr(rag, "MAX_TOKENS", 0)
+        # openai_embed自体はtext-embedding-3-small（1536次元）の検証付きで包まれている
+        vectors = asyncio.run(rag._embed_remote(["Scrooge", "Marley"]))
+    finally:
+        server.shutdown()
+    assert vectors.shape == (2, 768)
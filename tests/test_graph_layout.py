@@ -0,0 +1,56 @@
+import numpy as np
+from utils.graph_layout import LAYOUT_DENSE_ITEMS, _near_pairs, force_layout, layout_groups
+
+
+def test_near_pairs_finds_every_close_pair():
+    pos = np.random.default_rng(0).normal(size=(500, 2))
+    reach = 0.2
+    i, j = _near_pairs(pos, reach)
+    found = {(min(a, b), max(a, b)) for a, b in zip(i.tolist(), j.tolist())}
+    assert len(found) == len(i)
+    dist = np.linalg.norm(pos[:, None] - pos[None], axis=-1)
+    close = {(a, b) for a, b in zip(*np.nonzero(np.triu(dist < reach, k=1)))}
+    assert close <= found
+
+
+def test_large_group_collapses_isolated_items():
+    rng = np.random.default_rng(0)
+    n = 3000
+    # 先頭の400要素だけが辺を持ち、残りは孤立している
+    src = rng.integers(0, 400, size=1200)
+    dst = rng.integers(0, 400, size=1200)
+    keep = src != dst
+    sizes = np.ones(n)
+    (pos, radii), = layout_groups([(sizes, src[keep], dst[keep])])
+    assert pos.shape == (n, 2)
+    assert np.all(np.linalg.norm(pos, axis=1) + radii <= 1 + 1e-9)
+    assert len(np.unique(pos.round(9), axis=0)) == n
+    # 孤立した要素はまとめて1つの円に並ぶので、互いに重ならない
+    isolated = pos[400:]
+    i, j = _near_pairs(isolated, 2 * radii[400:].max())
+    dist = np.linalg.norm(isolated[i] - isolated[j], axis=1)
+    assert np.all(dist >= radii[400:][i] + radii[400:][j] - 1e-9)
+
+
+def test_small_groups_keep_the_dense_layout():
+    src = np.array([0, 1, 2])
+    dst = np.array([1, 2, 0])
+    (pos, radii), (single, single_radii) = layout_groups([(np.ones(4), src, dst), (np.ones(1), src[:0], dst[:0])])
+    assert pos.shape == (4, 2)
+    assert np.all(np.linalg.norm(pos, axis=1) + radii <= 1 + 1e-9)
+    assert single_radii.tolist() == [0.9]
+
+
+def test_force_layout_of_a_large_graph():
+    rng = np.random.default_rng(1)
+    n = LAYOUT_DENSE_ITEMS * 4
+    src = np.arange(1, n)
+    dst = rng.integers(0, src)
+    pos = force_layout(n, src, dst)
+    assert pos.shape == (n, 2)
+    assert np.all(np.isfinite(pos))
+    assert np.linalg.norm(pos, axis=1).max() <= 1 + 1e-9
+    # つながったノードは平均的な2点間より近くに置かれる
+    edge_length = np.linalg.norm(pos[src] - pos[dst], axis=1).mean()
+    random_length = np.linalg.norm(pos[rng.permutation(n)] - pos, axis=1).mean()
+    assert edge_length < random_length
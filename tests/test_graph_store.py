@@ -0,0 +1,98 @@
+import os
+import networkx as nx
+import numpy as np
+from utils.graph_store import load_graph, snapshot_dir
+
+
+def sample_graph():
+    graph = nx.Graph()
+    graph.add_node("SCROOGE", entity_type="person", description="A miser", weight=2.5, alive=True)
+    graph.add_node("MARLEY", entity_type="person", description="Scrooge's late partner")
+    graph.add_node("LONDON", entity_type="geo")
+    graph.add_node("BOB CRATCHIT", entity_type="person")
+    graph.add_node("TINY TIM", entity_type="person")
+    graph.add_edge("SCROOGE", "MARLEY", description="partners", weight=3.0)
+    graph.add_edge("SCROOGE", "LONDON", description="lives in", weight=1.0)
+    graph.add_edge("SCROOGE", "BOB CRATCHIT", description="employs", weight=2.0)
+    graph.add_edge("BOB CRATCHIT", "TINY TIM", description="father of", weight=2.0)
+    return graph
+
+
+def write(graph, tmp_path):
+    path = str(tmp_path / "graph_chunk_entity_relation.graphml")
+    nx.write_graphml(graph, path)
+    return path
+
+
+def test_snapshot_round_trip(tmp_path):
+    graph = sample_graph()
+    snapshot = load_graph(write(graph, tmp_path))
+    assert os.path.isdir(snapshot_dir(str(tmp_path / "graph_chunk_entity_relation.graphml")))
+    assert (snapshot.n_nodes, snapshot.n_edges, snapshot.directed) == (5, 4, False)
+    restored = snapshot.to_networkx()
+    assert nx.utils.graphs_equal(restored, graph)
+    assert restored.nodes["SCROOGE"] == {"entity_type": "person", "description": "A miser", "weight": 2.5, "alive": True}
+    assert "description" not in restored.nodes["LONDON"]
+
+    scrooge = snapshot.find_node("Scrooge")
+    assert snapshot.degrees()[scrooge] == 3
+    assert sorted(snapshot.node_ids()[index] for index in snapshot.neighbors(scrooge)) == ["BOB CRATCHIT", "LONDON", "MARLEY"]
+    data = snapshot.node_link_data()
+    assert len(data["nodes"]) == 5 and len(data["links"]) == 4
+
+
+def test_snapshot_is_rebuilt_when_the_graphml_changes(tmp_path):
+    graph = sample_graph()
+    path = write(graph, tmp_path)
+    first = load_graph(path)
+    assert load_graph(path) is first
+
+    graph.add_edge("MARLEY", "TINY TIM", description="haunts")
+    nx.write_graphml(graph, path)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    second = load_graph(path)
+    assert second is not first
+    assert second.n_edges == 5
+    assert second.sha256 != first.sha256
+
+
+def test_directed_snapshot(tmp_path):
+    graph = nx.DiGraph([("A", "B"), ("B", "C")])
+    snapshot = load_graph(write(graph, tmp_path))
+    assert snapshot.directed
+    assert [snapshot.node_ids()[index] for index in snapshot.neighbors(snapshot.node_index("B"))] == ["C"]
+    assert np.array_equal(snapshot.degrees(), [1, 1, 0])
+
+
+def names(snapshot, indices):
+    return [snapshot.node_ids()[index] for index in indices]
+
+
+def test_k_hop_is_breadth_first_from_the_seeds(tmp_path):
+    snapshot = load_graph(write(sample_graph(), tmp_path))
+    tim = snapshot.node_index("TINY TIM")
+    assert names(snapshot, snapshot.k_hop([tim], 0)) == ["TINY TIM"]
+    assert names(snapshot, snapshot.k_hop([tim], 1)) == ["TINY TIM", "BOB CRATCHIT"]
+    two_hops = names(snapshot, snapshot.k_hop([tim], 2))
+    assert two_hops == ["TINY TIM", "BOB CRATCHIT", "SCROOGE"]
+    assert set(names(snapshot, snapshot.k_hop([tim], 3))) == set(sample_graph().nodes)
+    # 複数の起点（重複は1つにまとめる）とノード数の上限
+    seeds = [tim, snapshot.node_index("LONDON"), tim]
+    assert names(snapshot, snapshot.k_hop(seeds, 1))[:2] == ["TINY TIM", "LONDON"]
+    assert len(snapshot.k_hop(seeds, 3, max_nodes=3)) == 3
+
+
+def test_k_hop_follows_outgoing_edges_of_directed_graphs(tmp_path):
+    snapshot = load_graph(write(nx.DiGraph([("A", "B"), ("B", "C"), ("D", "A")]), tmp_path))
+    assert names(snapshot, snapshot.k_hop([snapshot.node_index("A")], 5)) == ["A", "B", "C"]
+
+
+def test_subgraph_edges(tmp_path):
+    snapshot = load_graph(write(sample_graph(), tmp_path))
+    nodes = [snapshot.node_index(name) for name in ["SCROOGE", "BOB CRATCHIT", "TINY TIM"]]
+    edges = snapshot.subgraph_edges(nodes)
+    pairs = {frozenset(names(snapshot, [snapshot.edge_src[edge], snapshot.edge_dst[edge]])) for edge in edges}
+    assert pairs == {frozenset(["SCROOGE", "BOB CRATCHIT"]), frozenset(["BOB CRATCHIT", "TINY TIM"])}
+    data = snapshot.node_link_data(nodes)
+    assert len(data["nodes"]) == 3 and len(data["links"]) == 2
@@ -0,0 +1,82 @@
+import asyncio
+from utils import config
+from utils.config import RagConfig, hot_dataset_configs
+from utils.rag_pool import RagPool
+
+
+class FakeRag:
+    def __init__(self, key):
+        self.key = key
+        self.finalized = False
+
+    async def finalize_storages(self):
+        self.finalized = True
+
+
+def make_pool(fail=(), **kwargs):
+    async def factory(*key):
+        if key[0] in fail:
+            raise RuntimeError("broken index")
+        return FakeRag(key), None
+    return RagPool(factory, **kwargs)
+
+
+def key(tmp_path, name):
+    return (str(tmp_path / name), "English", "NetworkXStorage", "NanoVectorDBStorage")
+
+
+def test_hot_dataset_configs(monkeypatch):
+    monkeypatch.setattr(config, "RAG_HOT_DATASETS", " dickens:English, tenant1 ,,")
+    assert hot_dataset_configs("Japanese") == [
+        RagConfig("dickens", "English", config.get_graph_storage(), config.get_vector_storage()),
+        RagConfig("tenant1", "Japanese", config.get_graph_storage(), config.get_vector_storage()),
+    ]
+
+
+def test_hot_datasets_survive_idle_expiry(tmp_path):
+    pool = make_pool(idle_seconds=0)
+    hot, cold = key(tmp_path, "hot"), key(tmp_path, "cold")
+
+    async def scenario():
+        await pool.preload([hot])
+        async with pool.borrow(*cold):
+            pass
+        await asyncio.sleep(0.01)
+        await pool._evict()
+    asyncio.run(scenario())
+    assert [(entry["working_dir"], entry["hot"]) for entry in pool.stats()["entries"]] == [(hot[0], True)]
+
+
+def test_hot_datasets_are_evicted_for_memory_last(tmp_path):
+    pool = make_pool()
+    hot, cold = key(tmp_path, "hot"), key(tmp_path, "cold")
+    for name in ("hot", "cold"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "vdb_chunks.json").write_bytes(b"x" * 1024)
+
+    async def scenario():
+        await pool.preload([hot])
+        async with pool.borrow(*cold):
+            pass
+        # 最後に使ったのはcoldだが、ホットデータセットを残してcoldを破棄する
+        pool._memory_budget = 1024
+        await pool._evict()
+    asyncio.run(scenario())
+    assert [entry["working_dir"] for entry in pool.stats()["entries"]] == [hot[0]]
+
+
+def test_stats_list_warm_datasets_most_recent_first(tmp_path):
+    pool = make_pool(fail={str(tmp_path / "broken")})
+    first, second, broken = key(tmp_path, "first"), key(tmp_path, "second"), key(tmp_path, "broken")
+
+    async def scenario():
+        await pool.preload([first, broken, second])
+        async with pool.borrow(*first):
+            pass
+    asyncio.run(scenario())
+    stats = pool.stats()
+    assert [entry["working_dir"] for entry in stats["entries"]] == [first[0], second[0]]
+    assert all(entry["hot"] and entry["load_seconds"] >= 0 for entry in stats["entries"])
+    # 読み込みに失敗したデータセットはホット扱いにしない
+    assert broken not in pool._pinned
+    assert "memory_used_mb" in stats
@@ -0,0 +1,73 @@
+from lightrag.utils import compute_mdhash_id, sanitize_text_for_encoding
+from utils.index_manifest import (
+    PARAGRAPH_SEPARATOR,
+    whole_file_doc_id,
+    iter_paragraphs,
+    iter_segments,
+    segment_paragraphs,
+)
+
+
+def test_whole_file_doc_id_matches_ainsert(tmp_path):
+    text = "Scrooge &amp; Marley\n\nA Christmas Carol.\n"
+    path = tmp_path / "dickens.txt"
+    path.write_text(text, encoding="utf-8")
+    # ainsertは整形（前後の空白の除去など）した後のテキストからIDを計算する
+    assert whole_file_doc_id(path) == compute_mdhash_id(sanitize_text_for_encoding(text), prefix="doc-")
+    assert whole_file_doc_id(path) != compute_mdhash_id(text, prefix="doc-")
+
+
+def test_whole_file_doc_id_is_computed_in_windows(tmp_path):
+    text = (
+        "\n \t  Scrooge &amp; Marley &#x41;&#66 &not;it &lt;&gt;\x01\x7f\r\n"
+        + "Bob  \x0b Cratchit\u3000 " * 40
+        + "&CounterClockwiseContourIntegral; &amp\n\n\u3000 \n"
+    )
+    path = tmp_path / "dickens.txt"
+    path.write_bytes(text.encode("utf-8"))
+    with open(path, encoding="utf-8") as f:
+        expected = compute_mdhash_id(sanitize_text_for_encoding(f.read()), prefix="doc-")
+    # 窓の境界がHTMLエスケープや前後の空白の途中にあっても、ファイル全体を整形した場合と同じID
+    for window_chars in [1, 2, 3, 5, 8, 13, 1024]:
+        assert whole_file_doc_id(path, window_chars) == expected
+    (tmp_path / "blank.txt").write_text(" \n\n ", encoding="utf-8")
+    assert whole_file_doc_id(tmp_path / "blank.txt", 2) == compute_mdhash_id("", prefix="doc-")
+
+
+def write_paragraphs(path, paragraphs):
+    path.write_text("\n\n".join(paragraphs) + "\n", encoding="utf-8")
+
+
+def test_iter_paragraphs_matches_whole_file_split(tmp_path):
+    path = tmp_path / "book.txt"
+    write_paragraphs(path, [f"段落{i}の本文です。" * (i % 7 + 1) for i in range(200)])
+    text = path.read_text(encoding="utf-8")
+    # 窓の境界が段落やマルチバイト文字の途中にあっても結果は変わらない
+    for window_bytes in [7, 64, 1000, 1024 * 1024]:
+        assert list(iter_paragraphs(path, window_bytes)) == PARAGRAPH_SEPARATOR.split(text)
+
+
+def test_segments_only_change_around_an_edit(tmp_path):
+    paragraphs = [f"Paragraph {i} about Scrooge and Marley." for i in range(300)]
+    before = tmp_path / "before.txt"
+    after = tmp_path / "after.txt"
+    write_paragraphs(before, paragraphs)
+    write_paragraphs(after, paragraphs[:150] + ["An inserted paragraph."] + paragraphs[150:] + ["An appended paragraph."])
+
+    old_segments = list(iter_segments(before))
+    new_segments = list(iter_segments(after))
+    assert len(old_segments) > 10
+    assert set(old_segments) - set(new_segments)
+    # 挿入・追記した段落を含むセグメント以外は同じ内容（同じドキュメントID）のまま
+    assert len(set(old_segments) - set(new_segments)) <= 2
+    assert len(set(new_segments) - set(old_segments)) <= 2
+
+
+def test_segments_are_capped_by_max_chars():
+    paragraphs = ["x" * 100 + str(i) for i in range(50)]
+    for segment in segment_paragraphs(paragraphs, max_chars=300, boundary=10 ** 9):
+        assert len(segment.split("\n\n")) <= 3
+
+
+def test_blank_paragraphs_are_skipped():
+    assert list(segment_paragraphs(["a", "  ", "", "b"], boundary=10 ** 9)) == ["a\n\nb"]
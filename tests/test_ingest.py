@@ -0,0 +1,94 @@
+import asyncio
+from utils import ingest
+from utils.index_manifest import load_manifest, whole_file_doc_id
+
+
+class FakeDocStatus:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def is_empty(self):
+        return not self.docs
+
+    async def get_by_id(self, doc_id):
+        return self.docs.get(doc_id)
+
+
+class FakeRag:
+    def __init__(self, docs=()):
+        self.docs = dict.fromkeys(docs, {"status": "processed"})
+        self.doc_status = FakeDocStatus(self.docs)
+
+    async def ainsert(self, segments, ids, file_paths):
+        self.docs.update(dict.fromkeys(ids, {"status": "processed"}))
+
+    async def adelete_by_doc_id(self, doc_id):
+        del self.docs[doc_id]
+
+
+def sync(rag, tmp_path, paths):
+    working_dir = str(tmp_path / "index")
+    manifest = load_manifest(working_dir)
+    summary = asyncio.run(ingest.sync_text_files(rag, working_dir, [str(path) for path in paths], manifest))
+    return summary, load_manifest(working_dir)
+
+
+def write_books(tmp_path):
+    paths = []
+    for name in ("carol", "chimes"):
+        path = tmp_path / f"{name}.txt"
+        path.write_text("\n\n".join(f"{name} paragraph {i}" for i in range(20)), encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+def test_first_ingest_does_not_read_whole_files(monkeypatch, tmp_path):
+    def whole_file(path):
+        raise AssertionError("whole-file id computed for a new index")
+
+    monkeypatch.setattr(ingest, "whole_file_doc_id", whole_file)
+    rag = FakeRag()
+    summary, manifest = sync(rag, tmp_path, write_books(tmp_path))
+    assert summary["added"] == len(rag.docs) > 2
+    assert manifest["legacy_index"] is False
+    # 2回目以降に追加したファイルも旧IDを確認しない
+    extra = tmp_path / "bells.txt"
+    extra.write_text("A new book.", encoding="utf-8")
+    summary, _ = sync(rag, tmp_path, write_books(tmp_path) + [extra])
+    assert summary["added"] == 1
+
+
+def test_pre_manifest_documents_are_replaced(tmp_path):
+    paths = write_books(tmp_path)
+    legacy_ids = [whole_file_doc_id(path) for path in paths]
+    rag = FakeRag(legacy_ids)
+    summary, manifest = sync(rag, tmp_path, paths)
+    assert summary["removed"] == 2
+    assert not set(legacy_ids) & rag.docs.keys()
+    assert manifest["legacy_index"] is False
+
+
+def test_interrupted_first_run_still_replaces_the_remaining_files(monkeypatch, tmp_path):
+    paths = write_books(tmp_path)
+    legacy_ids = [whole_file_doc_id(path) for path in paths]
+    rag = FakeRag(legacy_ids)
+    insert = rag.ainsert
+
+    async def fail_on_second_file(segments, ids, file_paths):
+        if file_paths[0] == str(paths[1]):
+            raise RuntimeError("interrupted")
+        await insert(segments, ids, file_paths)
+
+    monkeypatch.setattr(rag, "ainsert", fail_on_second_file)
+    try:
+        sync(rag, tmp_path, paths)
+    except RuntimeError:
+        pass
+    assert load_manifest(str(tmp_path / "index"))["legacy_index"] is True
+
+    monkeypatch.setattr(rag, "ainsert", insert)
+    summary, manifest = sync(rag, tmp_path, paths)
+    # 中断前に置き換えたファイルの旧ドキュメントも削除する
+    assert not set(legacy_ids) & rag.docs.keys()
+    assert summary["removed"] == 2
+    assert manifest["stale_doc_ids"] == []
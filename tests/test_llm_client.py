@@ -0,0 +1,129 @@
+import asyncio
+import pytest
+from utils import llm_client as llm_client_module
+from utils.llm_client import SharedLLMClient, RateLimiter, estimate_tokens
+
+
+class Clock:
+    """Fake monotonic clock; sleeping advances it instead of waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_client_module.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(llm_client_module.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+async def measure_concurrency(client, calls):
+    running = []
+    peak = []
+
+    async def request():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        return "ok"
+
+    results = await asyncio.wait_for(asyncio.gather(*[client.call(request) for _ in range(calls)]), 5)
+    return results, max(peak)
+
+
+def test_call_limits_concurrency_and_releases_the_slot():
+    client = SharedLLMClient(max_concurrency=2)
+
+    async def scenario():
+        results, peak = await measure_concurrency(client, 6)
+        return results, peak, client._state()["semaphore"]._value
+    results, peak, free = asyncio.run(scenario())
+    assert results == ["ok"] * 6
+    assert peak == 2
+    assert free == 2
+    assert client.stats()["requests"] == 6
+
+
+@pytest.mark.parametrize("max_concurrency", [0, -1])
+def test_non_positive_concurrency_is_unlimited(max_concurrency):
+    client = SharedLLMClient(max_concurrency=max_concurrency)
+    _, peak = asyncio.run(measure_concurrency(client, 6))
+    assert peak == 6
+
+
+def test_failed_call_releases_the_slot():
+    client = SharedLLMClient(max_concurrency=1)
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await client.call(fail)
+        return await asyncio.wait_for(client.call(lambda: asyncio.sleep(0, "ok")), 1)
+    assert asyncio.run(scenario()) == "ok"
+
+
+def test_stream_holds_the_slot_until_exhausted():
+    client = SharedLLMClient(max_concurrency=1)
+
+    async def stream():
+        async def chunks():
+            for chunk in ["a", "b"]:
+                yield chunk
+        return chunks()
+
+    async def scenario():
+        iterator = await client.call(stream)
+        semaphore = client._state()["semaphore"]
+        held = semaphore.locked()
+        chunks = [chunk async for chunk in iterator]
+        return held, chunks, semaphore.locked()
+    held, chunks, locked_after = asyncio.run(scenario())
+    assert held
+    assert chunks == ["a", "b"]
+    assert not locked_after
+
+
+def test_rate_limiter_refills_per_minute(clock):
+    limiter = RateLimiter(60)
+
+    async def scenario():
+        for _ in range(60):
+            await limiter.acquire()
+        assert clock.slept == []
+        # バケットが空なので1件分（1秒）補充されるまで待つ
+        await limiter.acquire()
+        assert clock.slept == [pytest.approx(1.0)]
+        clock.now += 30
+        await limiter.acquire(30)
+        assert len(clock.slept) == 1
+    asyncio.run(scenario())
+
+
+def test_rate_limiter_caps_large_requests_and_can_be_disabled(clock):
+    async def scenario():
+        limiter = RateLimiter(10)
+        # 上限を超える量は上限として扱う（永久に待たない）
+        await limiter.acquire(100)
+        assert limiter.tokens == 0
+        for per_minute in (0, -5):
+            await RateLimiter(per_minute).acquire(1000)
+    asyncio.run(scenario())
+    assert clock.slept == []
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("abcd", None, "ef") == 3
+    assert estimate_tokens() == 1
@@ -0,0 +1,60 @@
+import json
+import asyncio
+from utils import mode_router
+from utils.mode_router import EntityMatcher, route
+
+
+def matcher():
+    return EntityMatcher(["SCROOGE", "Bob Cratchit", "Bob", "スクルージ", "マーレイ", "THE", "UK", "Tim"])
+
+
+def test_entity_matcher():
+    names = matcher()
+    # 短すぎる名前とストップワードは使わない
+    assert len(names) == 6
+    assert names.find("Who is scrooge?") == ["SCROOGE"]
+    # 長い名前を優先し、同じ名前は一度だけ返す
+    assert names.find("What does Bob Cratchit do? Bob Cratchit works.") == ["Bob Cratchit"]
+    assert names.find("Bob and Scrooge") == ["Bob", "SCROOGE"]
+    # 英数字の名前は単語の途中では一致させない
+    assert names.find("Scrooged and Bobby Timothy") == []
+    assert names.find("スクルージとマーレイの関係は？") == ["スクルージ", "マーレイ"]
+
+
+def test_route():
+    names = matcher()
+    assert route("What are the main themes of the story?", names).mode == "global"
+    assert route("スクルージについて全体をまとめて", names).mode == "hybrid"
+    assert route("Who is Scrooge?", names).mode == "local"
+    assert route("What is the relationship between Scrooge and Bob?", names).reason == "relationship between entities"
+    assert route("スクルージとマーレイ", names).reason == "relationship between entities"
+    assert route("How are the ghosts connected?", names).mode == "local"
+    decision = route("What happens on Christmas morning?", names)
+    assert (decision.mode, decision.entities, decision.cues) == ("naive", [], [])
+    assert route("Who is Scrooge?").mode == "naive"
+
+
+def test_entity_matcher_is_rebuilt_for_a_new_index_version():
+    loads = []
+
+    async def load_names():
+        loads.append(1)
+        return ["SCROOGE"] if len(loads) == 1 else ["SCROOGE", "MARLEY"]
+
+    async def scenario():
+        first = await mode_router.entity_matcher(("dickens",), "1", load_names)
+        again = await mode_router.entity_matcher(("dickens",), "1", load_names)
+        updated = await mode_router.entity_matcher(("dickens",), "2", load_names)
+        return first, again, updated
+
+    first, again, updated = asyncio.run(scenario())
+    assert first is again and len(loads) == 2
+    assert updated.find("Marley and Scrooge") == ["MARLEY", "SCROOGE"]
+
+
+def test_log_decision(tmp_path, monkeypatch):
+    log_file = tmp_path / "router.jsonl"
+    monkeypatch.setattr(mode_router, "ROUTER_LOG_FILE", str(log_file))
+    mode_router.log_decision("dickens", "Who is Scrooge?", route("Who is Scrooge?", matcher()), trace_id="abc")
+    line = json.loads(log_file.read_text(encoding="utf-8"))
+    assert (line["dataset"], line["mode"], line["entities"], line["trace_id"]) == ("dickens", "local", ["SCROOGE"], "abc")
@@ -0,0 +1,65 @@
+import pytest
+from utils import neo4j_driver
+
+
+class FakeDriver:
+    def __init__(self):
+        self.verifications = 0
+        self.fail = False
+        self.closed = False
+        # 接続確認のTTLを進めるための時計
+        self.now = 100.0
+
+    def verify_connectivity(self):
+        self.verifications += 1
+        if self.fail:
+            raise ConnectionError("unreachable")
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def driver(monkeypatch):
+    driver = FakeDriver()
+    monkeypatch.setattr(neo4j_driver.GraphDatabase, "driver", lambda *args, **kwargs: driver)
+    monkeypatch.setattr(neo4j_driver.time, "monotonic", lambda: driver.now)
+    monkeypatch.setattr(neo4j_driver, "NEO4J_VERIFY_TTL", 60)
+    monkeypatch.setattr(neo4j_driver, "_metrics", dict(neo4j_driver._metrics, verifications=0, verification_cache_hits=0))
+    neo4j_driver.close_driver()
+    yield driver
+    neo4j_driver.close_driver()
+
+
+def test_verification_is_cached_until_the_ttl_expires(driver):
+    neo4j_driver.verify_connectivity()
+    neo4j_driver.verify_connectivity()
+    driver.now += 59
+    neo4j_driver.verify_connectivity()
+    assert driver.verifications == 1
+    assert neo4j_driver.health()["verification_cache_hits"] == 2
+
+    driver.now += 1
+    neo4j_driver.verify_connectivity()
+    assert driver.verifications == 2
+    neo4j_driver.verify_connectivity(force=True)
+    assert driver.verifications == 3
+    assert neo4j_driver.health()["verified"]
+
+
+def test_failures_are_not_cached(driver):
+    neo4j_driver.verify_connectivity()
+    driver.fail = True
+    with pytest.raises(ConnectionError):
+        neo4j_driver.verify_connectivity(force=True)
+    assert not neo4j_driver.health()["verified"]
+    with pytest.raises(ConnectionError):
+        neo4j_driver.verify_connectivity()
+    assert driver.verifications == 3
+
+
+def test_the_driver_is_shared_until_closed(driver):
+    assert neo4j_driver.get_driver() is neo4j_driver.get_driver() is driver
+    neo4j_driver.close_driver()
+    assert driver.closed
+    assert not neo4j_driver.health()["driver_open"]
@@ -0,0 +1,88 @@
+import asyncio
+from utils import rag
+
+KEYWORDS = {"hl_keywords": ["miser"], "ll_keywords": ["SCROOGE"]}
+
+
+class Branches:
+    """Fake text and multimodal branches that only finish once both have started."""
+
+    def __init__(self, text_delay=0.0, multimodal_delay=0.0, text_error=None):
+        self.started = {"text": asyncio.Event(), "multimodal": asyncio.Event()}
+        self.text_delay = text_delay
+        self.multimodal_delay = multimodal_delay
+        self.text_error = text_error
+        self.calls = {}
+
+    async def _run(self, name, other, delay, kwargs):
+        self.calls[name] = kwargs
+        self.started[name].set()
+        # 順番に実行されていると相手の枝が始まらずにタイムアウトする
+        await asyncio.wait_for(self.started[other].wait(), 1)
+        await asyncio.sleep(delay)
+
+    async def aquery_llm(self, query, param):
+        await self._run("text", "multimodal", self.text_delay, {"hl_keywords": param.hl_keywords, "ll_keywords": param.ll_keywords})
+        if self.text_error:
+            raise self.text_error
+        return {
+            "data": {"entities": [{"entity_name": "SCROOGE"}, {"entity_name": ""}]},
+            "llm_response": {"content": f"text answer to {query}"},
+        }
+
+    async def multimodal_aquery(self, query, mode, vlm_enhanced, **kwargs):
+        await self._run("multimodal", "text", self.multimodal_delay, kwargs)
+        return f"multimodal answer to {query}"
+
+
+class FakeRagAnything:
+    def __init__(self, branches):
+        self.branches = branches
+
+    async def aquery(self, query, mode, vlm_enhanced, **kwargs):
+        return await self.branches.multimodal_aquery(query, mode, vlm_enhanced, **kwargs)
+
+
+def query_both(monkeypatch, branches, timeout=5):
+    async def shared_keywords(rag_instance, query, mode):
+        return KEYWORDS
+
+    monkeypatch.setattr(rag, "_shared_keywords", shared_keywords)
+    monkeypatch.setattr(rag, "QUERY_TIMEOUT", timeout)
+
+    async def scenario():
+        return await rag._query_both(branches, FakeRagAnything(branches), "Who is Scrooge?", "hybrid")
+    return asyncio.run(scenario())
+
+
+def test_branches_run_concurrently_with_shared_keywords(monkeypatch):
+    branches = Branches()
+    msg, msg_multimodal, entities, cacheable = query_both(monkeypatch, branches)
+    assert msg == "text answer to Who is Scrooge?"
+    assert msg_multimodal == "multimodal answer to Who is Scrooge?"
+    assert entities == ["SCROOGE"]
+    assert cacheable
+    assert branches.calls["text"] == KEYWORDS
+    assert branches.calls["multimodal"] == KEYWORDS
+
+
+def test_timed_out_branch_keeps_the_other_answer(monkeypatch):
+    branches = Branches(multimodal_delay=1)
+    msg, msg_multimodal, entities, cacheable = query_both(monkeypatch, branches, timeout=0.2)
+    assert msg == "text answer to Who is Scrooge?"
+    assert entities == ["SCROOGE"]
+    assert msg_multimodal == "Multimodal search timed out after 0 seconds."
+    assert not cacheable
+
+
+def test_failed_branch_is_reported_inline(monkeypatch):
+    branches = Branches(text_error=RuntimeError("boom"))
+    msg, msg_multimodal, entities, cacheable = query_both(monkeypatch, branches)
+    assert msg == "Text Only search failed: boom"
+    assert entities == []
+    assert msg_multimodal == "multimodal answer to Who is Scrooge?"
+    assert not cacheable
+
+
+def test_naive_mode_skips_keyword_extraction():
+    assert asyncio.run(rag._shared_keywords(None, "Who is Scrooge?", "naive")) == {}
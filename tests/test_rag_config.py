@@ -0,0 +1,37 @@
+import os
+import sys
+import asyncio
+import subprocess
+import pytest
+from utils import rag
+from utils.config import ModalType, RagConfig
+
+
+def test_rag_module_does_not_need_streamlit_or_raganything():
+    code = "import sys, utils.rag; print(sorted(name for name in ('streamlit', 'raganything') if name in sys.modules))"
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
+
+
+def test_rag_config_selects_storages(monkeypatch):
+    monkeypatch.delenv("NEO4J_URI", raising=False)
+    monkeypatch.delenv("VECTOR_STORAGE", raising=False)
+    assert RagConfig("./dickens").pool_key == ("./dickens", "Japanese", "NetworkXStorage", "NanoVectorDBStorage")
+    monkeypatch.setenv("NEO4J_URI", "neo4j://localhost:7687")
+    monkeypatch.setenv("VECTOR_STORAGE", "AnnVectorDBStorage")
+    assert RagConfig("./dickens", "English").pool_key == ("./dickens", "English", "Neo4JStorage", "AnnVectorDBStorage")
+
+
+def test_search_validates_the_modal():
+    config = RagConfig("./dickens", graph_storage="NetworkXStorage", vector_storage="NanoVectorDBStorage")
+    with pytest.raises(ValueError, match="No image"):
+        asyncio.run(rag.search(config, "hybrid", "Who is Scrooge?", ModalType.MULTIMODAL_INPUT))
+    with pytest.raises(ValueError, match="Invalid modal"):
+        asyncio.run(rag.search(config, "hybrid", "Who is Scrooge?", "Text Only"))
+
+
+def test_make_index_raises_for_a_missing_dataset(tmp_path):
+    config = RagConfig(str(tmp_path / "dickens"), graph_storage="NetworkXStorage", vector_storage="NanoVectorDBStorage")
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(rag.make_index(config, "dickens", data_dir=str(tmp_path)))
@@ -0,0 +1,75 @@
+import asyncio
+from utils.rag_pool import RagPool
+
+
+class FakeRag:
+    def __init__(self, key):
+        self.key = key
+        self.finalized = False
+
+    async def finalize_storages(self):
+        self.finalized = True
+
+
+def make_pool(**kwargs):
+    async def factory(*key):
+        return FakeRag(key), None
+    return RagPool(factory, **kwargs)
+
+
+def test_invalidate_defers_finalize_of_busy_entries(tmp_path):
+    pool = make_pool()
+    key = (str(tmp_path), "Japanese", "NetworkXStorage", "NanoVectorDBStorage")
+
+    async def scenario():
+        async with pool.borrow(*key) as (busy, _):
+            await pool.invalidate(str(tmp_path))
+            assert not busy.finalized
+            # 無効化の後の借用では新しいインスタンスが作られる
+            async with pool.borrow(*key) as (fresh, _):
+                assert fresh is not busy
+        assert busy.finalized
+        assert not fresh.finalized
+        return fresh
+
+    fresh = asyncio.run(scenario())
+    assert pool.stats()["entries"][0]["in_use"] == 0
+    asyncio.run(pool.invalidate(str(tmp_path)))
+    assert fresh.finalized
+    assert pool.stats()["entries"] == []
+
+
+def test_finalize_drops_key_lock(tmp_path):
+    pool = make_pool(idle_seconds=0)
+    keys = [(str(tmp_path / str(i)), "Japanese", "NetworkXStorage", "NanoVectorDBStorage") for i in range(5)]
+
+    async def scenario():
+        for key in keys:
+            async with pool.borrow(*key):
+                pass
+        await asyncio.sleep(0.01)
+        await pool._evict()
+
+    asyncio.run(scenario())
+    assert pool._entries == {}
+    assert pool._key_locks == {}
+
+
+def test_memory_eviction_keeps_hot_entries(tmp_path):
+    pool = make_pool()
+    hot = (str(tmp_path / "hot"), "Japanese", "NetworkXStorage", "NanoVectorDBStorage")
+    cold = (str(tmp_path / "cold"), "Japanese", "NetworkXStorage", "NanoVectorDBStorage")
+    for key in [hot, cold]:
+        (tmp_path / key[0]).mkdir()
+        (tmp_path / key[0] / "graph.graphml").write_text("x" * 600_000)
+
+    async def scenario():
+        await pool.preload([hot])
+        async with pool.borrow(*cold):
+            pass
+        pool._memory_budget = 1024 * 1024
+        await pool._evict()
+
+    asyncio.run(scenario())
+    # 予算に収まるまで破棄するとき、ホットデータセットは最近使われていなくても後回しになる
+    assert [entry["working_dir"] for entry in pool.stats()["entries"]] == [hot[0]]
@@ -0,0 +1,49 @@
+import asyncio
+import httpx
+import pytest
+from openai import RateLimitError
+from utils import rag
+from utils.llm_client import llm_client
+
+
+def rate_limit_error():
+    response = httpx.Response(429, request=httpx.Request("POST", "http://localhost/chat/completions"))
+    return RateLimitError("rate limited", response=response, body=None)
+
+
+def test_complete_retries_rate_limits_without_holding_a_slot(monkeypatch):
+    calls = []
+    free_slots = []
+
+    async def complete_once(model, prompt, **kwargs):
+        calls.append(prompt)
+        if len(calls) < 3:
+            raise rate_limit_error()
+        return "answer"
+
+    async def sleep(delay):
+        free_slots.append(llm_client._state()["semaphore"]._value)
+
+    monkeypatch.setattr(rag, "_complete_once", complete_once)
+    monkeypatch.setattr(rag, "_rate_limit_delay", lambda error, attempt: 0)
+    monkeypatch.setattr(rag.asyncio, "sleep", sleep)
+
+    assert asyncio.run(rag.complete("question")) == "answer"
+    assert len(calls) == 3
+    # バックオフの待機中は同時実行数の枠を返している
+    assert free_slots == [llm_client.max_concurrency] * 2
+
+
+def test_complete_gives_up_after_max_retries(monkeypatch):
+    async def complete_once(model, prompt, **kwargs):
+        raise rate_limit_error()
+
+    async def sleep(delay):
+        pass
+
+    monkeypatch.setattr(rag, "_complete_once", complete_once)
+    monkeypatch.setattr(rag, "_rate_limit_delay", lambda error, attempt: 0)
+    monkeypatch.setattr(rag.asyncio, "sleep", sleep)
+
+    with pytest.raises(RateLimitError):
+        asyncio.run(rag.complete("question"))
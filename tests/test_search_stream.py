@@ -0,0 +1,102 @@
+import asyncio
+import pytest
+from utils import rag
+from utils.config import ModalType, RagConfig
+from utils.rag_pool import RagPool
+from utils.answer_cache import AnswerCache
+
+CHUNKS = ["Scrooge ", "is ", "a miser."]
+
+
+class FakeRag:
+    def __init__(self):
+        self.queries = []
+
+    async def aquery_llm(self, query, param):
+        self.queries.append((query, param.mode, param.stream))
+
+        async def chunks():
+            for chunk in CHUNKS:
+                await asyncio.sleep(0)
+                yield chunk
+        if param.stream:
+            llm_response = {"is_streaming": True, "response_iterator": chunks()}
+        else:
+            llm_response = {"content": "".join(CHUNKS)}
+        return {"data": {"entities": [{"entity_name": "SCROOGE"}]}, "llm_response": llm_response}
+
+    async def finalize_storages(self):
+        pass
+
+
+class FakeRagAnything:
+    async def aquery(self, query, mode, vlm_enhanced):
+        return f"multimodal answer to {query}"
+
+
+@pytest.fixture
+def pool(monkeypatch, tmp_path):
+    instances = []
+
+    async def factory(working_dir, language, graph_storage, vector_storage):
+        instances.append(FakeRag())
+        return instances[-1], FakeRagAnything()
+
+    pool = RagPool(factory)
+    monkeypatch.setattr(rag, "rag_pool", pool)
+    monkeypatch.setattr(rag, "answer_cache", AnswerCache(path=str(tmp_path / "answers.sqlite"), similarity=0))
+    pool.instances = instances
+    yield pool
+    pool.close()
+
+
+def collect(tmp_path, modal=ModalType.TEXT_ONLY, retrieval=None):
+    config = RagConfig(str(tmp_path), "English", "NetworkXStorage", "NanoVectorDBStorage")
+
+    async def scenario():
+        stream = await rag.search(config, "hybrid", "Who is Scrooge?", modal, stream=True, retrieval=retrieval)
+        return [chunk async for chunk in stream]
+    return asyncio.run(scenario())
+
+
+def test_text_answer_is_streamed_then_cached(pool, tmp_path):
+    retrieval = {}
+    assert collect(tmp_path, retrieval=retrieval) == CHUNKS
+    assert pool.instances[0].queries == [("Who is Scrooge?", "hybrid", True)]
+    assert retrieval["entities"] == ["SCROOGE"]
+    # 2回目はキャッシュした回答全体を1つのチャンクで返す
+    retrieval = {}
+    assert collect(tmp_path, retrieval=retrieval) == ["".join(CHUNKS)]
+    assert len(pool.instances[0].queries) == 1
+    assert retrieval["entities"] == ["SCROOGE"]
+
+
+def test_multimodal_answer_is_a_single_chunk(pool, tmp_path):
+    assert collect(tmp_path, ModalType.MULTIMODAL) == ["multimodal answer to Who is Scrooge?"]
+
+
+def test_stream_runs_on_the_pool_loop_and_closes_early(pool):
+    loops = []
+    closed = []
+
+    async def numbers():
+        try:
+            for number in range(10):
+                loops.append(asyncio.get_running_loop())
+                yield number
+        finally:
+            closed.append(asyncio.get_running_loop())
+
+    async def scenario():
+        received = []
+        async for number in pool.stream(numbers()):
+            received.append(number)
+            if number == 2:
+                break
+        return received, asyncio.get_running_loop()
+
+    received, caller_loop = asyncio.run(scenario())
+    assert received == [0, 1, 2]
+    assert all(loop is pool._loop for loop in loops + closed)
+    assert caller_loop is not pool._loop
+    assert len(closed) == 1
@@ -0,0 +1,89 @@
+import json
+import asyncio
+import pytest
+from utils import tracing, rag
+from utils.tracing import Trace
+
+
+def test_spans_nest_under_the_current_span():
+    trace = Trace()
+    with tracing.record("nesting", trace, dataset="dickens"):
+        with tracing.span("query"):
+            with tracing.span("vector_retrieval", top_k=5) as inner:
+                inner.add_usage({"prompt_tokens": 3})
+            with tracing.span("llm"):
+                pass
+        with pytest.raises(ValueError):
+            with tracing.span("graph"):
+                raise ValueError("broken")
+    assert tracing.start_span("outside") is None
+    with tracing.span("outside") as outside:
+        assert outside is None
+
+    spans = {span["name"]: span for span in trace.to_dict()["spans"]}
+    assert spans["vector_retrieval"]["parent"] == "query"
+    assert spans["vector_retrieval"]["top_k"] == 5
+    assert spans["llm"]["parent"] == "query"
+    assert spans["query"]["parent"] == "nesting"
+    assert spans["graph"]["error"] == "ValueError: broken"
+    stages = {row["stage"]: row for row in trace.stage_rows()}
+    assert stages["query"]["self_ms"] <= stages["query"]["total_ms"]
+    assert stages["vector_retrieval"]["prompt_tokens"] == 3
+    assert trace.to_dict()["attributes"] == {"dataset": "dickens"}
+    assert trace.duration_ms >= stages["query"]["total_ms"]
+
+
+def test_export_appends_the_trace_to_the_file(monkeypatch, tmp_path):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(path))
+    for _ in range(2):
+        with tracing.record("exported") as trace:
+            with tracing.span("llm"):
+                pass
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert len(lines) == 2
+    assert lines[1]["trace_id"] == trace.trace_id
+    assert [span["name"] for span in lines[1]["spans"]] == ["llm"]
+
+
+def test_openmetrics_renders_histograms_and_token_counters():
+    with tracing.record("metrics"):
+        with tracing.span("llm") as span:
+            span.add_usage({"prompt_tokens": 10, "completion_tokens": 4, "total_tokens": 14})
+    text = tracing.openmetrics()
+    lines = text.splitlines()
+    assert lines[0] == "# TYPE graphrag_stage_seconds histogram"
+    assert lines[-1] == "# EOF" and text.endswith("\n")
+    buckets = [line for line in lines if line.startswith('graphrag_stage_seconds_bucket{operation="metrics",stage="llm"')]
+    assert len(buckets) == len(tracing.LATENCY_BUCKETS) + 1
+    assert buckets[-1].endswith('le="+Inf"} 1')
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts)
+    assert 'graphrag_stage_seconds_count{operation="metrics",stage="metrics"} 1' in lines
+    assert 'graphrag_tokens_total{operation="metrics",stage="llm",kind="prompt"} 10' in lines
+    assert 'graphrag_tokens_total{operation="metrics",stage="llm",kind="completion"} 4' in lines
+
+
+def test_traced_call_ends_the_span_when_the_stream_is_exhausted():
+    @rag._traced_call("llm")
+    async def complete(prompt, stream=False, token_tracker=None):
+        async def chunks():
+            for chunk in ["Scrooge ", "is ", "a miser."]:
+                await asyncio.sleep(0.01)
+                yield chunk
+            token_tracker.add_usage({"completion_tokens": 3})
+        return chunks() if stream else "Scrooge is a miser."
+
+    async def scenario():
+        with tracing.record("streaming") as trace:
+            assert await complete("Who is Scrooge?") == "Scrooge is a miser."
+            stream = await complete("Who is Scrooge?", stream=True)
+            assert trace.stages["llm"]["calls"] == 1
+            chunks = [chunk async for chunk in stream]
+        return trace, chunks
+    trace, chunks = asyncio.run(scenario())
+    assert chunks == ["Scrooge ", "is ", "a miser."]
+    llm = [span for span in trace.to_dict()["spans"] if span["name"] == "llm"]
+    assert len(llm) == 2
+    assert llm[1]["duration_ms"] >= 30
+    assert llm[1]["completion_tokens"] == 3
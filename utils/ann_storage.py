@@ -0,0 +1,485 @@
+"""
+Approximate nearest-neighbor vector storage for LightRAG (faiss, CPU only).
+
+Selected with VECTOR_STORAGE=AnnVectorDBStorage in place of LightRAG's default
+NanoVectorDBStorage, which compares the query with every stored vector. The
+index is persisted per namespace next to the other storages of the dataset
+(`ann_<namespace>.index` and `.meta.json`) and updated in place as documents
+are added and deleted:
+
+- ANN_INDEX=hnsw: HNSW graph over the full vectors. Deleted vectors are
+  skipped at search time and the graph is rebuilt without them once they make
+  up ANN_COMPACT_RATIO of the index.
+- ANN_INDEX=ivfpq: inverted lists with product-quantized vectors (much less
+  memory, lower recall). Until ANN_IVF_TRAIN_SIZE vectors exist the storage
+  searches exactly; the quantizer is then trained once on the stored vectors.
+
+Vectors are L2-normalized, so inner product is cosine similarity as with
+NanoVectorDB. Build parameters are read from the environment; after changing
+them, or to switch an indexed dataset over without re-embedding, run
+
+    python -m utils.ann_storage rebuild <dataset>
+
+which rebuilds the indexes from the current ANN indexes, or from the
+NanoVectorDB files (`vdb_<namespace>.json`) when there is no ANN index yet, and
+
+    python -m utils.ann_storage report <dataset> --top-k 10
+
+to measure recall@k and per-query latency against exact search.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from dataclasses import dataclass
+from typing import Any, final
+import numpy as np
+from dotenv import load_dotenv
+from lightrag.base import BaseVectorStorage
+from lightrag.utils import logger, compute_mdhash_id
+from lightrag.kg.shared_storage import get_namespace_lock, get_update_flag, set_all_update_flags
+
+# faiss-cpuはこのストレージを選んだときだけ必要になる
+import faiss  # type: ignore
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+ANN_INDEX = os.getenv("ANN_INDEX", "hnsw")
+ANN_HNSW_M = int(os.getenv("ANN_HNSW_M", 32))
+ANN_HNSW_EF_CONSTRUCTION = int(os.getenv("ANN_HNSW_EF_CONSTRUCTION", 200))
+ANN_HNSW_EF_SEARCH = int(os.getenv("ANN_HNSW_EF_SEARCH", 128))
+ANN_IVF_NLIST = int(os.getenv("ANN_IVF_NLIST", 1024))
+ANN_IVF_PQ_M = int(os.getenv("ANN_IVF_PQ_M", 64))
+ANN_IVF_NBITS = int(os.getenv("ANN_IVF_NBITS", 8))
+ANN_IVF_NPROBE = int(os.getenv("ANN_IVF_NPROBE", 32))
+# faissはセントロイドごとに39件以上の学習データを推奨している
+ANN_IVF_TRAIN_SIZE = int(os.getenv("ANN_IVF_TRAIN_SIZE", ANN_IVF_NLIST * 39))
+ANN_COMPACT_RATIO = float(os.getenv("ANN_COMPACT_RATIO", 0.2))
+ANN_ADD_BATCH = 65536
+NAMESPACES = ["chunks", "entities", "relationships"]
+META_VERSION = 1
+
+
+def index_paths(workspace_dir, namespace):
+    index_file = os.path.join(workspace_dir, f"ann_{namespace}.index")
+    return index_file, f"{index_file}.meta.json"
+
+def _pq_m(dim):
+    # PQのサブベクトル数は次元数の約数にする
+    return max(m for m in range(1, min(ANN_IVF_PQ_M, dim) + 1) if dim % m == 0)
+
+def build_params(kind, dim):
+    if kind == "hnsw":
+        return {"M": ANN_HNSW_M, "ef_construction": ANN_HNSW_EF_CONSTRUCTION}
+    if kind == "ivfpq":
+        return {"nlist": ANN_IVF_NLIST, "pq_m": _pq_m(dim), "nbits": ANN_IVF_NBITS}
+    return {}
+
+def new_index(kind, dim, training_vectors=None):
+    """Empty index of `kind` ("hnsw", "ivfpq", or "flat" for exact search); ivfpq is trained on `training_vectors`."""
+    if kind == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, ANN_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = ANN_HNSW_EF_CONSTRUCTION
+        return faiss.IndexIDMap2(hnsw)
+    if kind == "ivfpq":
+        params = build_params(kind, dim)
+        index = faiss.IndexIVFPQ(
+            faiss.IndexFlatIP(dim), dim, params["nlist"], params["pq_m"], params["nbits"], faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(training_vectors)
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+    if kind == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    raise ValueError(f"Unknown ANN_INDEX: {kind} (hnsw or ivfpq)")
+
+def add_vectors(index, vectors, fids):
+    for start in range(0, len(fids), ANN_ADD_BATCH):
+        index.add_with_ids(vectors[start:start + ANN_ADD_BATCH], fids[start:start + ANN_ADD_BATCH])
+
+def build_index(kind, dim, vectors, fids):
+    """Index of the configured `kind` over normalized `vectors` with the int64 ids `fids`."""
+    if kind == "ivfpq" and len(fids) < ANN_IVF_TRAIN_SIZE:
+        kind = "flat"
+    training = vectors[np.random.default_rng(0).permutation(len(vectors))[:ANN_IVF_NLIST * 256]] if kind == "ivfpq" else None
+    index = new_index(kind, dim, training)
+    add_vectors(index, vectors, fids)
+    return kind, index
+
+def stored_vectors(index, fids):
+    """The vectors stored under `fids` (PQ reconstructions for ivfpq, i.e. approximate)."""
+    fids = np.asarray(fids, dtype=np.int64)
+    if len(fids) == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_batch(fids)
+
+def search(index, kind, queries, top_k, deleted=()):
+    """faiss search with the configured search-time parameters, skipping the `deleted` ids."""
+    params = None
+    if kind == "hnsw":
+        params = faiss.SearchParametersHNSW(efSearch=max(ANN_HNSW_EF_SEARCH, top_k))
+    elif kind == "ivfpq":
+        params = faiss.SearchParametersIVF(nprobe=ANN_IVF_NPROBE)
+    if deleted:
+        params = params or faiss.SearchParameters()
+        params.sel = faiss.IDSelectorNot(faiss.IDSelectorBatch(np.fromiter(deleted, dtype=np.int64)))
+    return index.search(queries, top_k, params=params)
+
+def _normalized(vectors):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+@final
+@dataclass
+class AnnVectorDBStorage(BaseVectorStorage):
+    """LightRAG vector storage backed by a faiss HNSW or IVF-PQ index (see the module docstring)."""
+
+    def __post_init__(self):
+        self._validate_embedding_func()
+        kwargs = self.global_config.get("vector_db_storage_cls_kwargs", {})
+        cosine_threshold = kwargs.get("cosine_better_than_threshold")
+        if cosine_threshold is None:
+            raise ValueError("cosine_better_than_threshold must be specified in vector_db_storage_cls_kwargs")
+        self.cosine_better_than_threshold = cosine_threshold
+
+        working_dir = self.global_config["working_dir"]
+        workspace_dir = os.path.join(working_dir, self.workspace) if self.workspace else working_dir
+        self.workspace = self.workspace or ""
+        os.makedirs(workspace_dir, exist_ok=True)
+        self._index_file, self._meta_file = index_paths(workspace_dir, self.namespace)
+        self._max_batch_size = self.global_config["embedding_batch_num"]
+        self._dim = self.embedding_func.embedding_dim
+        self._load()
+
+    async def initialize(self):
+        self.storage_updated = await get_update_flag(self.namespace, workspace=self.workspace)
+        self._storage_lock = get_namespace_lock(self.namespace, workspace=self.workspace)
+
+    # 保存済みのインデックスを読み込む（なければ空のインデックスを作る）
+    def _load(self):
+        self._reset()
+        if not os.path.exists(self._index_file):
+            return
+        try:
+            with open(self._meta_file, encoding="utf-8") as f:
+                meta = json.load(f)
+            index = faiss.read_index(self._index_file)
+        except Exception as e:
+            logger.error(f"[{self.workspace}] Failed to load ANN index {self._index_file}, starting empty: {e}")
+            return
+        if index.d != self._dim:
+            raise ValueError(
+                f"Dimension mismatch: ANN index {self._index_file} has dimension {index.d}, "
+                f"but the embedding function has {self._dim}. Rebuild the index."
+            )
+        self._index = index
+        self._kind = meta["kind"]
+        self._next_fid = meta["next_fid"]
+        self._deleted = set(meta["deleted"])
+        self._rows = {int(fid): row for fid, row in meta["rows"].items()}
+        self._fids = {row["__id__"]: fid for fid, row in self._rows.items()}
+        self._relations = {}
+        for fid, row in self._rows.items():
+            self._index_relation(fid, row)
+        configured = ANN_INDEX if not (ANN_INDEX == "ivfpq" and self._kind == "flat") else "flat"
+        if self._kind != configured or meta["params"] != build_params(self._kind, self._dim):
+            logger.warning(
+                f"[{self.workspace}] ANN index {self.namespace} was built as {self._kind} {meta['params']}; "
+                f"run `python -m utils.ann_storage rebuild {self.workspace}` to apply ANN_INDEX={ANN_INDEX}"
+            )
+        logger.info(f"[{self.workspace}] ANN index {self.namespace} loaded: {self._kind}, {len(self._rows)} vectors")
+
+    def _reset(self):
+        self._kind = "flat" if ANN_INDEX == "ivfpq" else ANN_INDEX
+        self._index = new_index(self._kind, self._dim)
+        self._next_fid = 0
+        self._deleted = set()
+        self._rows = {}
+        self._fids = {}
+        self._relations = {}
+
+    def _index_relation(self, fid, row):
+        for entity in (row.get("src_id"), row.get("tgt_id")):
+            if entity is not None:
+                self._relations.setdefault(entity, set()).add(fid)
+
+    async def _reload_if_updated(self):
+        if self.storage_updated.value:
+            logger.info(f"[{self.workspace}] Process {os.getpid()} reloading ANN index {self.namespace} updated by another process")
+            self._load()
+            self.storage_updated.value = False
+
+    async def upsert(self, data: dict[str, dict[str, Any]]) -> None:
+        logger.debug(f"[{self.workspace}] ANN: inserting {len(data)} to {self.namespace}")
+        if not data:
+            return
+        current_time = int(time.time())
+        rows = []
+        contents = []
+        for key, value in data.items():
+            row = {field: value[field] for field in self.meta_fields if field in value}
+            row["__id__"] = key
+            row["__created_at__"] = current_time
+            rows.append(row)
+            contents.append(value["content"])
+        embeddings = await asyncio.gather(*[
+            self.embedding_func(contents[start:start + self._max_batch_size])
+            for start in range(0, len(contents), self._max_batch_size)
+        ])
+        vectors = _normalized(np.concatenate(embeddings, axis=0))
+        if len(vectors) != len(rows):
+            logger.error(f"[{self.workspace}] Embedding size mismatch. Embeddings: {len(vectors)}, Data: {len(rows)}")
+            return
+
+        async with self._storage_lock:
+            await self._reload_if_updated()
+            self._remove([self._fids[row["__id__"]] for row in rows if row["__id__"] in self._fids])
+            fids = np.arange(self._next_fid, self._next_fid + len(rows), dtype=np.int64)
+            self._next_fid += len(rows)
+            # 大量の追加はイベントループを止めないよう別スレッドで行う（検索もロック内で行うので競合しない）
+            await asyncio.to_thread(add_vectors, self._index, vectors, fids)
+            for fid, row in zip(fids.tolist(), rows):
+                self._rows[fid] = row
+                self._fids[row["__id__"]] = fid
+                self._index_relation(fid, row)
+            if self._kind == "flat" and ANN_INDEX == "ivfpq" and len(self._rows) >= ANN_IVF_TRAIN_SIZE:
+                await asyncio.to_thread(self._rebuild, "ivfpq")
+        return [row["__id__"] for row in rows]
+
+    # 削除（HNSWは削除済みとして検索から除外し、一定の割合を超えたら作り直す）
+    def _remove(self, fids):
+        if not fids:
+            return
+        for fid in fids:
+            row = self._rows.pop(fid)
+            self._fids.pop(row["__id__"], None)
+            for entity in (row.get("src_id"), row.get("tgt_id")):
+                if entity in self._relations:
+                    self._relations[entity].discard(fid)
+        if self._kind == "hnsw":
+            self._deleted.update(fids)
+            if len(self._deleted) > ANN_COMPACT_RATIO * self._index.ntotal:
+                self._rebuild("hnsw")
+        else:
+            self._index.remove_ids(faiss.IDSelectorArray(np.array(fids, dtype=np.int64)))
+
+    def _rebuild(self, kind):
+        fids = np.fromiter(self._rows, dtype=np.int64, count=len(self._rows))
+        self._kind, self._index = build_index(kind, self._dim, stored_vectors(self._index, fids), fids)
+        self._deleted = set()
+        logger.info(f"[{self.workspace}] ANN index {self.namespace} rebuilt as {self._kind} with {self._index.ntotal} vectors")
+
+    async def query(self, query: str, top_k: int, query_embedding: list[float] = None) -> list[dict[str, Any]]:
+        if query_embedding is None:
+            query_embedding = (await self.embedding_func([query], _priority=5))[0]
+        embedding = _normalized(np.array([query_embedding]))
+        async with self._storage_lock:
+            await self._reload_if_updated()
+            if not self._rows:
+                return []
+            distances, fids = search(self._index, self._kind, embedding, min(top_k, len(self._rows)), self._deleted)
+            results = []
+            for distance, fid in zip(distances[0].tolist(), fids[0].tolist()):
+                row = self._rows.get(fid)
+                if row is None or distance < self.cosine_better_than_threshold:
+                    continue
+                results.append({**row, "id": row["__id__"], "distance": distance, "created_at": row.get("__created_at__")})
+        return results
+
+    @property
+    def client_storage(self):
+        return {"data": list(self._rows.values())}
+
+    async def delete(self, ids: list[str]):
+        async with self._storage_lock:
+            self._remove([self._fids[id] for id in ids if id in self._fids])
+        logger.debug(f"[{self.workspace}] Deleted {len(ids)} vectors from {self.namespace}")
+
+    async def delete_entity(self, entity_name: str) -> None:
+        await self.delete([compute_mdhash_id(entity_name, prefix="ent-")])
+
+    async def delete_entity_relation(self, entity_name: str) -> None:
+        async with self._storage_lock:
+            self._remove(list(self._relations.pop(entity_name, ())))
+
+    def _record(self, id):
+        fid = self._fids.get(id)
+        if fid is None:
+            return None
+        row = self._rows[fid]
+        return {**row, "id": row["__id__"], "created_at": row.get("__created_at__")}
+
+    async def get_by_id(self, id: str) -> dict[str, Any] | None:
+        return self._record(id)
+
+    async def get_by_ids(self, ids: list[str]) -> list[dict[str, Any]]:
+        return [self._record(id) for id in ids]
+
+    async def get_vectors_by_ids(self, ids: list[str]) -> dict[str, list[float]]:
+        """Stored vectors by id (PQ reconstructions for ivfpq, i.e. approximate)."""
+        async with self._storage_lock:
+            found = [id for id in ids if id in self._fids]
+            vectors = stored_vectors(self._index, [self._fids[id] for id in found])
+            return {id: vector.tolist() for id, vector in zip(found, vectors)}
+
+    def _save(self):
+        faiss.write_index(self._index, f"{self._index_file}.tmp")
+        meta = {
+            "version": META_VERSION,
+            "kind": self._kind,
+            "params": build_params(self._kind, self._dim),
+            "next_fid": self._next_fid,
+            "deleted": sorted(self._deleted),
+            "rows": {str(fid): row for fid, row in self._rows.items()},
+        }
+        with open(f"{self._meta_file}.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(f"{self._index_file}.tmp", self._index_file)
+        os.replace(f"{self._meta_file}.tmp", self._meta_file)
+
+    async def index_done_callback(self) -> None:
+        async with self._storage_lock:
+            if self.storage_updated.value:
+                logger.warning(f"[{self.workspace}] ANN index {self.namespace} was updated by another process, reloading...")
+                self._load()
+                self.storage_updated.value = False
+                return False
+            try:
+                await asyncio.to_thread(self._save)
+                await set_all_update_flags(self.namespace, workspace=self.workspace)
+                self.storage_updated.value = False
+            except Exception as e:
+                logger.error(f"[{self.workspace}] Error saving ANN index {self.namespace}: {e}")
+                return False
+        return True
+
+    async def drop(self) -> dict[str, str]:
+        try:
+            async with self._storage_lock:
+                for path in (self._index_file, self._meta_file):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._reset()
+                await set_all_update_flags(self.namespace, workspace=self.workspace)
+                self.storage_updated.value = False
+            logger.info(f"[{self.workspace}] Process {os.getpid()} drop ANN index {self.namespace}")
+            return {"status": "success", "message": "data dropped"}
+        except Exception as e:
+            logger.error(f"[{self.workspace}] Error dropping ANN index {self.namespace}: {e}")
+            return {"status": "error", "message": str(e)}
+
+
+# 保存済みのベクトル（ANNインデックスから。IVF-PQは近似値になるため、同じ内容のNanoVectorDBのファイルがあればそちらを使う）
+def _stored_vectors(workspace_dir, namespace):
+    from nano_vectordb.dbs import load_storage
+
+    index_file, meta_file = index_paths(workspace_dir, namespace)
+    meta = None
+    if os.path.exists(index_file):
+        with open(meta_file, encoding="utf-8") as f:
+            meta = json.load(f)
+    nano = load_storage(os.path.join(workspace_dir, f"vdb_{namespace}.json"))
+    if nano is not None and len(nano["data"]):
+        nano_ids = [row["__id__"] for row in nano["data"]]
+        if meta is None or (meta["kind"] == "ivfpq" and set(nano_ids) == {row["__id__"] for row in meta["rows"].values()}):
+            return "nano", nano_ids, nano["data"], _normalized(nano["matrix"])
+    if meta is None:
+        return None, [], [], None
+    fids = sorted(int(fid) for fid in meta["rows"])
+    rows = [meta["rows"][str(fid)] for fid in fids]
+    return meta["kind"], [row["__id__"] for row in rows], rows, _normalized(stored_vectors(faiss.read_index(index_file), fids))
+
+def rebuild(workspace_dir, namespace):
+    """Rebuild the namespace's index with the current ANN_* parameters. Returns (source, kind, count)."""
+    source, _, rows, vectors = _stored_vectors(workspace_dir, namespace)
+    if source is None:
+        return None, None, 0
+    rows = [{key: value for key, value in row.items() if key not in ("__vector__", "__metrics__")} for row in rows]
+    fids = np.arange(len(rows), dtype=np.int64)
+    kind, index = build_index(ANN_INDEX, vectors.shape[1], vectors, fids)
+    index_file, meta_file = index_paths(workspace_dir, namespace)
+    faiss.write_index(index, index_file)
+    with open(meta_file, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": META_VERSION,
+            "kind": kind,
+            "params": build_params(kind, vectors.shape[1]),
+            "next_fid": len(rows),
+            "deleted": [],
+            "rows": {str(fid): row for fid, row in zip(fids.tolist(), rows)},
+        }, f, ensure_ascii=False)
+    return source, kind, len(rows)
+
+def _percentiles(seconds):
+    values = np.array(seconds) * 1000
+    return {"p50_ms": round(float(np.percentile(values, 50)), 3), "p95_ms": round(float(np.percentile(values, 95)), 3)}
+
+def report(workspace_dir, namespace, top_k=10, queries=200, noise=0.05, seed=0):
+    """
+    recall@top_k and per-query latency of the namespace's ANN index against
+    exact search over the stored vectors. Queries are stored vectors with
+    Gaussian noise; for ivfpq without NanoVectorDB files the ground truth uses
+    the PQ reconstructions.
+    """
+    index_file, meta_file = index_paths(workspace_dir, namespace)
+    if not os.path.exists(index_file):
+        return None
+    with open(meta_file, encoding="utf-8") as f:
+        meta = json.load(f)
+    index = faiss.read_index(index_file)
+    source, ids, _, vectors = _stored_vectors(workspace_dir, namespace)
+    if len(ids) == 0:
+        return None
+    fid_by_id = {row["__id__"]: int(fid) for fid, row in meta["rows"].items()}
+    deleted = set(meta["deleted"])
+    rng = np.random.default_rng(seed)
+    samples = vectors[rng.choice(len(vectors), min(queries, len(vectors)), replace=False)]
+    samples = _normalized(samples + rng.normal(0, noise, samples.shape).astype(np.float32))
+    top_k = min(top_k, len(ids))
+
+    recalls, exact_seconds, ann_seconds = [], [], []
+    for query in samples:
+        start = time.perf_counter()
+        exact = np.argpartition(-(vectors @ query), top_k - 1)[:top_k]
+        exact_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        _, found = search(index, meta["kind"], query[None, :], top_k, deleted)
+        ann_seconds.append(time.perf_counter() - start)
+        expected = {fid_by_id.get(ids[position]) for position in exact.tolist()}
+        recalls.append(len(expected & set(found[0].tolist())) / top_k)
+    return {
+        "namespace": namespace,
+        "kind": meta["kind"],
+        "params": meta["params"],
+        "vectors": len(ids),
+        "ground_truth": "exact" if source in ("nano", "hnsw", "flat") else "pq_reconstruction",
+        f"recall@{top_k}": round(float(np.mean(recalls)), 4),
+        "ann": _percentiles(ann_seconds),
+        "exact": _percentiles(exact_seconds),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or evaluate the ANN vector indexes of a dataset.")
+    parser.add_argument("command", choices=["rebuild", "report"])
+    parser.add_argument("dataset", help="Dataset (working) directory")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    if not os.path.isdir(args.dataset):
+        print(f"Dataset directory not found: {args.dataset}", file=sys.stderr)
+        sys.exit(1)
+    for namespace in NAMESPACES:
+        if args.command == "rebuild":
+            source, kind, count = rebuild(args.dataset, namespace)
+            print(json.dumps({"namespace": namespace, "source": source, "kind": kind, "vectors": count}))
+        else:
+            print(json.dumps(report(args.dataset, namespace, args.top_k, args.queries) or {"namespace": namespace, "vectors": 0}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+from dotenv import load_dotenv
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "./cache/answer_cache.sqlite3")
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+# 0の場合は類似クエリによる再利用を行わない
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0))
+INDEX_VERSION_FILE = "index_version"
+NO_CONTEXT_MARKER = "[no-context]"
+
+
+# クエリの正規化（全角/半角、大文字/小文字、空白、末尾の句読点の揺れを吸収）
+def normalize_query(query):
+    query = unicodedata.normalize("NFKC", query).strip().lower()
+    query = re.sub(r"\s+", " ", query)
+    return query.rstrip("。.？?！! ")
+
+
+# インデックスのバージョン管理
+def get_index_version(working_dir):
+    path = os.path.join(working_dir, INDEX_VERSION_FILE)
+    if not os.path.exists(path):
+        return "0"
+    with open(path) as f:
+        return f.read().strip() or "0"
+
+def bump_index_version(working_dir):
+    os.makedirs(working_dir, exist_ok=True)
+    version = str(time.time_ns())
+    with open(os.path.join(working_dir, INDEX_VERSION_FILE), "w") as f:
+        f.write(version)
+    return version
+
+
+class AnswerCache:
+    """
+    On-disk (SQLite) cache of search answers.
+
+    Exact hits are keyed by (dataset, mode, modal, normalized query, index version).
+    When `similarity` is set, a miss falls back to the cached entry of the same
+    (dataset, mode, modal, index version) whose query embedding has the highest
+    cosine similarity, provided it is at least `similarity`.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 ttl_seconds=ANSWER_CACHE_TTL_SECONDS, similarity=ANSWER_CACHE_SIMILARITY):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    dataset TEXT, mode TEXT, modal TEXT, query TEXT, version TEXT,
+                    answer TEXT, embedding BLOB, created REAL, last_access REAL, entities TEXT
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS answers_scope ON answers (dataset, mode, modal, version)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(dataset, mode, modal, query, version):
+        raw = "\x1f".join([dataset, mode, modal, normalize_query(query), version])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, dataset, mode, modal, query, version, embedding=None):
+        key = self.make_key(dataset, mode, modal, query, version)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT answer, created FROM answers WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl_seconds:
+                conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+                self.hits += 1
+                return row[0]
+            if embedding is not None and self.similarity > 0:
+                answer = self._get_similar(conn, dataset, mode, modal, version, embedding, now)
+                if answer is not None:
+                    self.similar_hits += 1
+                    return answer
+            self.misses += 1
+            return None
+
+    def _get_similar(self, conn, dataset, mode, modal, version, embedding, now):
+        rows = conn.execute(
+            "SELECT key, answer, embedding FROM answers "
+            "WHERE dataset = ? AND mode = ? AND modal = ? AND version = ? "
+            "AND embedding IS NOT NULL AND created >= ?",
+            (dataset, mode, modal, version, now - self.ttl_seconds),
+        ).fetchall()
+        if not rows:
+            return None
+        query_vec = np.asarray(embedding, dtype=np.float32)
+        matrix = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vec)
+        scores = matrix @ query_vec / np.where(norms == 0, 1, norms)
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None
+        conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (now, rows[best][0]))
+        conn.commit()
+        return rows[best][1]
+
+    def entities(self, dataset, mode, modal, query, version, embedding=None):
+        """Entity names retrieved for an exactly matching cached answer, or None."""
+        key = self.make_key(dataset, mode, modal, query, version)
+        with self._lock:
+            row = self._connect().execute("SELECT entities FROM answers WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def put(self, dataset, mode, modal, query, version, answer, embedding=None, entities=None):
+        # 失敗した回答やコンテキストなしの回答はキャッシュしない
+        if not answer or NO_CONTEXT_MARKER in answer:
+            return
+        key = self.make_key(dataset, mode, modal, query, version)
+        blob = None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes()
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(key, dataset, mode, modal, query, version, answer, embedding, created, last_access, entities) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, dataset, mode, modal, normalize_query(query), version, answer, blob, now, now,
+                 None if entities is None else json.dumps(entities, ensure_ascii=False)),
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    # TTL切れとLRUによるエントリの削除
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl_seconds,))
+        conn.execute(
+            "DELETE FROM answers WHERE key IN ("
+            "SELECT key FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def invalidate(self, dataset):
+        """Remove every cached answer for the dataset."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM answers WHERE dataset = ?", (dataset,))
+            conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.similar_hits + self.misses
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.similar_hits) / lookups if lookups else 0.0,
+        }
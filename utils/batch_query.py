@@ -0,0 +1,187 @@
+"""
+Batch query runner.
+
+Reads a JSONL file of {"query", "mode", "modal"} records (optionally "id",
+"dataset" and "img_base64") and answers them with bounded concurrency on the
+shared RAG instances. Identical queries within the last BATCH_DEDUP_WINDOW
+distinct ones are answered once (older repeats hit the answer cache). Every
+record is written to the output JSONL as soon as it finishes, with its latency
+and the token usage reported by the API and the time spent in each stage
+(`stages_ms`).
+
+    python -m utils.batch_query queries.jsonl --dataset dickens --output answers.jsonl --concurrency 8
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import contextlib
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+from utils.rag import rag_pool, search, track_token_usage
+from utils.config import RagConfig, ModalType, SEARCH_MODES, get_graph_storage
+from utils.tracing import Trace
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+# 重複を判定するために回答を保持する直近の質問数（それより前の質問と同じものは回答キャッシュから答える）
+BATCH_DEDUP_WINDOW = int(os.getenv("BATCH_DEDUP_WINDOW", 1000))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="JSONL file with one query record per line")
+    parser.add_argument("--output", default="-", help="output JSONL file (default: stdout)")
+    parser.add_argument("--dataset", default=None, help="dataset for records without a `dataset` field")
+    parser.add_argument("--language", default="Japanese")
+    parser.add_argument("--mode", default="hybrid", choices=SEARCH_MODES, help="mode for records without a `mode` field")
+    parser.add_argument("--modal", default=ModalType.TEXT_ONLY.value, help="modal for records without a `modal` field")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    return parser.parse_args()
+
+# 入力レコードを検索の引数に変換する（不正なレコードはValueError）
+def _request(record, defaults):
+    if not isinstance(record, dict) or not record.get("query"):
+        raise ValueError("record must be a JSON object with a `query`")
+    request = {
+        "dataset": record.get("dataset") or defaults["dataset"],
+        "language": record.get("language") or defaults["language"],
+        "mode": record.get("mode") or defaults["mode"],
+        "modal": ModalType(record.get("modal") or defaults["modal"]),
+        "query": record["query"],
+        "img_base64": record.get("img_base64"),
+    }
+    if not request["dataset"]:
+        raise ValueError("no `dataset` in the record and no --dataset given")
+    if not os.path.isdir(request["dataset"]):
+        raise ValueError(f"dataset `{request['dataset']}` has no index")
+    if request["mode"] not in SEARCH_MODES:
+        raise ValueError(f"mode must be one of {SEARCH_MODES}")
+    if request["modal"] == ModalType.MULTIMODAL_INPUT and not request["img_base64"]:
+        raise ValueError("img_base64 is required for Multimodal Input mode")
+    return request
+
+def _request_key(request):
+    image = hashlib.sha256(request["img_base64"].encode("utf-8")).hexdigest() if request["img_base64"] else None
+    return (request["dataset"], request["language"], request["mode"], request["modal"].value, request["query"], image)
+
+async def _answer(request, graph_storage, slots):
+    async with slots:
+        start = time.perf_counter()
+        retrieval = {}
+        trace = Trace()
+        with track_token_usage() as tracker:
+            try:
+                answer = await search(
+                    RagConfig(request["dataset"], request["language"], graph_storage),
+                    request["mode"], request["query"], request["modal"], request["img_base64"],
+                    retrieval=retrieval, trace=trace,
+                )
+                error = None
+            except Exception as e:
+                answer, error = None, f"{type(e).__name__}: {e}"
+        return {
+            "answer": answer,
+            "mode": retrieval.get("mode", request["mode"]),
+            "entities": retrieval.get("entities", []),
+            "error": error,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "tokens": tracker.get_usage(),
+            "stages_ms": {row["stage"]: row["self_ms"] for row in trace.stage_rows()},
+        }
+
+async def run_batch(lines, output, defaults, concurrency=BATCH_CONCURRENCY):
+    """
+    Answer every JSONL line on the pool loop and write one result line per
+    input line (in completion order, with its 1-based `line`). Returns a summary.
+    """
+    graph_storage = get_graph_storage()
+    slots = asyncio.Semaphore(concurrency)
+    # 入力を先読みしすぎないよう、実行中のレコード数を並列数の数倍までに抑える
+    pending = set()
+    # 直近BATCH_DEDUP_WINDOW件の質問の (最初の行番号, 回答のタスク)
+    recent = OrderedDict()
+    # 集計は書き出すたびに更新する（書き出した回答は保持しない）
+    counts = {"records": 0, "unique": 0, "deduplicated": 0, "errors": 0, "total_tokens": 0}
+    latencies = []
+
+    async def process(line_number, record, task, duplicate_of):
+        result = await task
+        row = {"line": line_number, "id": record.get("id"), **result}
+        if duplicate_of is not None:
+            row.update(duplicate_of=duplicate_of, latency_ms=0.0, tokens=None, stages_ms=None)
+        output.write(json.dumps(row, ensure_ascii=False) + "\n")
+        output.flush()
+        counts["records"] += 1
+        counts["deduplicated"] += duplicate_of is not None
+        counts["errors"] += bool(row["error"])
+        counts["total_tokens"] += row["tokens"]["total_tokens"] if row["tokens"] else 0
+        if duplicate_of is None and not row["error"]:
+            latencies.append(row["latency_ms"])
+
+    start = time.perf_counter()
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            request = _request(record, defaults)
+        except ValueError as e:
+            record = {}
+            failed = asyncio.get_running_loop().create_future()
+            failed.set_result({"answer": None, "mode": None, "entities": [], "error": f"Invalid record: {e}", "latency_ms": 0.0, "tokens": None, "stages_ms": None})
+            task, duplicate_of = failed, None
+        else:
+            key = _request_key(request)
+            if key in recent:
+                duplicate_of, task = recent[key]
+                recent.move_to_end(key)
+            else:
+                duplicate_of, task = None, asyncio.create_task(_answer(request, graph_storage, slots))
+                recent[key] = (line_number, task)
+                counts["unique"] += 1
+                if len(recent) > BATCH_DEDUP_WINDOW:
+                    recent.popitem(last=False)
+        pending.add(asyncio.create_task(process(line_number, record, task, duplicate_of)))
+        if len(pending) >= concurrency * 4:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    if pending:
+        await asyncio.gather(*pending)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "records": counts["records"],
+        "unique": counts["unique"],
+        "deduplicated": counts["deduplicated"],
+        "errors": counts["errors"],
+        "elapsed_s": round(elapsed, 2),
+        "queries_per_second": round(counts["records"] / elapsed, 2) if elapsed else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1) if latencies else None,
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1) if latencies else None,
+        "total_tokens": counts["total_tokens"],
+    }
+
+def main():
+    args = parse_args()
+    defaults = {"dataset": args.dataset, "language": args.language, "mode": args.mode, "modal": args.modal}
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        # 検索中に表示される質問と回答は標準エラーに出し、結果のJSONLと混ざらないようにする
+        with open(args.input, encoding="utf-8") as lines, contextlib.redirect_stdout(sys.stderr):
+            summary = asyncio.run(rag_pool.run(run_batch(lines, output, defaults, args.concurrency)))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        rag_pool.close()
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
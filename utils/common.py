@@ -3,19 +3,13 @@ import io
 import base64
 import streamlit as st
 from PIL import Image
-from neo4j import GraphDatabase
 from dotenv import load_dotenv
-from enum import Enum
+from utils.config import SEARCH_MODES, ModalType, get_graph_storage, get_vector_storage
+from utils.neo4j_driver import verify_connectivity, health
 
 # 環境変数をロード
 load_dotenv()
 
-class ModalType(Enum):
-    TEXT_ONLY = "Text Only"
-    MULTIMODAL = "Multimodal"
-    MULTIMODAL_INPUT = "Multimodal Input"
-    BOTH = "Both"
-
 # データセットの選択
 def select_dataset():
     return st.text_input(
@@ -34,20 +28,18 @@ def select_language():
 
 # グラフストレージの選択
 def select_graph_storage():
-    graph_storage = "Neo4JStorage" if os.getenv("NEO4J_URI") else "NetworkXStorage"
-    st.info(f"Using Graph Storage: {graph_storage}")
+    graph_storage = get_graph_storage()
+    st.info(f"Using Graph Storage: {graph_storage} / Vector Storage: {get_vector_storage()}")
     if graph_storage == "Neo4JStorage":
         verify_neo4j_connection()
     return graph_storage
 
-# Neo4jストレージの接続確認
+# Neo4jストレージの接続確認（共有ドライバーを使い、確認結果は一定時間キャッシュする）
 def verify_neo4j_connection():
-    neo4j_uri = os.getenv('NEO4J_URI')
-    username = os.getenv('NEO4J_USERNAME')
-    password = os.getenv('NEO4J_PASSWORD')
-    with GraphDatabase.driver(neo4j_uri, auth=(username, password)) as driver:
-        driver.verify_connectivity()
-        st.success("Successfully access neo4j")
+    verify_connectivity()
+    st.success("Successfully access neo4j")
+    with st.expander("Neo4j Connection"):
+        st.json(health())
 
 # インデックスデータの確認
 def check_storage(working_dir, filename):
@@ -59,9 +51,9 @@ def check_storage(working_dir, filename):
 def select_search_mode():
     return st.selectbox(
         "Select Search Mode",
-        ["naive", "local", "global", "hybrid", "mix"],
+        SEARCH_MODES,
         key="mode",
-        help="- `naive`: 単純な類似検索\n- `local`: 人物相関など特定の関係性について質問をする\n- `global`: 文章全体にまたがる抽象的な質問をする\n- `hybrid`: `local`と`global`の両方を混ぜたもの\n- `mix`: 知識グラフとベクトル検索を組み合わせて検索する"
+        help="- `naive`: 単純な類似検索\n- `local`: 人物相関など特定の関係性について質問をする\n- `global`: 文章全体にまたがる抽象的な質問をする\n- `hybrid`: `local`と`global`の両方を混ぜたもの\n- `mix`: 知識グラフとベクトル検索を組み合わせて検索する\n- `auto`: 質問の内容から十分なモードのうち最も安いものを自動で選ぶ（LLMは使わない）"
     )
 
 def select_modal():
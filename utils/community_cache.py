@@ -0,0 +1,157 @@
+import os
+import html
+import json
+import hashlib
+import numpy as np
+import networkx as nx
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from graphrag.graphs.hierarchical_leiden import hierarchical_leiden
+from utils.graph_store import load_graph
+
+# 定数の設定
+GRAPH_FILE = "graph_chunk_entity_relation.graphml"
+COMMUNITY_CACHE_DIR = "communities"
+COMMUNITY_COLUMNS = ["level", "community", "parent", "title"]
+# クラスタリング結果に影響するパラメータ（verboseなどはキャッシュキーに含めない）
+STRATEGY_KEYS = ["type", "max_cluster_size", "use_lcc", "seed"]
+
+
+def strategy_key(strategy):
+    params = {key: strategy.get(key) for key in STRATEGY_KEYS}
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def community_cache_path(working_dir, strategy):
+    return os.path.join(working_dir, COMMUNITY_CACHE_DIR, f"{strategy_key(strategy)}.parquet")
+
+# graphragのstable_lccと同じノード名の正規化（HTMLエスケープの解除・大文字化・前後の空白の除去）
+def normalize_name(name):
+    return html.unescape(name).upper().strip()
+
+# 連結成分ごとのノード名と辺リスト（無向・重み付き、順序を固定）
+# normalizeを指定した場合は正規化後の名前で成分を作る（同じ名前になるノードは1つにまとめ、重複した辺は最初の辺を使う）
+def component_edges(graph, normalize=None):
+    ids = graph.node_ids()
+    if normalize is not None:
+        ids = [normalize(name) for name in ids]
+    src = np.asarray(graph.edge_src)
+    dst = np.asarray(graph.edge_dst)
+    weight_column = graph.edge_columns.get("weight")
+    weights = np.ones(graph.n_edges) if weight_column is None else np.nan_to_num(
+        np.asarray(weight_column.values, dtype=np.float64), nan=1.0
+    )
+    pairs = {}
+    for source, target, weight in zip(src.tolist(), dst.tolist(), weights.tolist()):
+        pair = tuple(sorted((ids[source], ids[target])))
+        if pair[0] != pair[1]:
+            pairs.setdefault(pair, weight)
+    G = nx.Graph()
+    G.add_edges_from(pairs)
+    components = list(nx.connected_components(G))
+    label = {name: number for number, nodes in enumerate(components) for name in nodes}
+    edges = [[] for _ in components]
+    for (source, target), weight in pairs.items():
+        edges[label[source]].append((source, target, weight))
+    return [(sorted(nodes), sorted(edge_list)) for nodes, edge_list in zip(components, edges)]
+
+def component_signature(edges):
+    return hashlib.sha1(json.dumps(edges).encode("utf-8")).hexdigest()
+
+# 連結成分ごとの階層的Leidenクラスタリング（コミュニティIDは成分内のローカルID）
+def cluster_component(edges, strategy):
+    clusters = {}
+    for partition in hierarchical_leiden(
+        edges, max_cluster_size=strategy["max_cluster_size"], random_seed=strategy["seed"]
+    ):
+        parent = partition.parent_cluster if partition.parent_cluster is not None else -1
+        key = (partition.level, partition.cluster, parent)
+        clusters.setdefault(key, []).append(partition.node)
+    return [
+        {"level": level, "community": community, "parent": parent, "title": sorted(titles)}
+        for (level, community, parent), titles in sorted(clusters.items())
+    ]
+
+
+def _read_cache(path):
+    if not os.path.exists(path):
+        return None, pd.DataFrame(columns=["component", *COMMUNITY_COLUMNS])
+    table = pq.read_table(path)
+    metadata = table.schema.metadata or {}
+    return metadata.get(b"graph_sha256", b"").decode(), table.to_pandas()
+
+def _write_cache(path, rows, graph_hash, strategy):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(rows, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b"graph_sha256": graph_hash.encode(),
+        b"strategy": json.dumps(strategy, sort_keys=True, default=str).encode(),
+    })
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+# 成分ごとのローカルIDを全体で一意なIDに振り直し、ノード単位の行に展開する
+def _assemble(rows, levels=None):
+    if rows.empty:
+        return pd.DataFrame(columns=COMMUNITY_COLUMNS).astype({"community": int})
+    frames = []
+    offset = 0
+    for _, component in rows.groupby("component", sort=False):
+        component = component[COMMUNITY_COLUMNS].copy()
+        span = int(component["community"].max()) + 1
+        component["community"] = component["community"] + offset
+        component["parent"] = component["parent"].where(component["parent"] < 0, component["parent"] + offset)
+        frames.append(component)
+        offset += span
+    communities = pd.concat(frames, ignore_index=True)
+    if levels is not None:
+        communities = communities[communities["level"].isin(levels)]
+    communities = communities.explode("title")
+    communities["community"] = communities["community"].astype(int)
+    return communities
+
+
+def load_communities(working_dir, strategy):
+    """
+    Return the hierarchical Leiden communities of the dataset's knowledge graph.
+
+    Results are stored per strategy in `<working_dir>/communities/<key>.parquet`
+    together with the hash of the GraphML file. When the graph is unchanged the
+    stored table is returned as is; otherwise only the connected components
+    whose edge lists changed are clustered again. The graph is read from its
+    binary snapshot (see utils.graph_store).
+    """
+    graph = load_graph(os.path.join(working_dir, GRAPH_FILE))
+    cache_path = community_cache_path(working_dir, strategy)
+    graph_hash = graph.sha256
+    cached_hash, cached_rows = _read_cache(cache_path)
+    if cached_hash == graph_hash:
+        return _assemble(cached_rows, strategy.get("levels"))
+
+    # 連結成分はノード数の多い順（同数ならノード名順）に並べる。
+    # use_lccの場合はgraphragと同じく正規化した名前で最大の成分を選ぶ（タイトルも正規化後の名前になる）
+    normalize = normalize_name if strategy.get("use_lcc") else None
+    components = sorted(component_edges(graph, normalize), key=lambda component: (-len(component[0]), component[0][0]))
+    if strategy.get("use_lcc"):
+        components = components[:1]
+
+    cached = {signature: group for signature, group in cached_rows.groupby("component", sort=False)}
+    frames = []
+    reused = 0
+    for _, edges in components:
+        signature = component_signature(edges)
+        if signature in cached:
+            frames.append(cached[signature])
+            reused += 1
+            continue
+        rows = pd.DataFrame(cluster_component(edges, strategy), columns=COMMUNITY_COLUMNS)
+        rows.insert(0, "component", signature)
+        frames.append(rows)
+
+    rows = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["component", *COMMUNITY_COLUMNS])
+    if strategy.get("verbose"):
+        print(f"Clustered {len(frames) - reused} of {len(frames)} components ({reused} reused from {cache_path})")
+    _write_cache(cache_path, rows, graph_hash, strategy)
+    return _assemble(rows, strategy.get("levels"))
@@ -0,0 +1,319 @@
+"""
+Community reports for global search.
+
+After indexing, every community of the hierarchical Leiden clustering (the
+same clustering and parquet cache the graph view uses, see
+utils.community_cache) gets a short LLM-written report, stored in
+`<working_dir>/communities/reports.json`. Reports are keyed by a signature of
+the community's entities and relations, so a refresh only regenerates the
+communities whose content changed. Communities too large for one prompt are
+summarized from the reports of their sub-communities.
+
+Global queries then map over the highest-ranked reports of one level (a fixed
+number of map calls) and reduce the rated key points into the answer, so their
+cost does not grow with the corpus.
+"""
+import os
+import re
+import json
+import hashlib
+import asyncio
+import threading
+from dotenv import load_dotenv
+from utils.community_cache import GRAPH_FILE, COMMUNITY_CACHE_DIR, load_communities
+from utils.graph_store import load_graph
+from utils.llm_client import estimate_tokens
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+COMMUNITY_REPORTS = int(os.getenv("COMMUNITY_REPORTS", 1))
+COMMUNITY_REPORT_MIN_SIZE = int(os.getenv("COMMUNITY_REPORT_MIN_SIZE", 3))
+COMMUNITY_REPORT_MAX_INPUT_TOKENS = int(os.getenv("COMMUNITY_REPORT_MAX_INPUT_TOKENS", 4000))
+COMMUNITY_REPORT_CONCURRENCY = int(os.getenv("COMMUNITY_REPORT_CONCURRENCY", 4))
+GLOBAL_QUERY_LEVEL = int(os.getenv("GLOBAL_QUERY_LEVEL", 0))
+GLOBAL_MAX_REPORTS = int(os.getenv("GLOBAL_MAX_REPORTS", 32))
+GLOBAL_MAP_CONTEXT_TOKENS = int(os.getenv("GLOBAL_MAP_CONTEXT_TOKENS", 6000))
+GLOBAL_REDUCE_CONTEXT_TOKENS = int(os.getenv("GLOBAL_REDUCE_CONTEXT_TOKENS", 6000))
+REPORTS_FILE = "reports.json"
+REPORT_VERSION = 1
+# グラフ表示のレイアウト（utils.graph_visualize.LAYOUT_STRATEGY）と同じ設定にして、クラスタリング結果のキャッシュを共有する
+REPORT_STRATEGY = {
+    "type": "leiden",
+    "max_cluster_size": 10,
+    "use_lcc": False,
+    "seed": 0xDEADBEEF,
+    "levels": None,
+    "verbose": False,
+}
+GRAPH_FIELD_SEP = "<SEP>"
+REPORT_ENTITIES = 10
+NO_ANSWER = "Sorry, I'm not able to provide an answer to that question."
+
+REPORT_SYSTEM_PROMPT = """You write reports about communities of entities in a knowledge graph.
+Respond in {language} with a markdown report: a first line "# <short title>", one summary paragraph, then up to five bullet points with the most important findings. Use only the given data."""
+MAP_SYSTEM_PROMPT = """You extract the key points that help answer a question from community reports.
+Respond only with JSON: {{"points": [{{"description": "<key point in {language}>", "score": <0-100 importance for the question>}}]}}.
+Return {{"points": []}} when the reports are not relevant."""
+REDUCE_SYSTEM_PROMPT = """You answer questions about a whole document collection from key points that analysts extracted from community reports, most important first.
+Respond in {language}. Combine the points into a coherent answer in markdown, do not mention the scores, and say so if the points do not answer the question."""
+
+
+def reports_path(working_dir):
+    return os.path.join(working_dir, COMMUNITY_CACHE_DIR, REPORTS_FILE)
+
+def _description(value):
+    return " ".join(part.strip() for part in (value or "").split(GRAPH_FIELD_SEP) if part.strip())
+
+def _column(columns, name, length):
+    return columns[name].tolist() if name in columns else [None] * length
+
+# コミュニティごとのエンティティ・関係の一覧と、その内容のシグネチャ
+def community_contexts(working_dir, language):
+    """
+    {(level, community): context} for the communities with at least
+    COMMUNITY_REPORT_MIN_SIZE entities. The context holds the entity and
+    relation lines (most connected first), their signature and the parent.
+    """
+    graph = load_graph(os.path.join(working_dir, GRAPH_FILE))
+    communities = load_communities(working_dir, REPORT_STRATEGY)
+    degrees = graph.degrees()
+    ids = graph.node_ids()
+    entity_types = _column(graph.node_columns, "entity_type", graph.n_nodes)
+    entity_descriptions = _column(graph.node_columns, "description", graph.n_nodes)
+    relation_descriptions = _column(graph.edge_columns, "description", graph.n_edges)
+    keywords = _column(graph.edge_columns, "keywords", graph.n_edges)
+    weights = _column(graph.edge_columns, "weight", graph.n_edges)
+    sources = graph.edge_src.tolist()
+    targets = graph.edge_dst.tolist()
+
+    members = {}
+    for level, community, parent, title in communities[["level", "community", "parent", "title"]].itertuples(index=False):
+        entry = members.setdefault((int(level), int(community)), {"parent": int(parent), "nodes": set()})
+        index = graph.node_index(title)
+        if index is not None:
+            entry["nodes"].add(index)
+
+    contexts = {}
+    for key, entry in members.items():
+        if len(entry["nodes"]) < COMMUNITY_REPORT_MIN_SIZE:
+            continue
+        nodes = sorted(entry["nodes"], key=lambda index: (-int(degrees[index]), ids[index]))
+        entity_lines = [
+            f"- {ids[index]} ({entity_types[index] or 'UNKNOWN'}): {_description(entity_descriptions[index])}"
+            for index in nodes
+        ]
+        edges = sorted(graph.subgraph_edges(nodes).tolist(), key=lambda edge: -(weights[edge] or 0))
+        relation_lines = [
+            f"- {ids[sources[edge]]} -> {ids[targets[edge]]}: {_description(relation_descriptions[edge])}"
+            + (f" ({keywords[edge]})" if keywords[edge] else "")
+            for edge in edges
+        ]
+        signature = hashlib.sha1(
+            json.dumps([REPORT_VERSION, language, sorted(entity_lines), sorted(relation_lines)], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        contexts[key] = {
+            "level": key[0],
+            "community": key[1],
+            "parent": entry["parent"],
+            "entities": [ids[index] for index in nodes[:REPORT_ENTITIES]],
+            "size": len(nodes),
+            "rank": len(nodes) + len(edges),
+            "entity_lines": entity_lines,
+            "relation_lines": relation_lines,
+            "signature": signature,
+        }
+    return contexts
+
+def _take(lines, budget):
+    taken = []
+    for line in lines:
+        tokens = estimate_tokens(line)
+        if tokens > budget:
+            break
+        taken.append(line)
+        budget -= tokens
+    return taken, budget
+
+# レポート作成用の入力（大きなコミュニティは下位コミュニティのレポートで置き換える）
+def _report_input(context, child_reports):
+    budget = COMMUNITY_REPORT_MAX_INPUT_TOKENS
+    full = estimate_tokens(*context["entity_lines"], *context["relation_lines"])
+    if full > budget and child_reports:
+        entities, unused = _take(context["entity_lines"], budget // 2)
+        reports, _ = _take([f"## Sub-community\n{report['report']}" for report in child_reports], budget - budget // 2 + unused)
+        return "Entities:\n" + "\n".join(entities) + "\n\nSub-community reports:\n" + "\n\n".join(reports)
+    entities, budget = _take(context["entity_lines"], budget)
+    relations, _ = _take(context["relation_lines"], budget)
+    return "Entities:\n" + "\n".join(entities) + "\n\nRelationships:\n" + "\n".join(relations)
+
+def _title(report, context):
+    for line in report.splitlines():
+        line = line.strip().lstrip("#").strip()
+        if line:
+            return line[:100]
+    return ", ".join(context["entities"][:3])
+
+
+_reports = {}
+_reports_lock = threading.Lock()
+
+def load_reports(working_dir):
+    """The stored reports of the dataset (cached until the file changes), or None."""
+    path = reports_path(working_dir)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _reports_lock:
+        cached = _reports.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(path, encoding="utf-8") as f:
+            reports = json.load(f)
+        _reports[path] = (mtime, reports)
+        return reports
+
+def fresh_reports(working_dir, language):
+    """The stored reports when they were built from the current graph in `language`, else None."""
+    graphml = os.path.join(working_dir, GRAPH_FILE)
+    reports = load_reports(working_dir)
+    if reports is None or not reports["reports"] or not os.path.exists(graphml):
+        return None
+    if reports["language"] != language or reports["graph_sha256"] != load_graph(graphml).sha256:
+        return None
+    return reports
+
+def _write_reports(working_dir, reports):
+    path = reports_path(working_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(reports, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+async def refresh_reports(working_dir, llm, language):
+    """
+    Bring the reports up to date with the dataset's NetworkX graph. Reports
+    whose community signature is unchanged are reused; the others are written
+    by `llm` (deepest level first, so parents can use their children's
+    reports). Communities whose report failed are retried on the next call
+    even if the graph is unchanged. Returns the counts, or None when the
+    dataset has no GraphML.
+    """
+    graphml = os.path.join(working_dir, GRAPH_FILE)
+    if not os.path.exists(graphml):
+        return None
+    previous = load_reports(working_dir)
+    graph_sha256 = load_graph(graphml).sha256
+    complete = previous is not None and not previous.get("failed")
+    if complete and previous["graph_sha256"] == graph_sha256 and previous["language"] == language:
+        return {"communities": len(previous["reports"]), "generated": 0, "reused": len(previous["reports"]), "failed": 0}
+
+    contexts = await asyncio.to_thread(community_contexts, working_dir, language)
+    cached = {report["signature"]: report for report in (previous or {}).get("reports", [])}
+    slots = asyncio.Semaphore(COMMUNITY_REPORT_CONCURRENCY)
+    reports = {}
+    counts = {"communities": len(contexts), "generated": 0, "reused": 0, "failed": 0}
+
+    async def generate(key, context):
+        children = sorted(
+            (report for (level, _), report in reports.items() if level == key[0] + 1 and report["parent"] == key[1]),
+            key=lambda report: -report["rank"],
+        )
+        async with slots:
+            try:
+                report = await llm(_report_input(context, children), system_prompt=REPORT_SYSTEM_PROMPT.format(language=language))
+            except Exception as e:
+                print(f"Community report for {context['entities'][:3]} failed: {e}")
+                counts["failed"] += 1
+                return
+        counts["generated"] += 1
+        reports[key] = {**_stored(context), "title": _title(report, context), "report": report.strip()}
+
+    for level in sorted({key[0] for key in contexts}, reverse=True):
+        pending = []
+        for key, context in contexts.items():
+            if key[0] != level:
+                continue
+            if context["signature"] in cached:
+                reports[key] = {**cached[context["signature"]], **_stored(context)}
+                counts["reused"] += 1
+            else:
+                pending.append(generate(key, context))
+        await asyncio.gather(*pending)
+
+    _write_reports(working_dir, {
+        "graph_sha256": graph_sha256,
+        "language": language,
+        "strategy": REPORT_STRATEGY,
+        # 失敗したコミュニティがあれば、グラフが変わらなくても次回に作り直す
+        "failed": counts["failed"],
+        "reports": sorted(reports.values(), key=lambda report: (report["level"], -report["rank"])),
+    })
+    return counts
+
+def _stored(context):
+    return {key: context[key] for key in ["level", "community", "parent", "entities", "size", "rank", "signature"]}
+
+
+# 質問に使うレポート（指定レベルの上位GLOBAL_MAX_REPORTS件）
+def select_reports(reports, level=GLOBAL_QUERY_LEVEL):
+    levels = sorted({report["level"] for report in reports["reports"]})
+    level = max((candidate for candidate in levels if candidate <= level), default=levels[0])
+    selected = [report for report in reports["reports"] if report["level"] == level]
+    return sorted(selected, key=lambda report: -report["rank"])[:GLOBAL_MAX_REPORTS]
+
+def _batches(reports, budget):
+    batches, current, used = [], [], 0
+    for report in reports:
+        text = f"## {report['title']}\n{report['report']}"
+        tokens = estimate_tokens(text)
+        if current and used + tokens > budget:
+            batches.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _parse_points(response):
+    match = re.search(r"\{.*\}", response or "", re.DOTALL)
+    try:
+        points = json.loads(match.group(0))["points"] if match else None
+        return [
+            {"description": str(point["description"]), "score": float(point.get("score", 0))}
+            for point in points
+            if point.get("description")
+        ]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        # JSONで返らなかった場合は回答全体を中程度の重要度の1項目として扱う
+        return [{"description": response.strip(), "score": 50.0}] if response and response.strip() else []
+
+async def global_search(query, reports, llm, language, stream=False):
+    """
+    Map-reduce answer to `query` over the selected community reports. Returns
+    (answer, entities); the answer is an async iterator of chunks with `stream`.
+    """
+    selected = select_reports(reports)
+    system_prompt = MAP_SYSTEM_PROMPT.format(language=language)
+    responses = await asyncio.gather(*[
+        llm(f"Question: {query}\n\nCommunity reports:\n\n" + "\n\n".join(batch), system_prompt=system_prompt)
+        for batch in _batches(selected, GLOBAL_MAP_CONTEXT_TOKENS)
+    ])
+    points = sorted(
+        (point for response in responses for point in _parse_points(response) if point["score"] > 0),
+        key=lambda point: -point["score"],
+    )
+    entities = list(dict.fromkeys(entity for report in selected for entity in report["entities"][:3]))
+    if not points:
+        return NO_ANSWER, entities
+    lines, _ = _take([f"- (importance {point['score']:.0f}) {point['description']}" for point in points], GLOBAL_REDUCE_CONTEXT_TOKENS)
+    answer = await llm(
+        f"Question: {query}\n\nKey points:\n" + "\n".join(lines),
+        system_prompt=REDUCE_SYSTEM_PROMPT.format(language=language),
+        stream=stream,
+    )
+    return answer, entities
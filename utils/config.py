@@ -0,0 +1,57 @@
+import os
+from enum import Enum
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+
+# 環境変数をロード
+load_dotenv()
+
+# 起動時に読み込んでおくデータセット（"dickens:English,tenant1"のようにカンマ区切り、言語の省略時はアプリではJapanese、APIではSERVER_LANGUAGE）
+RAG_HOT_DATASETS = os.getenv("RAG_HOT_DATASETS", "")
+
+# 検索モードの一覧（autoは質問ごとにutils.mode_routerが他のモードから選ぶ）
+AUTO_MODE = "auto"
+SEARCH_MODES = ["naive", "local", "global", "hybrid", "mix", AUTO_MODE]
+
+class ModalType(Enum):
+    TEXT_ONLY = "Text Only"
+    MULTIMODAL = "Multimodal"
+    MULTIMODAL_INPUT = "Multimodal Input"
+    BOTH = "Both"
+
+# 使用するグラフストレージ（NEO4J_URIが設定されていればNeo4j）
+def get_graph_storage():
+    return "Neo4JStorage" if os.getenv("NEO4J_URI") else "NetworkXStorage"
+
+# 近似最近傍検索のベクトルストレージ（utils.ann_storage、faiss-cpuが必要）
+ANN_VECTOR_STORAGE = "AnnVectorDBStorage"
+
+# 使用するベクトルストレージ（既定はLightRAGの全件比較のNanoVectorDBStorage）
+def get_vector_storage():
+    return os.getenv("VECTOR_STORAGE", "NanoVectorDBStorage")
+
+
+@dataclass(frozen=True)
+class RagConfig:
+    """
+    Which dataset the RAG functions work on. `working_dir` is the dataset's
+    index directory; the same config always borrows the same pooled instances.
+    """
+    working_dir: str
+    language: str = "Japanese"
+    graph_storage: str = field(default_factory=get_graph_storage)
+    vector_storage: str = field(default_factory=get_vector_storage)
+
+    @property
+    def pool_key(self):
+        return (self.working_dir, self.language, self.graph_storage, self.vector_storage)
+
+
+def hot_dataset_configs(default_language="Japanese"):
+    """RagConfigs of the RAG_HOT_DATASETS entries (`default_language` for entries without one)."""
+    configs = []
+    for item in RAG_HOT_DATASETS.split(","):
+        working_dir, _, language = item.strip().partition(":")
+        if working_dir:
+            configs.append(RagConfig(working_dir, language.strip() or default_language))
+    return configs
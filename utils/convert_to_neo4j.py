@@ -1,94 +1,362 @@
 import os
 import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from lightrag.utils import xml_to_json
-from neo4j import GraphDatabase
+from utils.graph_store import load_graph
+from utils.neo4j_driver import get_driver, NEO4J_MAX_CONNECTION_POOL_SIZE
 
 load_dotenv()
 
-def create_from_neo4j(working_dir):
-  xml_file = os.path.join(working_dir, "graph_chunk_entity_relation.graphml")
-  json_file = os.path.join(working_dir, "graph_data.json")
+# 定数の設定
+GRAPH_FILE = "graph_chunk_entity_relation.graphml"
+LOAD_STATE_FILE = "neo4j_load_state.json"
+SYNC_STATE_FILE = "neo4j_sync_state.json"
+NEO4J_SYNC_BATCH_SIZE = int(os.getenv("NEO4J_SYNC_BATCH_SIZE", 1000))
+NEO4J_BATCH_SIZE_NODES = int(os.getenv("NEO4J_BATCH_SIZE_NODES", 5000))
+NEO4J_BATCH_SIZE_EDGES = int(os.getenv("NEO4J_BATCH_SIZE_EDGES", 2000))
+NEO4J_LOAD_WORKERS = int(os.getenv("NEO4J_LOAD_WORKERS", 4))
+# キーワードにこれらの語が含まれる関係はその語をリレーションタイプにする
+RELATION_TYPE_KEYWORDS = ["lead", "participate", "uses", "located", "occurs"]
+DEFAULT_ENTITY_LABEL = "UNKNOWN"
+DEFAULT_RELATION_TYPE = "related"
 
-  # Convert XML to JSON
-  json_data = convert_xml_to_json(xml_file, json_file)
-  if json_data is None:
-    return
+# Neo4j queries（動的なラベル/リレーションタイプはNeo4j 5.26以降の構文で、APOCは不要）
+SCHEMA_QUERIES = [
+  "CREATE CONSTRAINT entity_id IF NOT EXISTS FOR (e:Entity) REQUIRE e.id IS UNIQUE",
+  "CREATE INDEX entity_type IF NOT EXISTS FOR (e:Entity) ON (e.entity_type)",
+]
+
+CREATE_NODES_QUERY = """
+UNWIND $rows AS node
+MERGE (e:Entity {id: node.id})
+SET e.entity_type = node.entity_type,
+    e.description = node.description,
+    e.source_id = node.source_id,
+    e.displayName = node.id
+SET e:$(node.label)
+"""
+
+# 端点は一意制約のインデックスで引き、同じ辺は何度流しても1本になるようにMERGEする
+CREATE_EDGES_QUERY = """
+UNWIND $rows AS edge
+MATCH (source:Entity {id: edge.source})
+MATCH (target:Entity {id: edge.target})
+MERGE (source)-[rel:$(edge.type)]->(target)
+SET rel.weight = edge.weight,
+    rel.description = edge.description,
+    rel.keywords = edge.keywords,
+    rel.source_id = edge.source_id
+"""
+
+# 差分同期用: 内容が変わったノードは古いエンティティタイプのラベルを外してから付け直す
+UPSERT_NODES_QUERY = """
+UNWIND $rows AS node
+MERGE (e:Entity {id: node.id})
+SET e.entity_type = node.entity_type,
+    e.description = node.description,
+    e.source_id = node.source_id,
+    e.displayName = node.id
+WITH e, node, [label IN labels(e) WHERE label <> 'Entity' AND label <> node.label] AS stale
+REMOVE e:$(stale)
+SET e:$(node.label)
+"""
+
+DELETE_NODES_QUERY = """
+UNWIND $rows AS node
+MATCH (e:Entity {id: node.id})
+DETACH DELETE e
+"""
+
+# キーワードが変わるとリレーションタイプも変わるため、既存の関係を消して作り直す
+UPSERT_EDGES_QUERY = """
+UNWIND $rows AS edge
+MATCH (source:Entity {id: edge.source})
+MATCH (target:Entity {id: edge.target})
+CALL (source, target) {
+  MATCH (source)-[old]%s(target)
+  DELETE old
+}
+CREATE (source)-[rel:$(edge.type)]->(target)
+SET rel.weight = edge.weight,
+    rel.description = edge.description,
+    rel.keywords = edge.keywords,
+    rel.source_id = edge.source_id
+"""
+
+DELETE_EDGES_QUERY = """
+UNWIND $rows AS edge
+MATCH (:Entity {id: edge.source})-[rel]%s(:Entity {id: edge.target})
+DELETE rel
+"""
+
+
+def _text(attrs, name):
+  return str(attrs.get(name, "")).strip('"')
+
+def relation_type(keywords):
+  for word in RELATION_TYPE_KEYWORDS:
+    if word in keywords:
+      return word
+  return keywords.split(",")[0].replace('"', "").strip() or DEFAULT_RELATION_TYPE
+
+def node_rows(graph, start, stop):
+  ids = graph.node_id.tolist(start, stop)
+  rows = []
+  for node_id, attrs in zip(ids, graph.node_rows(start, stop)):
+    entity_type = _text(attrs, "entity_type")
+    rows.append({
+      "id": node_id.strip('"'),
+      "entity_type": entity_type,
+      "description": _text(attrs, "description"),
+      "source_id": _text(attrs, "source_id"),
+      "label": entity_type or DEFAULT_ENTITY_LABEL,
+    })
+  return rows
+
+def edge_rows(graph, start, stop):
+  ids = graph.node_ids()
+  rows = []
+  sources = graph.edge_src[start:stop].tolist()
+  targets = graph.edge_dst[start:stop].tolist()
+  for source, target, attrs in zip(sources, targets, graph.edge_rows(start, stop)):
+    keywords = _text(attrs, "keywords")
+    rows.append({
+      "source": ids[source].strip('"'),
+      "target": ids[target].strip('"'),
+      "weight": float(attrs.get("weight", 0.0)),
+      "description": _text(attrs, "description"),
+      "keywords": keywords,
+      "source_id": _text(attrs, "source_id"),
+      "type": relation_type(keywords),
+    })
+  return rows
+
+
+class LoadState:
+  """
+  Committed batches of a bulk load, saved in `<working_dir>/neo4j_load_state.json`
+  after every batch. The state is reset when the graph or the batch sizes change.
+  """
+
+  def __init__(self, working_dir, graph_hash, batch_sizes, restart=False):
+    self.path = os.path.join(working_dir, LOAD_STATE_FILE)
+    self._lock = threading.Lock()
+    saved = {}
+    if not restart and os.path.exists(self.path):
+      with open(self.path, encoding="utf-8") as f:
+        saved = json.load(f)
+    if saved.get("graph_sha256") != graph_hash or saved.get("batch_sizes") != batch_sizes:
+      saved = {}
+    self.data = {
+      "graph_sha256": graph_hash,
+      "batch_sizes": batch_sizes,
+      "done": {kind: sorted(saved.get("done", {}).get(kind, [])) for kind in batch_sizes},
+      "completed": saved.get("completed", False),
+    }
+
+  def done(self, kind):
+    return set(self.data["done"][kind])
+
+  def commit(self, kind, batch):
+    with self._lock:
+      self.data["done"][kind].append(batch)
+      self._save()
+
+  def complete(self):
+    with self._lock:
+      self.data["completed"] = True
+      self._save()
+
+  def _save(self):
+    tmp_path = f"{self.path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+      json.dump(self.data, f)
+    os.replace(tmp_path, self.path)
 
-  # Load nodes and edges
-  nodes = json_data.get("nodes", [])
-  edges = json_data.get("edges", [])
-
-  # Noe4j queries
-  create_nodes_query = """
-  UNWIND $nodes AS node
-  MERGE (e:Entity {id: node.id})
-  SET e.entity_type = node.entity_type,
-      e.description = node.description,
-      e.source_id = node.source_id,
-      e.displayName = node.id
-  REMOVE e:Entity
-  WITH e, node
-  CALL apoc.create.addLabels(e, [node.id]) YIELD node AS labeledNode
-  RETURN count(*)
+
+def print_progress(kind, done, total, rows, elapsed):
+  rate = rows / elapsed if elapsed else 0.0
+  print(f"[neo4j] {kind}: {done}/{total} batches ({rows} rows, {rate:.0f} rows/s)")
+
+def ensure_schema(driver):
+  with driver.session() as session:
+    for query in SCHEMA_QUERIES:
+      session.run(query).consume()
+    session.run("CALL db.awaitIndexes(300)").consume()
+
+def _write_batch(driver, query, rows):
+  # 1バッチ = 1トランザクション（デッドロックなどの一時的なエラーはドライバーが再試行する）
+  with driver.session() as session:
+    session.execute_write(lambda tx: tx.run(query, rows=rows).consume())
+  return len(rows)
+
+def _load_batches(driver, state, kind, query, make_rows, total_rows, batch_size, workers, progress):
+  total = (total_rows + batch_size - 1) // batch_size
+  committed = state.done(kind)
+  batches = [batch for batch in range(total) if batch not in committed]
+  done = total - len(batches)
+  rows = 0
+  start = time.perf_counter()
+  futures = {}
+  error = None
+
+  def collect(finished):
+    nonlocal done, rows, error
+    batch = futures.pop(finished)
+    try:
+      rows += finished.result()
+    except Exception as e:
+      error = error or e
+      return
+    state.commit(kind, batch)
+    done += 1
+    progress(kind, done, total, rows, time.perf_counter() - start)
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    for batch in batches:
+      if error:
+        break
+      # 送信待ちのバッチは並列数の2倍までに抑え、全件をメモリに載せない
+      if len(futures) >= workers * 2:
+        collect(next(as_completed(futures)))
+      batch_rows = make_rows(batch * batch_size, (batch + 1) * batch_size)
+      futures[executor.submit(_write_batch, driver, query, batch_rows)] = batch
+    # 失敗したバッチがあっても、実行中のバッチはコミットを記録してから止める
+    for finished in as_completed(list(futures)):
+      collect(finished)
+  if error:
+    raise error
+  return rows
+
+def bulk_load(working_dir, driver, batch_size_nodes=NEO4J_BATCH_SIZE_NODES, batch_size_edges=NEO4J_BATCH_SIZE_EDGES,
+              workers=NEO4J_LOAD_WORKERS, restart=False, progress=print_progress):
   """
+  Load the dataset's knowledge graph into Neo4j in per-batch transactions.
 
-  create_edges_query = """
-  UNWIND $edges AS edge
-  MATCH (source {id: edge.source})
-  MATCH (target {id: edge.target})
-  WITH source, target, edge,
-    CASE
-      WHEN edge.keywords CONTAINS 'lead' THEN 'lead'
-      WHEN edge.keywords CONTAINS 'participate' THEN 'participate'
-      WHEN edge.keywords CONTAINS 'uses' THEN 'uses'
-      WHEN edge.keywords CONTAINS 'located' THEN 'located'
-      WHEN edge.keywords CONTAINS 'occurs' THEN 'occurs'
-      ELSE REPLACE(SPLIT(edge,keywords, ',')[0], '\"', '')
-    END AS relType
-  CALL apoc.create.relationship(source, relType, {
-    weight: edge.weight,
-    description: edge.description,
-    keywords: edge.keywords,
-    source_id: edge.source_id
-  }, target) YIELD rel
-  RETURN count(*)
+  The uniqueness constraint on `(:Entity {id})` is created first so edges
+  find their endpoints through the index. Nodes and then edges are read
+  from the graph snapshot batch by batch and written by `workers` parallel
+  sessions. Committed batches are recorded (see LoadState), so an
+  interrupted load resumes where it stopped; all writes are MERGEs, so
+  replaying a batch is harmless. Returns the number of rows written.
   """
+  graph = load_graph(os.path.join(working_dir, GRAPH_FILE))
+  state = LoadState(working_dir, graph.sha256, {"nodes": batch_size_nodes, "edges": batch_size_edges}, restart)
+  if state.data["completed"]:
+    print(f"[neo4j] {working_dir} is already loaded (graph {graph.sha256[:12]})")
+    return {"nodes": 0, "edges": 0}
+  ensure_schema(driver)
+  written = {
+    "nodes": _load_batches(driver, state, "nodes", CREATE_NODES_QUERY, lambda start, stop: node_rows(graph, start, stop),
+                           graph.n_nodes, batch_size_nodes, workers, progress),
+    "edges": _load_batches(driver, state, "edges", CREATE_EDGES_QUERY, lambda start, stop: edge_rows(graph, start, stop),
+                           graph.n_edges, batch_size_edges, workers, progress),
+  }
+  state.complete()
+  _write_sync_state(working_dir, graph_digests(graph))
+  return written
+
+def _digest(row):
+  return hashlib.blake2b(json.dumps(row, sort_keys=True, ensure_ascii=False).encode("utf-8"), digest_size=8).hexdigest()
+
+def _keyed_rows(graph, kind, chunk_size=NEO4J_SYNC_BATCH_SIZE):
+  # 無向グラフの辺は端点の向きが保存ごとに入れ替わることがあるため、キーは端点をソートして作る
+  total, make_rows = (graph.n_nodes, node_rows) if kind == "nodes" else (graph.n_edges, edge_rows)
+  for start in range(0, total, chunk_size):
+    for row in make_rows(graph, start, start + chunk_size):
+      if kind == "nodes":
+        key = row["id"]
+      else:
+        if not graph.directed and row["source"] > row["target"]:
+          row["source"], row["target"] = row["target"], row["source"]
+        key = f"{row['source']}\t{row['target']}"
+      yield key, _digest(row), row
+
+def graph_digests(graph):
+  digests = {"graph_sha256": graph.sha256}
+  for kind in ["nodes", "edges"]:
+    digests[kind] = {key: digest for key, digest, _ in _keyed_rows(graph, kind)}
+  return digests
 
-  set_displayname_and_labels_query = """
-  MATCH (n)
-  SET n.displayName = n.id
-  WITH n
-  CALL apoc.create.setLabels(n, [n.entity_type]) YIELD node
-  RETURN count(*)
+def diff_graph(graph, previous):
   """
+  Compare the graph with the digests of the last sync.
+  Returns (digests, changed rows, removed keys); changed rows include additions.
+  """
+  digests = {"graph_sha256": graph.sha256}
+  changed, removed = {}, {}
+  for kind in ["nodes", "edges"]:
+    old = previous.get(kind, {})
+    digests[kind], changed[kind] = {}, []
+    for key, digest, row in _keyed_rows(graph, kind):
+      digests[kind][key] = digest
+      if old.get(key) != digest:
+        changed[kind].append(row)
+    removed[kind] = [key for key in old if key not in digests[kind]]
+  return digests, changed, removed
+
+def _read_sync_state(working_dir):
+  path = os.path.join(working_dir, SYNC_STATE_FILE)
+  if not os.path.exists(path):
+    return {}
+  with open(path, encoding="utf-8") as f:
+    return json.load(f)
+
+def _write_sync_state(working_dir, digests):
+  path = os.path.join(working_dir, SYNC_STATE_FILE)
+  with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+    json.dump(digests, f, ensure_ascii=False)
+  os.replace(f"{path}.tmp", path)
+
+def sync_graph(working_dir, driver, batch_size=NEO4J_SYNC_BATCH_SIZE, progress=print_progress):
+  """
+  Push only the nodes and edges that changed since the last sync (or bulk load).
 
-  # Create a Neo4j driver
-  NEO4J_URI = os.getenv("NEO4J_URI")
-  NEO4J_USERNAME = os.getenv("NEO4J_USERNAME")
-  NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
-  driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
-  BATCH_SIZE_NODES = 500
-  BATCH_SIZE_EDGES = 100
+  Per-row digests of the synced graph are kept in `<working_dir>/neo4j_sync_state.json`
+  and are replaced only after every batch is written, so a failed sync is
+  simply retried against the same baseline. Returns the number of rows per step.
+  """
+  graph = load_graph(os.path.join(working_dir, GRAPH_FILE))
+  previous = _read_sync_state(working_dir)
+  if previous.get("graph_sha256") == graph.sha256:
+    print(f"[neo4j] {working_dir} is up to date (graph {graph.sha256[:12]})")
+    return {}
+  digests, changed, removed = diff_graph(graph, previous)
+  direction = "->" if graph.directed else "-"
+  steps = [
+    ("upsert nodes", UPSERT_NODES_QUERY, changed["nodes"]),
+    ("delete edges", DELETE_EDGES_QUERY % direction,
+     [dict(zip(["source", "target"], key.split("\t"))) for key in removed["edges"]]),
+    ("upsert edges", UPSERT_EDGES_QUERY % direction, changed["edges"]),
+    ("delete nodes", DELETE_NODES_QUERY, [{"id": key} for key in removed["nodes"]]),
+  ]
+  ensure_schema(driver)
+  for kind, query, rows in steps:
+    total = (len(rows) + batch_size - 1) // batch_size
+    start = time.perf_counter()
+    for batch in range(total):
+      _write_batch(driver, query, rows[batch * batch_size:(batch + 1) * batch_size])
+      progress(kind, batch + 1, total, min((batch + 1) * batch_size, len(rows)), time.perf_counter() - start)
+  _write_sync_state(working_dir, digests)
+  return {kind: len(rows) for kind, _, rows in steps}
 
+def create_from_neo4j(working_dir, sync=False, **kwargs):
+  if not os.path.exists(os.path.join(working_dir, GRAPH_FILE)):
+    print(f"Error: File not found - {os.path.join(working_dir, GRAPH_FILE)}")
+    return
+  # 共有ドライバーのコネクションプールを使うため、並列数はプールサイズまでに抑える
+  if "workers" in kwargs:
+    kwargs["workers"] = min(kwargs["workers"], NEO4J_MAX_CONNECTION_POOL_SIZE)
   try:
-    # Execute queries in batches
-    with driver.session() as session:
-      # Insert nodes in batches
-      session.execute_write(
-        process_in_batches, create_nodes_query, nodes, BATCH_SIZE_NODES
-      )
-      # Insert edges in batches
-      session.execute_write(
-        process_in_batches, create_edges_query, edges, BATCH_SIZE_EDGES
-      )
-
-      # Set displayName and labels
-      session.run(set_displayname_and_labels_query)
+    if sync:
+      return sync_graph(working_dir, get_driver(), **kwargs)
+    return bulk_load(working_dir, get_driver(), **kwargs)
   except Exception as e:
     print(f"Error occured: {e}")
-  finally:
-    driver.close()
 
 def convert_xml_to_json(xml_path, output_path):
   """Convert XML file to JSON and saves the output."""
@@ -96,7 +364,7 @@ def convert_xml_to_json(xml_path, output_path):
     print(f"Error: File not found - {xml_path}")
     return
 
-  json_data = xml_to_json(xml_path)
+  json_data = graph_to_json(xml_path)
   if json_data:
     with open(output_path, "w", encoding="utf-8") as f:
       json.dump(json_data, f, ensure_ascii=False, indent=2)
@@ -105,8 +373,50 @@ def convert_xml_to_json(xml_path, output_path):
       print("Failed to create JSON data")
       return
 
-def process_in_batches(tx, query, data, batch_size):
-  """Process data in batches and execute the given query."""
-  for i in range(0, len(data), batch_size):
-    batch = data[i : i + batch_size]
-    tx.run(query, {"nodes": batch} if "nodes" in query else {"edges": batch})
+def graph_to_json(graphml_path):
+  """Build the nodes/edges JSON of a GraphML file from its binary snapshot."""
+  graph = load_graph(graphml_path)
+  ids = graph.node_ids()
+  nodes = [
+    {
+      "id": node_id.strip('"'),
+      "entity_type": _text(attrs, "entity_type"),
+      "description": _text(attrs, "description"),
+      "source_id": _text(attrs, "source_id"),
+    }
+    for node_id, attrs in zip(ids, graph.node_rows())
+  ]
+  edges = [
+    {
+      "source": ids[source].strip('"'),
+      "target": ids[target].strip('"'),
+      "weight": float(attrs.get("weight", 0.0)),
+      "description": _text(attrs, "description"),
+      "keywords": _text(attrs, "keywords"),
+      "source_id": _text(attrs, "source_id"),
+    }
+    for source, target, attrs in zip(graph.edge_src.tolist(), graph.edge_dst.tolist(), graph.edge_rows())
+  ]
+  return {"nodes": nodes, "edges": edges}
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Bulk load a dataset's knowledge graph into Neo4j")
+  parser.add_argument("working_dir", help="dataset directory containing graph_chunk_entity_relation.graphml")
+  parser.add_argument("--batch-size-nodes", type=int, default=NEO4J_BATCH_SIZE_NODES)
+  parser.add_argument("--batch-size-edges", type=int, default=NEO4J_BATCH_SIZE_EDGES)
+  parser.add_argument("--workers", type=int, default=NEO4J_LOAD_WORKERS)
+  parser.add_argument("--restart", action="store_true", help="ignore the saved progress and load every batch again")
+  parser.add_argument("--sync", action="store_true", help="push only the changes since the last load or sync")
+  parser.add_argument("--batch-size-sync", type=int, default=NEO4J_SYNC_BATCH_SIZE)
+  args = parser.parse_args()
+  if args.sync:
+    create_from_neo4j(args.working_dir, sync=True, batch_size=args.batch_size_sync)
+  else:
+    create_from_neo4j(
+      args.working_dir,
+      batch_size_nodes=args.batch_size_nodes,
+      batch_size_edges=args.batch_size_edges,
+      workers=args.workers,
+      restart=args.restart,
+    )
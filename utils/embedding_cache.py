@@ -0,0 +1,226 @@
+import os
+import re
+import fcntl
+import asyncio
+import contextlib
+import hashlib
+import numpy as np
+from dotenv import load_dotenv
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./cache/embeddings")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", 5))
+# 索引ファイルの1行（"<sha1> <行番号>"）。固定長なので書きかけで途切れた行は読み飛ばせる
+INDEX_LINE = "{} {:012d}\n"
+INDEX_LINE_LENGTH = len(INDEX_LINE.format("0" * 40, 0))
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Append-only on-disk store of float32 vectors for one (model, dim), shared
+    by every process using the same cache directory.
+
+    Vectors are written to `<model>_<dim>.f32` and read back through a memory
+    map; `<model>_<dim>.idx` holds one "<text hash> <row>" line per vector.
+    Writers take an exclusive lock on `<model>_<dim>.lock` and place new rows
+    at the end of the vector file, so concurrent writers never share a row;
+    each store picks up the rows written by others from the tail of the index.
+    Keys are text hashes (see text_hash).
+    """
+
+    def __init__(self, cache_dir, model, dim):
+        name = "{}_{}".format(re.sub(r"[^\w.-]", "_", model), dim)
+        self.dim = dim
+        self.row_bytes = 4 * dim
+        self.vectors_path = os.path.join(cache_dir, f"{name}.f32")
+        self.index_path = os.path.join(cache_dir, f"{name}.idx")
+        self.lock_path = os.path.join(cache_dir, f"{name}.lock")
+        self._rows = {}
+        self._index_offset = 0
+        self._matrix = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self._refresh()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # ベクトルファイルに書き終わっている行数（中断された書き込みの端数は次の書き込みで上書きされる）
+    def _stored_rows(self):
+        try:
+            return os.path.getsize(self.vectors_path) // self.row_bytes
+        except FileNotFoundError:
+            return 0
+
+    # 索引ファイルの前回読んだ位置より後に追記された行を取り込む（書きかけの最終行は次回に回す）
+    def _refresh(self):
+        try:
+            with open(self.index_path, "rb") as f:
+                f.seek(self._index_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].decode("ascii", errors="replace").splitlines(keepends=True):
+            if len(line) == INDEX_LINE_LENGTH and line[41:-1].isdigit():
+                self._rows.setdefault(line[:40], int(line[41:-1]))
+        self._index_offset += complete
+
+    def _mapped(self, row):
+        if self._matrix is None or row >= len(self._matrix):
+            rows = self._stored_rows()
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._matrix
+
+    def get_many(self, keys):
+        if any(key not in self._rows for key in keys):
+            self._refresh()
+        found = {key: self._rows[key] for key in keys if key in self._rows}
+        if not found:
+            return {}
+        matrix = self._mapped(max(found.values()))
+        return {key: np.array(matrix[row]) for key, row in found.items()}
+
+    def put_many(self, keys, vectors):
+        if all(key in self._rows for key in keys):
+            return
+        with self._locked():
+            # ロック中に他のプロセスが書いた分を読み込み、まだ無いものだけを書き足す
+            self._refresh()
+            new = {}
+            for key, vector in zip(keys, vectors):
+                if key not in self._rows and key not in new:
+                    new[key] = vector
+            if not new:
+                return
+            start = self._stored_rows()
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(start * self.row_bytes)
+                f.write(np.asarray(list(new.values()), dtype=np.float32).tobytes())
+            # 索引はベクトルを書き終えてから追記する（索引に現れた行は必ず読める）
+            with open(self.index_path, "ab") as f:
+                if f.tell() and not self._ends_with_newline():
+                    f.write(b"\n")
+                f.write("".join(INDEX_LINE.format(key, start + offset) for offset, key in enumerate(new)).encode("ascii"))
+            self._refresh()
+
+    def _ends_with_newline(self):
+        with open(self.index_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def __len__(self):
+        return len(self._rows)
+
+
+class EmbeddingCache:
+    """
+    Cached, batching front end for an async embedding function.
+
+    Texts already embedded with the same (model, dim) are served from the
+    EmbeddingStore. The remaining texts of concurrent calls are coalesced into
+    requests of up to `batch_size` texts, waiting at most `batch_wait_ms` for a
+    batch to fill. Must be used from a single event loop.
+    """
+
+    def __init__(self, func, model, dim, cache_dir=EMBEDDING_CACHE_DIR,
+                 batch_size=EMBEDDING_BATCH_SIZE, batch_wait_ms=EMBEDDING_BATCH_WAIT_MS):
+        self.func = func
+        self.dim = dim
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.store = EmbeddingStore(cache_dir, model, dim)
+        self._queue = []
+        self._pending = {}
+        self._flush_handle = None
+        self._tasks = set()
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self.batches = 0
+
+    async def embed(self, texts):
+        self.requests += 1
+        keys = [text_hash(text) for text in texts]
+        vectors = self.store.get_many(set(keys))
+        self.hits += sum(1 for key in keys if key in vectors)
+
+        loop = asyncio.get_running_loop()
+        waiting = {}
+        for key, text in zip(keys, texts):
+            if key in vectors or key in waiting:
+                continue
+            self.misses += 1
+            if key not in self._pending:
+                self._pending[key] = loop.create_future()
+                self._queue.append((key, text))
+            waiting[key] = self._pending[key]
+
+        if waiting:
+            if len(self._queue) >= self.batch_size:
+                self._flush_now(loop)
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.batch_wait, self._flush_now, loop)
+            results = await asyncio.gather(*waiting.values())
+            vectors.update(zip(waiting.keys(), results))
+        return np.stack([vectors[key] for key in keys]) if keys else np.empty((0, self.dim), dtype=np.float32)
+
+    def _flush_now(self, loop):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._queue:
+            batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+            task = loop.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        self.batches += 1
+        keys = [key for key, _ in batch]
+        error = None
+        try:
+            result = await self.func([text for _, text in batch])
+            if len(result) != len(keys):
+                raise ValueError(f"Embedding function returned {len(result)} vectors for {len(keys)} texts")
+            self.store.put_many(keys, result)
+            for key, vector in zip(keys, result):
+                future = self._pending.pop(key)
+                if not future.done():
+                    future.set_result(np.asarray(vector, dtype=np.float32))
+        except Exception as e:
+            error = e
+        finally:
+            # 失敗や取り消しで結果を受け取れなかった呼び出しを待たせたままにしない
+            for key in keys:
+                future = self._pending.pop(key, None)
+                if future is None or future.done():
+                    continue
+                if error is None:
+                    future.cancel()
+                else:
+                    future.set_exception(error)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "stored_vectors": len(self.store),
+            "requests": self.requests,
+            "hits": self.hits,
+            "misses": self.misses,
+            "api_batches": self.batches,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,380 @@
+import os
+import numpy as np
+from utils.community_cache import GRAPH_FILE, load_communities, strategy_key
+from utils.graph_store import load_graph
+
+# 定数の設定
+LAYOUT_CACHE_DIR = "layout"
+LAYOUT_ITERATIONS = 60
+# 斥力計算で一度に作るペア数の上限（メモリ使用量を抑えるためブロックに分けて計算する）
+LAYOUT_BLOCK = 4_000_000
+# 要素数がこれを超えるフレームは、孤立した要素を1つの円にまとめ、斥力を近傍と標本から近似する
+LAYOUT_DENSE_ITEMS = 256
+LAYOUT_REPULSION_SAMPLES = 32
+GOLDEN_ANGLE = np.pi * (3 - np.sqrt(5))
+
+
+def layout_cache_path(working_dir, strategy):
+    return os.path.join(working_dir, LAYOUT_CACHE_DIR, f"{strategy_key(strategy)}.npz")
+
+def _scatter_add(index, values, n):
+    return np.column_stack([np.bincount(index, weights=values[:, axis], minlength=n) for axis in range(2)])
+
+# ひまわり状の配置（辺がない場合に使う）
+def spiral_layout(n):
+    index = np.arange(n)
+    radius = np.sqrt((index + 0.5) / max(n, 1))
+    theta = index * GOLDEN_ANGLE
+    return np.column_stack([radius * np.cos(theta), radius * np.sin(theta)])
+
+# グループごとに重心を原点へ移し、（円の半径を含めて）単位円に収める
+def _normalize(pos, mask, radii):
+    counts = mask.sum(axis=1)
+    pos = pos - (pos.sum(axis=1) / np.maximum(counts, 1)[:, None])[:, None, :]
+    pos = pos * mask[..., None]
+    extent = (np.linalg.norm(pos, axis=-1) + radii) * mask
+    scale = extent.max(axis=1)
+    scale = np.where(scale > 0, scale, 1.0)
+    return pos / scale[:, None, None], radii / scale[:, None]
+
+def _pairs(pos, mask, start, stop):
+    delta = pos[start:stop, :, None, :] - pos[start:stop, None, :, :]
+    return delta, mask[start:stop, None, :] & mask[start:stop, :, None]
+
+# 距離がreach未満になりうる要素の組（格子に分けて、同じセルと隣のセルの要素だけを調べる）
+def _near_pairs(pos, reach):
+    cells = np.floor(pos / reach).astype(np.int64)
+    keys = (cells[:, 0] << 32) + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    pairs_i, pairs_j = [], []
+    for dx, dy in [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]:
+        target = keys + (dx << 32) + dy
+        lo = np.searchsorted(sorted_keys, target, side="left")
+        counts = np.searchsorted(sorted_keys, target, side="right") - lo
+        i = np.repeat(np.arange(len(pos)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(lo, counts) + offsets]
+        keep = i < j if (dx, dy) == (0, 0) else np.ones(len(i), dtype=bool)
+        pairs_i.append(i[keep])
+        pairs_j.append(j[keep])
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+def sampled_force_layout(n, src, dst, iterations=LAYOUT_ITERATIONS, samples=LAYOUT_REPULSION_SAMPLES, seed=0):
+    """
+    Fruchterman-Reingold layout of one large graph in O(n) memory per step.
+
+    Repulsion is exact between nodes closer than 2k (found on a grid) and
+    estimated from `samples` random nodes per node beyond that; attraction
+    along the edges is exact. Returns positions of shape (n, 2).
+    """
+    rng = np.random.default_rng(seed)
+    pos = rng.uniform(-1, 1, size=(n, 2))
+    k2 = 1.0 / n
+    reach = 2 * np.sqrt(k2)
+    samples = min(samples, n - 1)
+    temperature = 0.1
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        i, j = _near_pairs(pos, reach)
+        delta = pos[i] - pos[j]
+        force = delta * (k2 / np.maximum((delta ** 2).sum(axis=1), 1e-12))[:, None]
+        disp = _scatter_add(i, force, n) - _scatter_add(j, force, n)
+        # 遠くの要素からの斥力は標本の平均から見積もる（近傍として計算済みの組は除く）
+        others = rng.integers(0, n - 1, size=(n, samples))
+        others += others >= np.arange(n)[:, None]
+        delta = pos[:, None, :] - pos[others]
+        dist2 = np.maximum((delta ** 2).sum(axis=-1), 1e-12)
+        far = dist2 >= reach ** 2
+        disp += (delta * (k2 / dist2 * far)[..., None]).sum(axis=1) * ((n - 1) / samples)
+        delta = pos[src] - pos[dst]
+        force = delta * (np.linalg.norm(delta, axis=1) / np.sqrt(k2))[:, None]
+        disp += _scatter_add(dst, force, n) - _scatter_add(src, force, n)
+        length = np.maximum(np.linalg.norm(disp, axis=-1), 1e-12)
+        pos += disp * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+    return pos
+
+def batched_force_layout(counts, size, src, dst, iterations=LAYOUT_ITERATIONS, seed=0):
+    """
+    Fruchterman-Reingold layout of many small graphs at once.
+
+    Graph `b` has `counts[b]` nodes stored in slots `b * size .. b * size + counts[b] - 1`;
+    `src` / `dst` are edges in those flat slot numbers. Returns positions of
+    shape (len(counts), size, 2); padding slots stay at the origin.
+    """
+    batch = len(counts)
+    mask = np.arange(size)[None, :] < counts[:, None]
+    pos = np.random.default_rng(seed).uniform(-1, 1, size=(batch, size, 2)) * mask[..., None]
+    k2 = 1.0 / np.maximum(counts, 1)
+    k = np.sqrt(k2)[src // size]
+    # 斥力は (グループ, ノード, ノード) の配列をブロックに分けて計算する
+    step = max(1, LAYOUT_BLOCK // (size * size))
+    temperature = 0.1
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        disp = np.zeros_like(pos)
+        for start in range(0, batch, step):
+            delta, pair_mask = _pairs(pos, mask, start, start + step)
+            dist2 = np.maximum((delta ** 2).sum(axis=-1), 1e-12)
+            disp[start:start + step] = (delta * (k2[start:start + step, None, None] / dist2 * pair_mask)[..., None]).sum(axis=2)
+        # 引力（d^2 / k）は辺の両端に逆向きに加える
+        flat = pos.reshape(-1, 2)
+        delta = flat[src] - flat[dst]
+        force = delta * (np.linalg.norm(delta, axis=1) / k)[:, None]
+        disp += (_scatter_add(dst, force, batch * size) - _scatter_add(src, force, batch * size)).reshape(batch, size, 2)
+        length = np.maximum(np.linalg.norm(disp, axis=-1), 1e-12)
+        pos += disp * (np.minimum(length, temperature) / length)[..., None] * mask[..., None]
+        temperature -= cooling
+    return pos
+
+# 円同士が重ならないように押し広げる
+def _separate(pos, mask, radii, iterations=50):
+    batch, size = mask.shape
+    step = max(1, LAYOUT_BLOCK // (size * size))
+    for _ in range(iterations):
+        push = np.zeros_like(pos)
+        for start in range(0, batch, step):
+            delta, pair_mask = _pairs(pos, mask, start, start + step)
+            dist = np.maximum(np.linalg.norm(delta, axis=-1), 1e-9)
+            overlap = np.maximum(radii[start:start + step, :, None] + radii[start:start + step, None, :] - dist, 0)
+            overlap *= pair_mask & ~np.eye(size, dtype=bool)
+            push[start:start + step] = (delta * (overlap / dist / 2)[..., None]).sum(axis=2)
+        if not push.any():
+            break
+        pos = pos + push
+    return pos
+
+# 重なりの解消（要素数が多いフレーム用。近い組だけを調べる）
+def _separate_sparse(pos, radii, iterations=50):
+    n = len(pos)
+    for _ in range(iterations):
+        i, j = _near_pairs(pos, 2 * radii.max())
+        delta = pos[i] - pos[j]
+        dist = np.maximum(np.linalg.norm(delta, axis=1), 1e-9)
+        overlap = np.maximum(radii[i] + radii[j] - dist, 0)
+        if not overlap.any():
+            break
+        push = delta * (overlap / dist / 2)[:, None]
+        pos = pos + _scatter_add(i, push, n) - _scatter_add(j, push, n)
+    return pos
+
+def _item_radii(sizes):
+    sizes = np.asarray(sizes, dtype=np.float64)
+    return 0.5 / np.sqrt(len(sizes)) * np.sqrt(sizes / sizes.mean())
+
+def _layout_large(sizes, src, dst, seed=0):
+    n = len(sizes)
+    pos = sampled_force_layout(n, src, dst, seed=seed)
+    radii = _item_radii(sizes)
+    pos = pos + np.random.default_rng(seed).normal(scale=1e-6, size=pos.shape)
+    pos, radii = _normalize(_separate_sparse(pos, radii)[None], np.ones((1, n), dtype=bool), radii[None])
+    return pos[0], radii[0]
+
+# 辺を持たない要素を1つの要素にまとめる（まとめた要素は最後の番号になる）
+def _collapse_isolated(sizes, src, dst):
+    sizes = np.asarray(sizes, dtype=np.float64)
+    degree = np.bincount(np.concatenate([src, dst]).astype(np.int64), minlength=len(sizes))
+    isolated = np.flatnonzero(degree == 0)
+    if len(isolated) < 2:
+        return (sizes, src, dst), None
+    connected = np.flatnonzero(degree > 0)
+    remap = np.full(len(sizes), -1, dtype=np.int64)
+    remap[connected] = np.arange(len(connected))
+    collapsed = np.append(sizes[connected], sizes[isolated].sum())
+    return (collapsed, remap[src], remap[dst]), (sizes, connected, isolated)
+
+# まとめた円の中に孤立した要素をひまわり状に並べる（大きいものほど中心寄り）
+def _expand_isolated(placed, collapsed):
+    pos, radii = placed
+    sizes, connected, isolated = collapsed
+    out_pos = np.zeros((len(sizes), 2))
+    out_radii = np.zeros(len(sizes))
+    out_pos[connected] = pos[:-1]
+    out_radii[connected] = radii[:-1]
+    order = isolated[np.argsort(-sizes[isolated], kind="stable")]
+    item_radii = radii[-1] * np.minimum(_item_radii(sizes[order]), 0.5 / np.sqrt(len(order)))
+    out_pos[order] = pos[-1] + spiral_layout(len(order)) * (radii[-1] - item_radii.max())
+    out_radii[order] = item_radii
+    return out_pos, out_radii
+
+def layout_groups(groups, seed=0):
+    """
+    Lay out several groups of items as non-overlapping discs in the unit disc.
+
+    `groups` is a list of (sizes, src, dst) where `sizes` weighs each item (a
+    community's node count, 1 for a single node) and `src` / `dst` are edges
+    between item indices. Groups are bucketed by padded size and laid out
+    together with batched_force_layout. In groups of more than
+    LAYOUT_DENSE_ITEMS items the items without edges share one disc, and if
+    the group is still that large it is laid out with sampled_force_layout.
+    Returns a list of (positions, radii).
+    """
+    results = [None] * len(groups)
+    buckets = {}
+    collapsed = {}
+    groups = list(groups)
+    for index, (sizes, src, dst) in enumerate(groups):
+        if len(sizes) > LAYOUT_DENSE_ITEMS:
+            groups[index], collapsed[index] = _collapse_isolated(sizes, src, dst)
+            sizes, src, dst = groups[index]
+        if len(sizes) == 1:
+            results[index] = (np.zeros((1, 2)), np.array([0.9]))
+        elif len(sizes) > LAYOUT_DENSE_ITEMS:
+            results[index] = _layout_large(sizes, src, dst, seed)
+        else:
+            buckets.setdefault(1 << (len(sizes) - 1).bit_length(), []).append(index)
+    for size, members in buckets.items():
+        counts = np.array([len(groups[index][0]) for index in members])
+        src = np.concatenate([groups[index][1] + slot * size for slot, index in enumerate(members)]).astype(np.int64)
+        dst = np.concatenate([groups[index][2] + slot * size for slot, index in enumerate(members)]).astype(np.int64)
+        pos = batched_force_layout(counts, size, src, dst, seed=seed)
+        mask = np.arange(size)[None, :] < counts[:, None]
+        radii = np.zeros(mask.shape)
+        for slot, index in enumerate(members):
+            sizes, group_src, _ = groups[index]
+            n = len(sizes)
+            if len(group_src) == 0:
+                pos[slot, :n] = spiral_layout(n)
+            radii[slot, :n] = _item_radii(sizes)
+        # 位置が重なった要素は決定的に少しずらす
+        pos = pos + np.random.default_rng(seed).normal(scale=1e-6, size=pos.shape) * mask[..., None]
+        pos, radii = _normalize(_separate(pos, mask, radii), mask, radii)
+        for slot, index in enumerate(members):
+            n = counts[slot]
+            results[index] = (pos[slot, :n], radii[slot, :n])
+    for index, group in collapsed.items():
+        if group is not None:
+            results[index] = _expand_isolated(results[index], group)
+    return results
+
+def force_layout(n, src, dst, iterations=LAYOUT_ITERATIONS, seed=0):
+    """Fruchterman-Reingold layout of one graph, fitted into the unit disc."""
+    if n <= 1:
+        return np.zeros((n, 2))
+    if len(src) == 0:
+        return spiral_layout(n)
+    mask = np.ones((1, n), dtype=bool)
+    if n > LAYOUT_DENSE_ITEMS:
+        pos = sampled_force_layout(n, np.asarray(src), np.asarray(dst), iterations, seed=seed)[None]
+    else:
+        pos = batched_force_layout(np.array([n]), n, np.asarray(src), np.asarray(dst), iterations, seed)
+    return _normalize(pos, mask, np.zeros((1, n)))[0][0]
+
+
+# コミュニティ表から、レベルごとに各ノードが属するコミュニティIDの配列を作る
+def community_paths(graph, communities):
+    levels = int(communities["level"].max()) + 1 if len(communities) else 0
+    paths = np.full((max(levels, 1), graph.n_nodes), -1, dtype=np.int64)
+    parents = {}
+    for row in communities[["level", "community", "parent", "title"]].itertuples(index=False):
+        index = graph.node_index(row.title)
+        if index is not None:
+            paths[row.level, index] = row.community
+        parents[row.community] = (row.level, row.parent)
+    n_communities = max(parents) + 1 if parents else 0
+    level = np.zeros(n_communities, dtype=np.int64)
+    parent = np.full(n_communities, -1, dtype=np.int64)
+    for community, (community_level, community_parent) in parents.items():
+        level[community] = community_level
+        parent[community] = community_parent
+    # どのコミュニティにも属さないノード（孤立ノードなど）は最上位の1つのグループにまとめる
+    unclustered = paths[0] < 0
+    if unclustered.any():
+        paths[0, unclustered] = n_communities
+        level = np.append(level, 0)
+        parent = np.append(parent, -1)
+    return paths, level, parent
+
+def _groups(keys):
+    """Return {key: positions} for the distinct values of `keys`."""
+    order = np.argsort(keys, kind="stable")
+    bounds = np.flatnonzero(np.diff(keys[order])) + 1
+    return {keys[chunk[0]]: chunk for chunk in np.split(order, bounds) if len(chunk)}
+
+def compute_layout(graph, communities, seed=0):
+    """
+    Hierarchical layout following the community tree.
+
+    Every community is a disc inside its parent's disc: the children and the
+    nodes directly in a community are placed with force_layout on the graph
+    between them, so each step only lays out one community at a time.
+    """
+    paths, level, parent = community_paths(graph, communities)
+    n_nodes, n_communities = graph.n_nodes, len(level)
+    src = np.asarray(graph.edge_src, dtype=np.int64)
+    dst = np.asarray(graph.edge_dst, dtype=np.int64)
+    node_xy = np.zeros((n_nodes, 2))
+    community_xyr = np.zeros((n_communities, 3))
+    layout = {"node_xy": node_xy, "paths": paths, "level": level, "parent": parent, "community_xyr": community_xyr}
+    if n_nodes == 0:
+        return layout
+    sizes = sum(np.bincount(row[row >= 0], minlength=n_communities) for row in paths).astype(np.float64)
+
+    # (ノード, 辺, 円) をレベルごとに処理する（最上位はグラフ全体を単位円に配置）
+    frames = [(np.arange(n_nodes), np.arange(len(src)), np.array([0.0, 0.0, 1.0]))]
+    for depth in range(len(paths) + 1):
+        below = paths[depth] if depth < len(paths) else np.full(n_nodes, -1)
+        # 子コミュニティはそのID、直接属するノードは n_communities + ノード番号 をキーにする
+        item_of = np.where(below >= 0, below, n_communities + np.arange(n_nodes))
+        items = []
+        for nodes, edges, _ in frames:
+            item_keys = np.unique(item_of[nodes])
+            edge_src = np.searchsorted(item_keys, item_of[src[edges]])
+            edge_dst = np.searchsorted(item_keys, item_of[dst[edges]])
+            keep = edge_src != edge_dst
+            is_node = item_keys >= n_communities
+            item_sizes = np.where(is_node, 1.0, sizes[np.where(is_node, 0, item_keys)])
+            items.append((item_keys, is_node, (item_sizes, edge_src[keep], edge_dst[keep])))
+        placed = layout_groups([group for _, _, group in items], seed=seed)
+        for (_, _, (cx, cy, radius)), (item_keys, is_node, _), (pos, radii) in zip(frames, items, placed):
+            world = np.array([cx, cy]) + pos * radius
+            node_xy[item_keys[is_node] - n_communities] = world[is_node]
+            community_xyr[item_keys[~is_node]] = np.column_stack([world[~is_node], radii[~is_node] * radius])
+        if depth == len(paths):
+            break
+        # 子コミュニティごとにノードと内部の辺を分けて次のレベルへ
+        next_frames = []
+        for nodes, edges, _ in frames:
+            child_nodes = nodes[below[nodes] >= 0]
+            inner = edges[(below[src[edges]] == below[dst[edges]]) & (below[src[edges]] >= 0)]
+            edge_groups = _groups(below[src[inner]])
+            for key, members in _groups(below[child_nodes]).items():
+                group_edges = inner[edge_groups[key]] if key in edge_groups else inner[:0]
+                next_frames.append((child_nodes[members], group_edges, community_xyr[key]))
+        frames = next_frames
+    return layout
+
+
+def _read_layout(path, graph_hash):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as cached:
+        if str(cached["graph_sha256"]) != graph_hash:
+            return None
+        return {key: cached[key] for key in cached.files if key != "graph_sha256"}
+
+def _write_layout(path, layout, graph_hash):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, graph_sha256=np.str_(graph_hash), **layout)
+    os.replace(tmp_path, path)
+
+def load_layout(working_dir, strategy):
+    """
+    Return precomputed coordinates of the dataset's knowledge graph.
+
+    The result (node positions in the unit disc, the community of every node
+    per level and a disc per community) is stored in
+    `<working_dir>/layout/<key>.npz` with the hash of the GraphML file and is
+    recomputed only when the graph changes.
+    """
+    graph = load_graph(os.path.join(working_dir, GRAPH_FILE))
+    path = layout_cache_path(working_dir, strategy)
+    layout = _read_layout(path, graph.sha256)
+    if layout is None:
+        communities = load_communities(working_dir, {**strategy, "levels": None})
+        layout = compute_layout(graph, communities, seed=strategy.get("seed", 0) % (2 ** 32))
+        _write_layout(path, layout, graph.sha256)
+    return graph, layout
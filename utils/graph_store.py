@@ -0,0 +1,400 @@
+import os
+import json
+import shutil
+import threading
+import xml.etree.ElementTree as ET
+import numpy as np
+import networkx as nx
+from utils.index_manifest import file_sha256
+
+# 定数の設定
+SNAPSHOT_VERSION = 1
+GRAPHML_NS = "{http://graphml.graphdrawing.org/xmlns}"
+# GraphMLの型名とスナップショットの列の型
+GRAPHML_TYPES = {
+    "string": "string",
+    "boolean": "bool",
+    "int": "int",
+    "long": "int",
+    "float": "float",
+    "double": "float",
+}
+
+
+def snapshot_dir(graphml_path):
+    return f"{os.path.splitext(graphml_path)[0]}_snapshot"
+
+def _source_stat(graphml_path):
+    stat = os.stat(graphml_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def _convert(value, kind):
+    if kind == "string":
+        return value or ""
+    if kind == "bool":
+        return (value or "").strip().lower() in ("true", "1")
+    if kind == "int":
+        return int(value)
+    return float(value)
+
+
+# GraphMLを1回だけストリーミングで読み、ノード/エッジと属性を配列にまとめる
+def _parse_graphml(graphml_path):
+    keys = {}
+    directed = False
+    node_index = {}
+    node_attrs = []
+    edge_index = {}
+    edge_src, edge_dst, edge_attrs = [], [], []
+
+    def add_node(node_id):
+        if node_id not in node_index:
+            node_index[node_id] = len(node_attrs)
+            node_attrs.append({})
+        return node_index[node_id]
+
+    def read_data(elem):
+        values = {}
+        for data in elem.findall(f"{GRAPHML_NS}data"):
+            key = keys.get(data.get("key"))
+            if key is not None:
+                values[key["name"]] = _convert(data.text, key["type"])
+        return values
+
+    for event, elem in ET.iterparse(graphml_path, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == f"{GRAPHML_NS}graph":
+                directed = elem.get("edgedefault", "undirected") == "directed"
+            continue
+        if tag == f"{GRAPHML_NS}key":
+            keys[elem.get("id")] = {
+                "name": elem.get("attr.name", elem.get("id")),
+                "for": elem.get("for", "all"),
+                "type": GRAPHML_TYPES.get(elem.get("attr.type", "string"), "string"),
+            }
+        elif tag == f"{GRAPHML_NS}node":
+            node_attrs[add_node(elem.get("id"))].update(read_data(elem))
+            elem.clear()
+        elif tag == f"{GRAPHML_NS}edge":
+            source, target = add_node(elem.get("source")), add_node(elem.get("target"))
+            # 無向グラフでは networkx.Graph と同様に同じ端点の辺を1本にまとめる
+            pair = (source, target) if directed else (min(source, target), max(source, target))
+            if pair in edge_index:
+                edge_attrs[edge_index[pair]].update(read_data(elem))
+            else:
+                edge_index[pair] = len(edge_src)
+                edge_src.append(source)
+                edge_dst.append(target)
+                edge_attrs.append(read_data(elem))
+            elem.clear()
+
+    node_ids = [None] * len(node_index)
+    for node_id, index in node_index.items():
+        node_ids[index] = node_id
+    return {
+        "directed": directed,
+        "keys": keys,
+        "node_ids": node_ids,
+        "node_attrs": node_attrs,
+        "edge_src": np.asarray(edge_src, dtype=np.int64),
+        "edge_dst": np.asarray(edge_dst, dtype=np.int64),
+        "edge_attrs": edge_attrs,
+    }
+
+
+def _write_column(directory, name, kind, values):
+    """Write one column as .npy files: strings as offsets + UTF-8 bytes, plus a validity mask if needed."""
+    valid = np.array([value is not None for value in values], dtype=bool)
+    if kind == "string":
+        encoded = [value.encode("utf-8") if value is not None else b"" for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+        np.save(os.path.join(directory, f"{name}.data.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    else:
+        dtype = {"bool": np.bool_, "int": np.int64, "float": np.float64}[kind]
+        filler = {"bool": False, "int": 0, "float": np.nan}[kind]
+        array = np.array([value if value is not None else filler for value in values], dtype=dtype)
+        np.save(os.path.join(directory, f"{name}.values.npy"), array)
+    if not valid.all():
+        np.save(os.path.join(directory, f"{name}.valid.npy"), valid)
+
+def _attribute_columns(keys, element, rows):
+    kinds = {}
+    for key in keys.values():
+        if key["for"] in (element, "all"):
+            kinds.setdefault(key["name"], key["type"])
+    # networkxと同じ属性の並びになるよう、行に現れた順に列を作る
+    names = {}
+    for row in rows:
+        names.update(dict.fromkeys(row))
+    return [(name, kinds.get(name, "string")) for name in names]
+
+
+def build_snapshot(graphml_path):
+    """Parse the GraphML once and write the binary snapshot next to it."""
+    parsed = _parse_graphml(graphml_path)
+    target = snapshot_dir(graphml_path)
+    tmp_dir = f"{target}.tmp-{os.getpid()}-{threading.get_ident()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    n_nodes = len(parsed["node_ids"])
+    src, dst = parsed["edge_src"], parsed["edge_dst"]
+    # CSR形式の隣接リスト（無向グラフは両方向を持つ）
+    rows = src if parsed["directed"] else np.concatenate([src, dst])
+    cols = dst if parsed["directed"] else np.concatenate([dst, src])
+    edge_ids = np.arange(len(src), dtype=np.int64)
+    edge_ids = edge_ids if parsed["directed"] else np.concatenate([edge_ids, edge_ids])
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_nodes), out=indptr[1:])
+    np.save(os.path.join(tmp_dir, "indptr.npy"), indptr)
+    np.save(os.path.join(tmp_dir, "indices.npy"), cols[order])
+    np.save(os.path.join(tmp_dir, "edge_ids.npy"), edge_ids[order])
+    np.save(os.path.join(tmp_dir, "edge_src.npy"), src)
+    np.save(os.path.join(tmp_dir, "edge_dst.npy"), dst)
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "source": {**_source_stat(graphml_path), "sha256": file_sha256(graphml_path)},
+        "directed": parsed["directed"],
+        "n_nodes": n_nodes,
+        "n_edges": len(src),
+        "node_attrs": [],
+        "edge_attrs": [],
+    }
+    _write_column(tmp_dir, "node_id", "string", parsed["node_ids"])
+    for element in ["node", "edge"]:
+        attrs = parsed[f"{element}_attrs"]
+        for index, (name, kind) in enumerate(_attribute_columns(parsed["keys"], element, attrs)):
+            _write_column(tmp_dir, f"{element}_{index}", kind, [row.get(name) for row in attrs])
+            meta[f"{element}_attrs"].append({"name": name, "type": kind, "file": f"{element}_{index}"})
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    # 読み込み中のプロセスがあっても壊れないよう、ディレクトリごと置き換える
+    old_dir = f"{target}.old-{os.getpid()}-{threading.get_ident()}"
+    if os.path.exists(target):
+        os.replace(target, old_dir)
+    os.replace(tmp_dir, target)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return target
+
+
+class Column:
+    """Memory-mapped node or edge attribute column."""
+
+    def __init__(self, directory, file, kind):
+        self.kind = kind
+        path = os.path.join(directory, file)
+        if kind == "string":
+            self.offsets = np.load(f"{path}.offsets.npy", mmap_mode="r")
+            self.data = np.load(f"{path}.data.npy", mmap_mode="r")
+            self.values = None
+        else:
+            self.values = np.load(f"{path}.values.npy", mmap_mode="r")
+        self.valid = np.load(f"{path}.valid.npy", mmap_mode="r") if os.path.exists(f"{path}.valid.npy") else None
+
+    def __len__(self):
+        return len(self.offsets) - 1 if self.kind == "string" else len(self.values)
+
+    def __getitem__(self, index):
+        if self.valid is not None and not self.valid[index]:
+            return None
+        if self.kind == "string":
+            return bytes(self.data[self.offsets[index]:self.offsets[index + 1]]).decode("utf-8")
+        return self.values[index].item()
+
+    def tolist(self, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        if self.kind == "string":
+            offsets = self.offsets[start:stop + 1].tolist()
+            raw = bytes(self.data[offsets[0]:offsets[-1]]) if offsets else b""
+            values = [raw[begin - offsets[0]:end - offsets[0]].decode("utf-8") for begin, end in zip(offsets, offsets[1:])]
+        else:
+            values = self.values[start:stop].tolist()
+        if self.valid is not None:
+            values = [value if ok else None for value, ok in zip(values, self.valid[start:stop].tolist())]
+        return values
+
+
+class GraphSnapshot:
+    """
+    Read-only view of a GraphML graph stored as memory-mapped arrays.
+
+    Adjacency is kept in CSR form (`indptr`, `indices`, `edge_ids`; undirected
+    graphs store both directions), the edge list in `edge_src` / `edge_dst`
+    and every node/edge attribute as a separate column.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.directed = self.meta["directed"]
+        self.n_nodes = self.meta["n_nodes"]
+        self.n_edges = self.meta["n_edges"]
+        self.sha256 = self.meta["source"]["sha256"]
+        self.indptr = self._load("indptr")
+        self.indices = self._load("indices")
+        self.edge_ids = self._load("edge_ids")
+        self.edge_src = self._load("edge_src")
+        self.edge_dst = self._load("edge_dst")
+        self.node_id = Column(directory, "node_id", "string")
+        self.node_columns = {attr["name"]: Column(directory, attr["file"], attr["type"]) for attr in self.meta["node_attrs"]}
+        self.edge_columns = {attr["name"]: Column(directory, attr["file"], attr["type"]) for attr in self.meta["edge_attrs"]}
+        self._ids = None
+        self._index = None
+
+    def _load(self, name):
+        return np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+
+    def node_ids(self):
+        if self._ids is None:
+            self._ids = self.node_id.tolist()
+        return self._ids
+
+    def node_index(self, node_id):
+        if self._index is None:
+            self._index = {node_id: index for index, node_id in enumerate(self.node_ids())}
+        return self._index.get(node_id)
+
+    def find_node(self, entity):
+        """Index of the entity, also trying the upper-cased name (older LightRAG versions stored names upper-cased)."""
+        index = self.node_index(entity)
+        if index is None:
+            index = self.node_index(entity.upper())
+        return index
+
+    def neighbors(self, index):
+        return self.indices[self.indptr[index]:self.indptr[index + 1]]
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    # 複数ノードの隣接リストをまとめて展開する（ノード, 隣接ノード, 辺ID）
+    def _adjacent(self, nodes):
+        starts = self.indptr[nodes]
+        counts = self.indptr[nodes + 1] - starts
+        positions = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        return np.repeat(nodes, counts), self.indices[positions], self.edge_ids[positions]
+
+    def k_hop(self, seeds, hops, max_nodes=None):
+        """
+        Indices of the nodes within `hops` steps of `seeds` (outgoing edges for
+        directed graphs), in breadth-first order with the seeds first. Only the
+        adjacency of the visited nodes is read; at most `max_nodes` are returned.
+        """
+        visited = np.zeros(self.n_nodes, dtype=bool)
+        frontier = np.array(list(dict.fromkeys(seeds)), dtype=np.int64)[:max_nodes]
+        visited[frontier] = True
+        found = [frontier]
+        total = len(frontier)
+        for _ in range(hops):
+            if len(frontier) == 0 or (max_nodes is not None and total >= max_nodes):
+                break
+            _, neighbors, _ = self._adjacent(frontier)
+            frontier = np.unique(neighbors[~visited[neighbors]])
+            if max_nodes is not None:
+                frontier = frontier[:max_nodes - total]
+            visited[frontier] = True
+            found.append(frontier)
+            total += len(frontier)
+        return np.concatenate(found)
+
+    def subgraph_edges(self, nodes):
+        """Ids of the edges whose endpoints are both in `nodes`."""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        inside = np.zeros(self.n_nodes, dtype=bool)
+        inside[nodes] = True
+        _, neighbors, edge_ids = self._adjacent(nodes)
+        return np.unique(edge_ids[inside[neighbors]])
+
+    @staticmethod
+    def _rows(columns, start, stop):
+        rows = [{} for _ in range(start, stop)]
+        for name, column in columns.items():
+            for row, value in zip(rows, column.tolist(start, stop)):
+                if value is not None:
+                    row[name] = value
+        return rows
+
+    def node_rows(self, start=0, stop=None):
+        return self._rows(self.node_columns, start, min(self.n_nodes if stop is None else stop, self.n_nodes))
+
+    def edge_rows(self, start=0, stop=None):
+        return self._rows(self.edge_columns, start, min(self.n_edges if stop is None else stop, self.n_edges))
+
+    def to_networkx(self):
+        G = nx.DiGraph() if self.directed else nx.Graph()
+        ids = self.node_ids()
+        G.add_nodes_from(zip(ids, self.node_rows()))
+        G.add_edges_from(
+            (ids[source], ids[target], attrs)
+            for source, target, attrs in zip(self.edge_src.tolist(), self.edge_dst.tolist(), self.edge_rows())
+        )
+        return G
+
+    @staticmethod
+    def _row(columns, index):
+        return {name: value for name, column in columns.items() if (value := column[index]) is not None}
+
+    def node_link_data(self, nodes=None):
+        """
+        Same structure as `networkx.node_link_data(G)` (with `links`). With
+        `nodes` (node indices) only those nodes and the edges between them are read.
+        """
+        ids = self.node_ids()
+        if nodes is None:
+            node_rows = zip(ids, self.node_rows())
+            edge_rows = zip(self.edge_src.tolist(), self.edge_dst.tolist(), self.edge_rows())
+        else:
+            nodes = np.asarray(nodes, dtype=np.int64)
+            edges = self.subgraph_edges(nodes)
+            node_rows = ((ids[index], self._row(self.node_columns, index)) for index in nodes.tolist())
+            edge_rows = (
+                (self.edge_src[edge].item(), self.edge_dst[edge].item(), self._row(self.edge_columns, edge))
+                for edge in edges.tolist()
+            )
+        return {
+            "directed": self.directed,
+            "multigraph": False,
+            "graph": {},
+            "nodes": [{**attrs, "id": node_id} for node_id, attrs in node_rows],
+            "links": [{**attrs, "source": ids[source], "target": ids[target]} for source, target, attrs in edge_rows],
+        }
+
+
+_snapshots = {}
+_lock = threading.Lock()
+
+def _is_fresh(directory, graphml_path):
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    source = meta.get("source", {})
+    return meta.get("version") == SNAPSHOT_VERSION and all(
+        source.get(key) == value for key, value in _source_stat(graphml_path).items()
+    )
+
+# GraphMLのスナップショットを取得（GraphMLが更新されていれば作り直す）
+def load_graph(graphml_path):
+    """
+    Return a GraphSnapshot of `graphml_path`, rebuilding the snapshot in
+    `<name>_snapshot/` only when the GraphML's size or mtime changed.
+    """
+    stat = _source_stat(graphml_path)
+    with _lock:
+        cached = _snapshots.get(graphml_path)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+        directory = snapshot_dir(graphml_path)
+        if not _is_fresh(directory, graphml_path):
+            build_snapshot(graphml_path)
+        snapshot = GraphSnapshot(directory)
+        _snapshots[graphml_path] = (stat, snapshot)
+        return snapshot
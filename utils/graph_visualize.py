@@ -1,15 +1,39 @@
 import json
 import os
-import networkx as nx
-import pandas as pd
+import functools
+import numpy as np
 from pyvis.network import Network
-from graphrag.index.operations.cluster_graph import cluster_graph
+from utils.community_cache import GRAPH_FILE, load_communities, strategy_key
+from utils.graph_layout import force_layout, load_layout
+from utils.graph_store import load_graph
+
+# 定数の設定
+# このノード数以下のグラフは最初からすべてのコミュニティを展開して表示する
+GRAPH_LOD_NODES = 300
+# ツールチップに埋め込む説明文の最大文字数（LightRAGが<SEP>で連結した説明は最初の1つだけ使う）
+GRAPH_DESCRIPTION_CHARS = 200
+GRAPH_FIELD_SEP = "<SEP>"
+GRAPH_HTML_VERSION = 3
+# 近傍グラフの最大ノード数とキャッシュする（エンティティ, ホップ数）の数
+NEIGHBORHOOD_MAX_NODES = 300
+NEIGHBORHOOD_CACHE_SIZE = 1024
+# クラスタリングの設定
+HIERARCHY_STRATEGY = {
+  "type": "leiden",
+  "max_cluster_size": 10,  # クラスタの最大サイズ
+  "use_lcc": True,         # 最大全結合成分のみを使用
+  "seed": 0xDEADBEEF,      # ランダムシード
+  "levels": None,          # すべてのレベルを使用
+  "verbose": True          # ログを表示
+}
+# 可視化ではすべてのノードをコミュニティに割り当てる
+LAYOUT_STRATEGY = {**HIERARCHY_STRATEGY, "use_lcc": False, "verbose": False}
 
 
 def create_simple_html(dataset):
   # Load the GraphML file
   filepath = f'./{dataset}/graph_chunk_entity_relation.graphml'
-  G = nx.read_graphml(filepath)
+  G = load_graph(filepath).to_networkx()
 
   # Create a Pyvis network
   net = Network(notebook=True)
@@ -24,40 +48,137 @@ from yfiles_jupyter_graphs import GraphWidget
 import streamlit as st
 
 def show_hierarchy_graph(dataset):
-  # クラスタリングの設定
-  strategy = {
-    "type": "leiden",
-    "max_cluster_size": 10,  # クラスタの最大サイズ
-    "use_lcc": True,         # 最大全結合成分のみを使用
-    "seed": 0xDEADBEEF,      # ランダムシード
-    "levels": None,          # すべてのレベルを使用
-    "verbose": True          # ログを表示
-  }
-
-  # Load the GraphML file
-  G = nx.read_graphml(f'./{dataset}/graph_chunk_entity_relation.graphml')
-
-  # クラスタリングを実行
-  communities = cluster_graph(G, strategy)
+  # クラスタリングを実行（グラフが変わっていなければ保存済みの結果を使い、変わった連結成分だけ再計算する）
+  base_communities = load_communities(f'./{dataset}', HIERARCHY_STRATEGY)
 
   # 結果を表示
   print("Detected communities:")
-  base_communities = pd.DataFrame(
-    communities, columns=pd.Index(["level", "community", "parent", "title"])
-  ).explode("title")
-  base_communities["community"] = base_communities["community"].astype(int)
 
   return base_communities
 
-# load GraphML file and transfer to JSON
-def graphml_to_json(graphml_file):
-    G = nx.read_graphml(graphml_file)
-    data = nx.node_link_data(G)
-    return json.dumps(data)
-
-# create HTML file
-def save_as_html(html_path, graph_json):
-    html_content = '''
+# 各コミュニティの代表ノード（次数が最大のノード）
+def _community_labels(paths, degrees, n_communities):
+    labels = np.zeros(n_communities, dtype=np.int64)
+    for row in paths:
+        members = np.flatnonzero(row >= 0)
+        # コミュニティID順・次数の降順に並べ、各コミュニティの先頭を取る
+        order = members[np.lexsort((-degrees[members], row[members]))]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = row[order][1:] != row[order][:-1]
+        labels[row[order][first]] = order[first]
+    return labels
+
+# ノードの列（ID・エンティティタイプ・説明文・座標）を並列配列にまとめる
+def _nodes_payload(graph, nodes, xy):
+    """`nodes` are snapshot indices, or None for every node."""
+    def column(name):
+        values = graph.node_columns.get(name)
+        if values is None:
+            return [None] * (graph.n_nodes if nodes is None else len(nodes))
+        return values.tolist() if nodes is None else [values[index] for index in nodes.tolist()]
+
+    ids = graph.node_ids()
+    types = column("entity_type")
+    type_names = list(dict.fromkeys(types))
+    type_index = {name: index for index, name in enumerate(type_names)}
+    xy = np.round(xy, 6)
+    return [name if name is not None else "N/A" for name in type_names], {
+        "id": ids if nodes is None else [ids[index] for index in nodes.tolist()],
+        "type": [type_index[name] for name in types],
+        "x": xy[:, 0].tolist(),
+        "y": xy[:, 1].tolist(),
+        "description": [
+            text.split(GRAPH_FIELD_SEP)[0][:GRAPH_DESCRIPTION_CHARS] if text else None for text in column("description")
+        ],
+    }
+
+# load the knowledge graph with its precomputed layout as compact JSON
+def graph_lod_json(dataset):
+    """
+    Node positions, community discs and edges of the dataset's graph for the
+    level-of-detail view. Columns are stored as parallel arrays and
+    descriptions are truncated to keep the embedded HTML small.
+    """
+    graph, layout = load_layout(f'./{dataset}', LAYOUT_STRATEGY)
+    paths = layout["paths"]
+    n_communities = len(layout["level"])
+    types, nodes = _nodes_payload(graph, None, layout["node_xy"])
+    sizes = sum(np.bincount(row[row >= 0], minlength=n_communities) for row in paths)
+    community_xyr = np.round(layout["community_xyr"], 6)
+    data = {
+        "expanded": graph.n_nodes <= GRAPH_LOD_NODES,
+        "types": types,
+        "nodes": nodes,
+        "communities": {
+            "x": community_xyr[:, 0].tolist(),
+            "y": community_xyr[:, 1].tolist(),
+            "r": community_xyr[:, 2].tolist(),
+            "level": layout["level"].tolist(),
+            "parent": layout["parent"].tolist(),
+            "size": sizes.tolist() if n_communities else [],
+            "label": _community_labels(paths, graph.degrees(), n_communities).tolist(),
+        },
+        "paths": paths.tolist(),
+        "edges": {
+            "source": np.asarray(graph.edge_src).tolist(),
+            "target": np.asarray(graph.edge_dst).tolist(),
+        },
+    }
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+# エンティティごと・ホップ数ごとの近傍ノード（グラフのハッシュが変われば別のキーになる）
+@functools.lru_cache(maxsize=NEIGHBORHOOD_CACHE_SIZE)
+def _neighborhood(graphml_file, graph_hash, entity, hops):
+    graph = load_graph(graphml_file)
+    index = graph.find_node(entity)
+    if index is None:
+        return ()
+    return tuple(graph.k_hop([index], hops, NEIGHBORHOOD_MAX_NODES).tolist())
+
+def neighborhood_json(dataset, entities, hops=1):
+    """
+    The k-hop neighborhood of `entities` as JSON for the same view as
+    graph_lod_json, laid out with force_layout, plus the entities that are not
+    in the graph. Node sets are cached per (entity, hops) and read through the
+    snapshot's adjacency index, so the full graph is never loaded.
+    """
+    graphml_file = f'./{dataset}/{GRAPH_FILE}'
+    return _neighborhood_json(graphml_file, load_graph(graphml_file).sha256, tuple(dict.fromkeys(entities)), hops)
+
+# 同じエンティティの組の近傍はレイアウトを含めて再利用する
+@functools.lru_cache(maxsize=NEIGHBORHOOD_CACHE_SIZE)
+def _neighborhood_json(graphml_file, graph_hash, entities, hops):
+    graph = load_graph(graphml_file)
+    found, missing = {}, []
+    for entity in entities:
+        nodes = _neighborhood(graphml_file, graph_hash, entity, hops)
+        if nodes:
+            found[nodes[0]] = nodes
+        else:
+            missing.append(entity)
+    # 各エンティティの近傍の和集合（エンティティ自身を先頭にする）
+    seeds = list(found)
+    nodes = np.array(list(dict.fromkeys(seeds + [node for group in found.values() for node in group])), dtype=np.int64)
+    nodes = nodes[:max(NEIGHBORHOOD_MAX_NODES, len(seeds))]
+    order = np.argsort(nodes)
+    edges = graph.subgraph_edges(nodes)
+    src = order[np.searchsorted(nodes[order], np.asarray(graph.edge_src)[edges])]
+    dst = order[np.searchsorted(nodes[order], np.asarray(graph.edge_dst)[edges])]
+    types, payload = _nodes_payload(graph, nodes, 0.9 * force_layout(len(nodes), src, dst))
+    data = {
+        "expanded": True,
+        "types": types,
+        "nodes": payload,
+        "highlight": list(range(len(seeds))),
+        "communities": {key: [] for key in ["x", "y", "r", "level", "parent", "size", "label"]},
+        "paths": [],
+        "edges": {"source": src.tolist(), "target": dst.tolist()},
+    }
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")), tuple(missing)
+
+# create HTML
+def render_html(graph_json, header=""):
+    html_content = header + '''
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -77,6 +198,9 @@ def save_as_html(html_path, graph_json):
             width: 100%;
             height: 100%;
         }
+        line, circle {
+            vector-effect: non-scaling-stroke;
+        }
         .links line {
             stroke: #999;
             stroke-opacity: 0.6;
@@ -85,19 +209,28 @@ def save_as_html(html_path, graph_json):
             stroke: #fff;
             stroke-width: 1.5px;
         }
-        .node-label {
-            font-size: 12px;
-            pointer-events: none;
+        .nodes circle.highlight {
+            stroke: #333;
+            stroke-width: 2.5px;
+        }
+        .communities circle {
+            stroke: #fff;
+            stroke-width: 1.5px;
+            fill-opacity: 0.7;
+            cursor: zoom-in;
+        }
+        .frames circle {
+            fill: #f4f4f4;
+            stroke: #bbb;
+            stroke-dasharray: 4 3;
+            cursor: zoom-out;
         }
-        .link-label {
-            font-size: 10px;
-            fill: #666;
+        .node-label, .community-label {
             pointer-events: none;
-            opacity: 0;
-            transition: opacity 0.3s;
         }
-        .link:hover .link-label {
-            opacity: 1;
+        .community-label {
+            font-weight: bold;
+            text-anchor: middle;
         }
         .tooltip {
             position: absolute;
@@ -130,15 +263,29 @@ def save_as_html(html_path, graph_json):
             margin-right: 5px;
             vertical-align: middle;
         }
+        .controls {
+            position: absolute;
+            top: 10px;
+            left: 10px;
+            font: 12px sans-serif;
+        }
     </style>
 </head>
 <body>
     <svg></svg>
     <div class="tooltip"></div>
     <div class="legend"></div>
+    <div class="controls"><button id="reset">Reset</button> <span id="status"></span></div>
     <script>
         [GRPH DATA];
         const graphData = graphJson;
+        const nodes = graphData.nodes;
+        const communities = graphData.communities;
+        const paths = graphData.paths;
+        const nNodes = nodes.id.length;
+        const nCommunities = communities.x.length;
+        const nItems = nCommunities + nNodes;
+        const highlight = new Set(graphData.highlight || []);
 
         const svg = d3.select("svg"),
             width = window.innerWidth,
@@ -147,150 +294,260 @@ def save_as_html(html_path, graph_json):
         svg.attr("viewBox", [0, 0, width, height]);
 
         const g = svg.append("g");
+        const frameLayer = g.append("g").attr("class", "frames");
+        const linkLayer = g.append("g").attr("class", "links");
+        const communityLayer = g.append("g").attr("class", "communities");
+        const nodeLayer = g.append("g").attr("class", "nodes");
+        const labelLayer = g.append("g").attr("class", "labels");
+
+        // Positions are precomputed in the unit disc. Items below nCommunities are communities, the rest are nodes.
+        const scale = Math.min(width, height) * 0.45;
+        const px = item => width / 2 + scale * (item < nCommunities ? communities.x[item] : nodes.x[item - nCommunities]);
+        const py = item => height / 2 + scale * (item < nCommunities ? communities.y[item] : nodes.y[item - nCommunities]);
+        const color = d3.scaleOrdinal(d3.schemeCategory10).domain(graphData.types);
+        const escapeHtml = text => String(text).replace(/[&<>"]/g, c => ({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})[c]);
+
+        const opened = new Set();
+        let zoomK = 1;
+
+        function resetOpened() {
+            opened.clear();
+            if (graphData.expanded) {
+                for (let c = 0; c < nCommunities; c++) opened.add(c);
+            }
+        }
+
+        // A node is drawn as the first collapsed community on its path, or as itself when all of them are opened.
+        function representative(node) {
+            for (let level = 0; level < paths.length; level++) {
+                const c = paths[level][node];
+                if (c < 0) break;
+                if (!opened.has(c)) return c;
+            }
+            return nCommunities + node;
+        }
+
+        function isShownFrame(c) {
+            for (let p = c; p >= 0; p = communities.parent[p]) {
+                if (!opened.has(p)) return false;
+            }
+            return true;
+        }
+
+        function render() {
+            const rep = new Int32Array(nNodes);
+            const items = new Set();
+            for (let i = 0; i < nNodes; i++) {
+                rep[i] = representative(i);
+                items.add(rep[i]);
+            }
+            // Edges are aggregated between the visible items.
+            const counts = new Map();
+            const source = graphData.edges.source, target = graphData.edges.target;
+            for (let e = 0; e < source.length; e++) {
+                let a = rep[source[e]], b = rep[target[e]];
+                if (a === b) continue;
+                if (a > b) [a, b] = [b, a];
+                const key = a * nItems + b;
+                counts.set(key, (counts.get(key) || 0) + 1);
+            }
+            const linkData = Array.from(counts, ([key, count]) => ({key, source: Math.floor(key / nItems), target: key % nItems, count}));
+            const communityData = [...items].filter(item => item < nCommunities);
+            const nodeData = [...items].filter(item => item >= nCommunities);
+            const frameData = [...opened].filter(isShownFrame);
+
+            frameLayer.selectAll("circle")
+                .data(frameData, d => d)
+                .join("circle")
+                .attr("cx", px)
+                .attr("cy", py)
+                .attr("r", d => communities.r[d] * scale)
+                .on("click", (event, d) => collapse(d));
+
+            linkLayer.selectAll("line")
+                .data(linkData, d => d.key)
+                .join("line")
+                .attr("x1", d => px(d.source))
+                .attr("y1", d => py(d.source))
+                .attr("x2", d => px(d.target))
+                .attr("y2", d => py(d.target))
+                .attr("stroke-width", d => Math.min(1 + Math.log2(d.count), 8));
+
+            communityLayer.selectAll("circle")
+                .data(communityData, d => d)
+                .join("circle")
+                .attr("cx", px)
+                .attr("cy", py)
+                .attr("r", d => communities.r[d] * scale)
+                .attr("fill", d => color(graphData.types[nodes.type[communities.label[d]]]))
+                .on("click", (event, d) => expand(d))
+                .on("mouseover", (event, d) => showTooltip(event,
+                    `<strong>${escapeHtml(nodes.id[communities.label[d]])}</strong><br>Community ${d} (level ${communities.level[d]})<br>Entities: ${communities.size[d]}<br>Click to expand`))
+                .on("mouseout", hideTooltip);
+
+            nodeLayer.selectAll("circle")
+                .data(nodeData, d => d)
+                .join("circle")
+                .attr("cx", px)
+                .attr("cy", py)
+                .attr("fill", d => color(graphData.types[nodes.type[d - nCommunities]]))
+                .classed("highlight", d => highlight.has(d - nCommunities))
+                .on("mouseover", (event, d) => {
+                    const i = d - nCommunities;
+                    showTooltip(event, `<strong>${escapeHtml(nodes.id[i])}</strong><br>Entity Type: ${escapeHtml(graphData.types[nodes.type[i]])}<br>Description: ${escapeHtml(nodes.description[i] || "N/A")}`);
+                })
+                .on("mouseout", hideTooltip);
+
+            labelLayer.selectAll("text")
+                .data(communityData.concat(nodeData), d => d)
+                .join("text")
+                .attr("class", d => d < nCommunities ? "community-label" : "node-label")
+                .text(d => d < nCommunities ? `${nodes.id[communities.label[d]]} (${communities.size[d]})` : nodes.id[d - nCommunities]);
+
+            d3.select("#status").text(`${nodeData.length} of ${nNodes} entities and ${communityData.length} communities shown`);
+            applyZoom();
+        }
 
-        const entityTypes = [...new Set(graphData.nodes.map(d => d.entity_type))];
-        const color = d3.scaleOrdinal(d3.schemeCategory10).domain(entityTypes);
-
-        const simulation = d3.forceSimulation(graphData.nodes)
-            .force("link", d3.forceLink(graphData.links).id(d => d.id).distance(150))
-            .force("charge", d3.forceManyBody().strength(-300))
-            .force("center", d3.forceCenter(width / 2, height / 2))
-            .force("collide", d3.forceCollide().radius(30));
-
-        const linkGroup = g.append("g")
-            .attr("class", "links")
-            .selectAll("g")
-            .data(graphData.links)
-            .enter().append("g")
-            .attr("class", "link");
-
-        const link = linkGroup.append("line")
-            .attr("stroke-width", d => Math.sqrt(d.value));
-
-        const linkLabel = linkGroup.append("text")
-            .attr("class", "link-label")
-            .text(d => d.description || "");
-
-        const node = g.append("g")
-            .attr("class", "nodes")
-            .selectAll("circle")
-            .data(graphData.nodes)
-            .enter().append("circle")
-            .attr("r", 5)
-            .attr("fill", d => color(d.entity_type))
-            .call(d3.drag()
-                .on("start", dragstarted)
-                .on("drag", dragged)
-                .on("end", dragended));
-
-        const nodeLabel = g.append("g")
-            .attr("class", "node-labels")
-            .selectAll("text")
-            .data(graphData.nodes)
-            .enter().append("text")
-            .attr("class", "node-label")
-            .text(d => d.id);
+        // Nodes and labels keep the same size on screen while zooming.
+        function applyZoom() {
+            nodeLayer.selectAll("circle").attr("r", d => (highlight.has(d - nCommunities) ? 8 : 5) / zoomK);
+            labelLayer.selectAll("text")
+                .attr("x", d => d < nCommunities ? px(d) : px(d) + 8 / zoomK)
+                .attr("y", d => d < nCommunities ? py(d) : py(d) + 3 / zoomK)
+                .attr("font-size", d => (d < nCommunities ? 12 : 10) / zoomK)
+                .attr("display", d => d >= nCommunities || communities.r[d] * scale * zoomK > 25 ? null : "none");
+        }
 
         const tooltip = d3.select(".tooltip");
 
-        node.on("mouseover", function(event, d) {
+        function showTooltip(event, html) {
             tooltip.transition()
                 .duration(200)
                 .style("opacity", .9);
-            tooltip.html(`<strong>${d.id}</strong><br>Entity Type: ${d.entity_type}<br>Description: ${d.description || "N/A"}`)
+            tooltip.html(html)
                 .style("left", (event.pageX + 10) + "px")
                 .style("top", (event.pageY - 28) + "px");
-        })
-        .on("mouseout", function(d) {
+        }
+
+        function hideTooltip() {
             tooltip.transition()
                 .duration(500)
                 .style("opacity", 0);
-        });
+        }
 
         const legend = d3.select(".legend");
-        entityTypes.forEach(type => {
+        graphData.types.forEach(type => {
             legend.append("div")
                 .attr("class", "legend-item")
-                .html(`<span class="legend-color" style="background-color: ${color(type)}"></span>${type}`);
+                .html(`<span class="legend-color" style="background-color: ${color(type)}"></span>${escapeHtml(type)}`);
         });
 
-        simulation
-            .nodes(graphData.nodes)
-            .on("tick", ticked);
-
-        simulation.force("link")
-            .links(graphData.links);
-
-        function ticked() {
-            link
-                .attr("x1", d => d.source.x)
-                .attr("y1", d => d.source.y)
-                .attr("x2", d => d.target.x)
-                .attr("y2", d => d.target.y);
-
-            linkLabel
-                .attr("x", d => (d.source.x + d.target.x) / 2)
-                .attr("y", d => (d.source.y + d.target.y) / 2)
-                .attr("text-anchor", "middle")
-                .attr("dominant-baseline", "middle");
-
-            node
-                .attr("cx", d => d.x)
-                .attr("cy", d => d.y);
-
-            nodeLabel
-                .attr("x", d => d.x + 8)
-                .attr("y", d => d.y + 3);
-        }
+        const zoom = d3.zoom()
+            .scaleExtent([0.5, 100000])
+            .on("zoom", zoomed);
+
+        svg.call(zoom);
 
-        function dragstarted(event) {
-            if (!event.active) simulation.alphaTarget(0.3).restart();
-            event.subject.fx = event.subject.x;
-            event.subject.fy = event.subject.y;
+        function zoomed(event) {
+            zoomK = event.transform.k;
+            g.attr("transform", event.transform);
+            applyZoom();
         }
 
-        function dragged(event) {
-            event.subject.fx = event.x;
-            event.subject.fy = event.y;
+        function focus(c) {
+            const k = Math.min(width, height) / (2.4 * Math.max(communities.r[c] * scale, 1e-6));
+            svg.transition()
+                .duration(600)
+                .call(zoom.transform, d3.zoomIdentity.translate(width / 2, height / 2).scale(k).translate(-px(c), -py(c)));
         }
 
-        function dragended(event) {
-            if (!event.active) simulation.alphaTarget(0);
-            event.subject.fx = null;
-            event.subject.fy = null;
+        function expand(c) {
+            hideTooltip();
+            opened.add(c);
+            render();
+            focus(c);
         }
 
-        const zoom = d3.zoom()
-            .scaleExtent([0.1, 10])
-            .on("zoom", zoomed);
+        function collapse(c) {
+            for (const other of [...opened]) {
+                for (let p = other; p >= 0; p = communities.parent[p]) {
+                    if (p === c) {
+                        opened.delete(other);
+                        break;
+                    }
+                }
+            }
+            render();
+            const parent = communities.parent[c];
+            if (parent >= 0) {
+                focus(parent);
+            } else {
+                svg.transition().duration(600).call(zoom.transform, d3.zoomIdentity);
+            }
+        }
 
-        svg.call(zoom);
+        d3.select("#reset").on("click", () => {
+            resetOpened();
+            render();
+            svg.transition().duration(600).call(zoom.transform, d3.zoomIdentity);
+        });
 
-        function zoomed(event) {
-            g.attr("transform", event.transform);
-        }
+        resetOpened();
+        render();
 
     </script>
 </body>
 </html>
     '''
 
-    html_content = html_content.replace("[GRPH DATA]", graph_json)
+    return html_content.replace("[GRPH DATA]", graph_json)
 
+# create HTML file
+def save_as_html(html_path, graph_json, header=""):
     with open(html_path, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+        f.write(render_html(graph_json, header))
 
 def create_json(json_data):
-    json_data = "var graphJson = " + json_data.replace('\\"', '').replace("'", "\\'").replace("\n", "")
+    # 説明文に含まれる </script> などでスクリプトが途切れないようにする
+    json_data = "var graphJson = " + json_data.replace("</", "<\\/")
 
     return json_data
 
+# 1行目に埋め込むグラフのハッシュ（グラフが変わったときだけHTMLを作り直す）
+def _html_header(dataset):
+    graph = load_graph(f'./{dataset}/{GRAPH_FILE}')
+    return f"<!-- graph {graph.sha256} {strategy_key(LAYOUT_STRATEGY)} v{GRAPH_HTML_VERSION} -->"
+
+def _is_current(html_path, header):
+    if not os.path.exists(html_path):
+        return False
+    with open(html_path, encoding='utf-8') as f:
+        return f.readline().rstrip("\n") == header
+
 # main function
 def visualize_graphml(dataset, html_path):
-    graphml_file = f'./{dataset}/graph_chunk_entity_relation.graphml'
-    json_data = graphml_to_json(graphml_file)
+    """
+    Write the level-of-detail view of the dataset's knowledge graph to `html_path`.
+
+    The layout is computed in Python and cached with the graph (see
+    utils.graph_layout), so the browser only draws fixed positions: community
+    super-nodes first, expanded into sub-communities and entities on click.
+    The file is left as is while the graph is unchanged.
+    """
+    header = _html_header(dataset)
+    if _is_current(html_path, header):
+        return
     html_dir = os.path.dirname(html_path)
     if not os.path.exists(html_dir):
         os.makedirs(html_dir)
 
-    save_as_html(html_path, create_json(json_data))
+    save_as_html(html_path, create_json(graph_lod_json(dataset)), header)
+
+def visualize_neighborhood(dataset, entities, hops=1):
+    """
+    HTML of the `hops`-hop neighborhood of the given entities (e.g. the
+    entities retrieved by the last search), with the entities highlighted.
+    Returns (html, entities not found in the graph).
+    """
+    graph_json, missing = neighborhood_json(dataset, entities, hops)
+    return render_html(create_json(graph_json)), list(missing)
@@ -0,0 +1,154 @@
+import os
+import re
+import json
+import codecs
+import hashlib
+from dotenv import load_dotenv
+from lightrag.utils import sanitize_text_for_encoding
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+MANIFEST_FILE = "index_manifest.json"
+CHECKPOINT_FILE = "ingest_checkpoint.json"
+READ_WINDOW_BYTES = int(os.getenv("READ_WINDOW_BYTES", 1024 * 1024))
+PARAGRAPH_SEPARATOR = re.compile(r"\n\s*\n")
+INDEX_SEGMENT_CHARS = int(os.getenv("INDEX_SEGMENT_CHARS", 8000))
+# 段落ハッシュがこの値で割り切れる位置でセグメントを区切る（内容依存の境界）
+INDEX_SEGMENT_BOUNDARY = int(os.getenv("INDEX_SEGMENT_BOUNDARY", 8))
+
+
+# マニフェストの読み込み/保存
+def load_manifest(working_dir):
+    path = os.path.join(working_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(working_dir, manifest):
+    _save_json(os.path.join(working_dir, MANIFEST_FILE), manifest)
+
+# 大きなファイルの投入途中の進捗（再開用）
+def load_checkpoint(working_dir):
+    path = os.path.join(working_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_checkpoint(working_dir, checkpoint):
+    _save_json(os.path.join(working_dir, CHECKPOINT_FILE), checkpoint)
+
+def _save_json(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# ファイル全体を1ドキュメントとして登録した場合のID（ainsertと同じく整形後のテキストから計算する）
+# 整形とハッシュの計算は窓ごとに行い、ファイル全体を読み込まない
+def whole_file_doc_id(path, window_chars=READ_WINDOW_BYTES):
+    digest = hashlib.md5()
+    carry = ""
+    pending = ""
+    started = False
+    with open(path, encoding="utf-8") as f:
+        while True:
+            block = f.read(window_chars)
+            text = carry + block
+            # 改行と空白はHTMLエスケープの途中に現れないため、最後の改行/空白の直後で区切る
+            cut = max(text.rfind("\n"), text.rfind(" ")) + 1 if block else len(text)
+            carry = text[cut:]
+            # 窓の両端の空白が除去されないよう"<"で挟んで整形する（"<"は整形で変わらず、エスケープを終端させる）
+            content = pending + sanitize_text_for_encoding(f"<{text[:cut]}<")[1:-1]
+            if not started:
+                content = content.lstrip()
+            # 末尾の空白は後ろに空白以外が続く場合だけハッシュに含める（テキスト全体の前後の空白は除去される）
+            body = content.rstrip()
+            pending = content[len(body):]
+            if body:
+                digest.update(body.encode("utf-8"))
+                started = True
+            if not block:
+                return f"doc-{digest.hexdigest()}"
+
+
+def iter_paragraphs(path, window_bytes=READ_WINDOW_BYTES):
+    """
+    Yield the paragraphs of a UTF-8 file while reading it in bounded windows.
+
+    The text after the last separator of a window is carried over to the next
+    one, so the paragraphs are identical to splitting the whole file at once.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    carry = ""
+    # 持ち越した部分は区切りから始まるため、分割した先頭の空文字列（前の窓で出力済みの境界）は捨てる
+    skip = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(window_bytes)
+            text = carry + decoder.decode(block, final=not block)
+            if not block:
+                yield from PARAGRAPH_SEPARATOR.split(text)[skip:]
+                return
+            last = None
+            for last in PARAGRAPH_SEPARATOR.finditer(text):
+                pass
+            if last is None:
+                carry = text
+                continue
+            carry = text[last.start():]
+            yield from PARAGRAPH_SEPARATOR.split(text[:last.start()])[skip:]
+            skip = 1
+
+
+def segment_paragraphs(paragraphs, max_chars=INDEX_SEGMENT_CHARS, boundary=INDEX_SEGMENT_BOUNDARY):
+    """
+    Group paragraphs into segments whose boundaries depend only on content.
+
+    A segment ends after a paragraph whose hash is divisible by `boundary` or once
+    it reaches `max_chars`, so editing or appending paragraphs only changes the
+    segments around the edit and the rest keep their document ids.
+    """
+    current = []
+    size = 0
+    for paragraph in paragraphs:
+        if not paragraph.strip():
+            continue
+        current.append(paragraph)
+        size += len(paragraph)
+        digest = int(hashlib.md5(paragraph.encode("utf-8")).hexdigest()[:8], 16)
+        if size >= max_chars or digest % boundary == 0:
+            yield "\n\n".join(current)
+            current = []
+            size = 0
+    if current:
+        yield "\n\n".join(current)
+
+def iter_segments(path, max_chars=INDEX_SEGMENT_CHARS, boundary=INDEX_SEGMENT_BOUNDARY):
+    return segment_paragraphs(iter_paragraphs(path), max_chars, boundary)
+
+
+# マニフェスト全体で参照されているドキュメントIDの集合
+def referenced_doc_ids(manifest):
+    return {doc_id for entry in manifest["files"].values() for doc_id in entry["doc_ids"]}
+
+# マニフェストから参照されなくなったドキュメントをインデックスから削除
+async def delete_docs(rag, manifest, doc_ids):
+    still_referenced = referenced_doc_ids(manifest)
+    removed = 0
+    for doc_id in doc_ids:
+        if doc_id not in still_referenced:
+            await rag.adelete_by_doc_id(doc_id)
+            removed += 1
+    return removed
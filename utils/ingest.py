@@ -0,0 +1,194 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from lightrag.utils import compute_mdhash_id
+from utils.index_manifest import (
+    file_sha256,
+    whole_file_doc_id,
+    iter_segments,
+    save_manifest,
+    load_checkpoint,
+    save_checkpoint,
+    delete_docs,
+)
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+PARSE_METHOD = os.getenv("PARSE_METHOD", "auto")
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", 32))
+
+
+def list_files(folder, extensions, recursive=True):
+    files = []
+    for root, dirs, names in os.walk(folder):
+        files.extend(
+            os.path.join(root, name)
+            for name in names
+            if os.path.splitext(name)[1].lower() in extensions
+        )
+        if not recursive:
+            break
+    return sorted(files)
+
+# データセットのテキストファイル一覧（data/<name>.txt と data/<name>/ 配下の .txt）
+def list_text_files(data_dir, dataset):
+    files = []
+    single_file = os.path.join(data_dir, f"{dataset}.txt")
+    if os.path.isfile(single_file):
+        files.append(single_file)
+    dataset_dir = os.path.join(data_dir, dataset)
+    if os.path.isdir(dataset_dir):
+        files.extend(list_files(dataset_dir, [".txt"]))
+    return files
+
+
+async def _insert_batch(rag, path, batch):
+    await rag.ainsert(
+        [segment for _, segment in batch],
+        ids=[doc_id for doc_id, _ in batch],
+        file_paths=[path] * len(batch),
+    )
+
+
+async def sync_text_files(rag, working_dir, paths, manifest, batch_size=INSERT_BATCH_SIZE):
+    """
+    Stream the text files and insert only their new segments; delete vanished ones.
+
+    Files are read in bounded windows and new segments are inserted in batches of
+    `batch_size`. After every batch the number of processed segments is written
+    to the ingest checkpoint, so an interrupted run resumes after the last
+    committed batch instead of starting over.
+    """
+    summary = {"added": 0, "removed": 0, "unchanged": 0, "failed": 0}
+    checkpoint = load_checkpoint(working_dir)
+    # 置き換えられたドキュメントは最後にまとめて削除する。
+    # マニフェストからは先に外れるため、中断しても削除できるよう削除するまでマニフェストに残す
+    stale_ids = set(manifest.get("stale_doc_ids", []))
+    # マニフェスト導入前のインデックス（ファイル全体を1ドキュメントとして登録していた）か。
+    # 途中で中断しても残りのファイルを置き換えられるよう、すべてのファイルを処理するまでマニフェストに残す
+    if "legacy_index" not in manifest:
+        manifest["legacy_index"] = not manifest["files"] and not await rag.doc_status.is_empty()
+    for path in paths:
+        file_hash = file_sha256(path)
+        entry = manifest["files"].get(path)
+        if entry is None:
+            entry = {"sha256": None, "kind": "text", "doc_ids": []}
+            # ファイル全体を1ドキュメントとして登録していた場合は置き換える
+            if manifest["legacy_index"]:
+                legacy_id = whole_file_doc_id(path)
+                if await rag.doc_status.get_by_id(legacy_id):
+                    entry["doc_ids"].append(legacy_id)
+        if entry["sha256"] == file_hash:
+            summary["unchanged"] += len(entry["doc_ids"])
+            continue
+
+        old_ids = set(entry["doc_ids"])
+        progress = checkpoint.get(path, {})
+        resume_from = progress.get("segments", 0) if progress.get("sha256") == file_hash else 0
+        doc_ids = {}
+        batch = []
+        for index, segment in enumerate(iter_segments(path)):
+            doc_id = compute_mdhash_id(segment, prefix="doc-")
+            if doc_id in doc_ids:
+                continue
+            doc_ids[doc_id] = None
+            if index < resume_from or doc_id in old_ids:
+                summary["unchanged"] += 1
+                continue
+            batch.append((doc_id, segment))
+            if len(batch) >= batch_size:
+                await _insert_batch(rag, path, batch)
+                summary["added"] += len(batch)
+                batch = []
+                checkpoint[path] = {"sha256": file_hash, "segments": index + 1}
+                save_checkpoint(working_dir, checkpoint)
+        if batch:
+            await _insert_batch(rag, path, batch)
+            summary["added"] += len(batch)
+
+        stale_ids |= old_ids - doc_ids.keys()
+        manifest["stale_doc_ids"] = sorted(stale_ids)
+        manifest["files"][path] = {"sha256": file_hash, "kind": "text", "doc_ids": list(doc_ids)}
+        save_manifest(working_dir, manifest)
+        checkpoint.pop(path, None)
+        save_checkpoint(working_dir, checkpoint)
+
+    manifest["legacy_index"] = False
+
+    # 削除されたテキストファイル
+    for path, entry in list(manifest["files"].items()):
+        if entry["kind"] == "text" and path not in paths:
+            stale_ids |= set(entry["doc_ids"])
+            del manifest["files"][path]
+
+    summary["removed"] = await delete_docs(rag, manifest, stale_ids)
+    manifest["stale_doc_ids"] = []
+    save_manifest(working_dir, manifest)
+    return summary
+
+
+# ドキュメントの解析（CPU負荷が高いため別プロセスで実行する）
+def parse_document(path, output_dir, parse_method=PARSE_METHOD):
+    from raganything.parser import MineruParser
+    return MineruParser().parse_document(path, method=parse_method, output_dir=output_dir)
+
+
+async def sync_multimodal_files(rag_anything, working_dir, folder, extensions, manifest, workers=PARSE_WORKERS):
+    """
+    Parse new or changed documents in a process pool and insert them; delete removed ones.
+
+    Parsing (MinerU) runs in up to `workers` processes while the parsed content
+    lists are inserted one at a time, so LLM/embedding concurrency stays governed
+    by the LightRAG settings.
+    """
+    summary = {"added": 0, "removed": 0, "unchanged": 0, "failed": 0}
+    current = set()
+    changed = []
+    for path in list_files(folder, extensions):
+        current.add(path)
+        file_hash = file_sha256(path)
+        entry = manifest["files"].get(path)
+        if entry is not None and entry["sha256"] == file_hash:
+            summary["unchanged"] += 1
+        else:
+            changed.append((path, file_hash))
+
+    loop = asyncio.get_running_loop()
+    insert_lock = asyncio.Lock()
+
+    async def ingest(executor, path, file_hash):
+        content_list = await loop.run_in_executor(executor, parse_document, path, working_dir)
+        doc_id = compute_mdhash_id(file_hash, prefix="doc-")
+        async with insert_lock:
+            await rag_anything.insert_content_list(content_list, file_path=path, doc_id=doc_id)
+            old_entry = manifest["files"].get(path)
+            manifest["files"][path] = {"sha256": file_hash, "kind": "multimodal", "doc_ids": [doc_id]}
+            if old_entry is not None:
+                summary["removed"] += await delete_docs(rag_anything.lightrag, manifest, old_entry["doc_ids"])
+            save_manifest(working_dir, manifest)
+            summary["added"] += 1
+
+    if changed:
+        # イベントループのスレッドからforkしないようにspawnでワーカーを起動する
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(changed)), mp_context=context) as executor:
+            results = await asyncio.gather(
+                *(ingest(executor, path, file_hash) for path, file_hash in changed),
+                return_exceptions=True,
+            )
+        for (path, _), result in zip(changed, results):
+            if isinstance(result, Exception):
+                print(f"Failed to ingest {path}: {result}")
+                summary["failed"] += 1
+
+    for path, entry in list(manifest["files"].items()):
+        if entry["kind"] == "multimodal" and path not in current:
+            del manifest["files"][path]
+            summary["removed"] += await delete_docs(rag_anything.lightrag, manifest, entry["doc_ids"])
+            save_manifest(working_dir, manifest)
+    return summary
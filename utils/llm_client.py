@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+import importlib.util
+import httpx
+from dotenv import load_dotenv
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 32))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 16))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", 60))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", 180))
+# LLM/ビジョン/埋め込みの全リクエストで共有する同時実行数とレート制限（0以下は無制限）
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", 8))
+API_REQUESTS_PER_MINUTE = int(os.getenv("API_REQUESTS_PER_MINUTE", 0))
+API_TOKENS_PER_MINUTE = int(os.getenv("API_TOKENS_PER_MINUTE", 0))
+
+
+class _SharedAsyncClient(httpx.AsyncClient):
+    """
+    httpx client that survives `AsyncOpenAI.close()`.
+
+    openai_complete_if_cache and openai_embed close their AsyncOpenAI client
+    after every call, which closes the http_client passed to it. Ignoring
+    aclose() keeps the pooled keep-alive connections for the next call.
+    """
+
+    async def aclose(self):
+        pass
+
+    async def shutdown(self):
+        await super().aclose()
+
+
+# 1分あたりのリクエスト数/トークン数を制限するトークンバケット
+class RateLimiter:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        if self.capacity <= 0:
+            return
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) * 60 / self.capacity)
+
+
+# 文字数からトークン数を概算する（日本語は1文字1トークン前後になるため控えめに見積もる）
+def estimate_tokens(*texts):
+    return max(1, sum(len(text) for text in texts if isinstance(text, str)) // 2)
+
+
+class SharedLLMClient:
+    """
+    Process-wide HTTP client, concurrency semaphore and rate limiters shared by
+    the LLM, vision and embedding functions.
+
+    One pooled httpx client (HTTP/2 when the `h2` package is installed) is
+    created per event loop and handed to the OpenAI SDK through
+    `openai_client_configs` / `client_configs`.
+    """
+
+    def __init__(self, max_concurrency=API_MAX_CONCURRENCY,
+                 requests_per_minute=API_REQUESTS_PER_MINUTE, tokens_per_minute=API_TOKENS_PER_MINUTE):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.http2 = importlib.util.find_spec("h2") is not None
+        self._per_loop = {}
+        self.requests = 0
+        self.waiting = 0
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self._per_loop.get(loop)
+        if state is None:
+            state = {
+                "http_client": _SharedAsyncClient(
+                    http2=self.http2,
+                    timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS),
+                    limits=httpx.Limits(
+                        max_connections=HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                        keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+                    ),
+                ),
+                "semaphore": asyncio.Semaphore(self.max_concurrency) if self.max_concurrency > 0 else None,
+                "requests": RateLimiter(self.requests_per_minute),
+                "tokens": RateLimiter(self.tokens_per_minute),
+            }
+            self._per_loop[loop] = state
+        return state
+
+    # OpenAI SDKの自動再試行は同時実行数の枠を持ったまま待機するため無効にする（再試行は呼び出し側で行う）
+    def client_configs(self):
+        return {"http_client": self._state()["http_client"], "max_retries": 0}
+
+    async def acquire(self, tokens=1):
+        state = self._state()
+        self.waiting += 1
+        try:
+            await state["requests"].acquire()
+            await state["tokens"].acquire(tokens)
+            if state["semaphore"] is not None:
+                await state["semaphore"].acquire()
+        finally:
+            self.waiting -= 1
+        self.requests += 1
+
+    def release(self):
+        semaphore = self._state()["semaphore"]
+        if semaphore is not None:
+            semaphore.release()
+
+    async def call(self, coro_func, tokens=1):
+        """Run `coro_func()` under the shared limits; streamed responses hold the slot until exhausted."""
+        await self.acquire(tokens)
+        try:
+            result = await coro_func()
+        except BaseException:
+            self.release()
+            raise
+        if hasattr(result, "__aiter__"):
+            return self._release_after(result)
+        self.release()
+        return result
+
+    async def _release_after(self, iterator):
+        try:
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "http2": self.http2,
+            "requests": self.requests,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+        }
+
+    async def aclose(self):
+        state = self._per_loop.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state["http_client"].shutdown()
+
+
+# プロセス全体で共有するクライアント
+llm_client = SharedLLMClient()
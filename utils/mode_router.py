@@ -0,0 +1,137 @@
+"""
+Search mode router for the "auto" mode.
+
+Picks the cheapest search mode that should answer the query, without an LLM
+call: `naive` skips keyword extraction and the graph entirely, `local` and
+`global` run one graph retrieval and `hybrid` both. The decision uses cue
+words for corpus-wide questions (themes, summaries) and for relationships, and
+the knowledge-graph entities the query mentions.
+
+Every decision is printed and, when ROUTER_LOG_FILE is set, appended to it as
+a JSON line (with the trace id, so it can be joined with TRACE_FILE).
+"""
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass, field, asdict
+from dotenv import load_dotenv
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+ROUTER_LOG_FILE = os.getenv("ROUTER_LOG_FILE")
+ROUTER_MIN_ENTITY_CHARS = int(os.getenv("ROUTER_MIN_ENTITY_CHARS", 3))
+# 文章全体にまたがる質問の手がかり語
+GLOBAL_CUES = [
+    "全体", "全般", "テーマ", "主題", "要約", "まとめ", "概要", "あらすじ", "傾向", "主な", "主要な", "知見", "教訓", "総括",
+    "overall", "overview", "summar", "theme", "main point", "key point", "trend", "in general", "lesson", "takeaway", "the whole",
+]
+# エンティティ同士の関係を問う質問の手がかり語
+RELATION_CUES = [
+    "関係", "関わ", "つなが", "繋が", "影響", "違い", "比較", "共通",
+    "relat", "between", "connect", "interact", "influenc", "affect", "compar", "differ", "in common",
+]
+# エンティティとして抽出されていても質問中の一致には使わない語
+STOPWORD_ENTITIES = {"the", "they", "them", "this", "that", "these", "those", "what", "which", "who", "how", "you", "and", "she", "him", "her", "his", "its"}
+
+
+@dataclass
+class Route:
+    mode: str
+    reason: str
+    entities: list = field(default_factory=list)
+    cues: list = field(default_factory=list)
+
+
+class EntityMatcher:
+    """Finds the entity names mentioned in a query (case-insensitive, whole words for ASCII names)."""
+
+    def __init__(self, names):
+        self._names = {}
+        self._lengths = {}
+        for name in names:
+            key = str(name).strip().lower()
+            if len(key) < ROUTER_MIN_ENTITY_CHARS or key in STOPWORD_ENTITIES:
+                continue
+            self._names[key] = str(name)
+            self._lengths.setdefault(key[0], set()).add(len(key))
+        # 先頭の文字ごとの名前の長さ（長い名前を優先して一致させる）
+        self._lengths = {char: sorted(lengths, reverse=True) for char, lengths in self._lengths.items()}
+
+    def __len__(self):
+        return len(self._names)
+
+    def find(self, query):
+        text = query.lower()
+        found = []
+        i = 0
+        while i < len(text):
+            for length in self._lengths.get(text[i], ()):
+                end = i + length
+                name = self._names.get(text[i:end]) if end <= len(text) else None
+                if name is not None and _word_boundary(text, i, end):
+                    if name not in found:
+                        found.append(name)
+                    i = end - 1
+                    break
+            i += 1
+        return found
+
+
+def _is_ascii_word(char):
+    return char.isascii() and char.isalnum()
+
+# 英数字の名前は単語の途中で一致させない（日本語は区切りがないのでそのまま一致させる）
+def _word_boundary(text, start, end):
+    if start > 0 and _is_ascii_word(text[start]) and _is_ascii_word(text[start - 1]):
+        return False
+    if end < len(text) and _is_ascii_word(text[end - 1]) and _is_ascii_word(text[end]):
+        return False
+    return True
+
+def _cues(text, cues):
+    return [cue for cue in cues if cue in text]
+
+def route(query, matcher=None):
+    """The cheapest adequate mode for `query`. `matcher` finds the knowledge-graph entities it mentions."""
+    text = query.lower()
+    entities = matcher.find(query) if matcher is not None else []
+    global_cues = _cues(text, GLOBAL_CUES)
+    relation_cues = _cues(text, RELATION_CUES)
+    if global_cues and entities:
+        return Route("hybrid", "corpus-wide question about specific entities", entities, global_cues)
+    if global_cues:
+        return Route("global", "corpus-wide question", entities, global_cues)
+    if entities:
+        reason = "relationship between entities" if relation_cues or len(entities) > 1 else "question about an entity"
+        return Route("local", reason, entities, relation_cues)
+    if relation_cues:
+        return Route("local", "relationship question without known entities", entities, relation_cues)
+    return Route("naive", "no entities or cues, plain similarity search is enough", entities, [])
+
+
+# データセットごとのエンティティ名の一致器（インデックスが更新されたら作り直す）
+_matchers = {}
+_log_lock = threading.Lock()
+
+async def entity_matcher(key, version, load_names):
+    """EntityMatcher for `key`, rebuilt from `await load_names()` when `version` changes."""
+    cached = _matchers.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    matcher = EntityMatcher(await load_names())
+    _matchers[key] = (version, matcher)
+    return matcher
+
+def log_decision(dataset, query, decision, trace_id=None):
+    print(f"[Auto mode] {decision.mode}: {decision.reason} (entities: {decision.entities[:5]}, cues: {decision.cues})")
+    if not ROUTER_LOG_FILE:
+        return
+    line = json.dumps(
+        {"time": time.time(), "dataset": dataset, "query": query, "trace_id": trace_id, **asdict(decision)},
+        ensure_ascii=False,
+    )
+    with _log_lock, open(ROUTER_LOG_FILE, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
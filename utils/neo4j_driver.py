@@ -0,0 +1,87 @@
+import os
+import time
+import atexit
+import threading
+from dotenv import load_dotenv
+from neo4j import GraphDatabase
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+NEO4J_MAX_CONNECTION_POOL_SIZE = int(os.getenv("NEO4J_MAX_CONNECTION_POOL_SIZE", 50))
+NEO4J_CONNECTION_ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", 60))
+NEO4J_VERIFY_TTL = float(os.getenv("NEO4J_VERIFY_TTL", 60))
+
+_lock = threading.Lock()
+_driver = None
+_verified_at = None
+_metrics = {
+    "driver_created_at": None,
+    "verifications": 0,
+    "verification_cache_hits": 0,
+    "verification_failures": 0,
+    "last_verified_at": None,
+    "last_verify_ms": None,
+    "last_error": None,
+}
+
+# プロセス全体で共有するNeo4jドライバー（初回呼び出し時に作成）
+def get_driver():
+    global _driver
+    with _lock:
+        if _driver is None:
+            _driver = GraphDatabase.driver(
+                os.getenv("NEO4J_URI"),
+                auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")),
+                max_connection_pool_size=NEO4J_MAX_CONNECTION_POOL_SIZE,
+                connection_acquisition_timeout=NEO4J_CONNECTION_ACQUISITION_TIMEOUT,
+            )
+            _metrics["driver_created_at"] = time.time()
+        return _driver
+
+# 接続確認（成功した結果はNEO4J_VERIFY_TTL秒キャッシュし、失敗はキャッシュしない）
+def verify_connectivity(force=False):
+    global _verified_at
+    with _lock:
+        if not force and _verified_at is not None and time.monotonic() - _verified_at < NEO4J_VERIFY_TTL:
+            _metrics["verification_cache_hits"] += 1
+            return
+    driver = get_driver()
+    start = time.perf_counter()
+    try:
+        driver.verify_connectivity()
+    except Exception as e:
+        with _lock:
+            _verified_at = None
+            _metrics["verification_failures"] += 1
+            _metrics["last_error"] = f"{type(e).__name__}: {e}"
+        raise
+    with _lock:
+        _verified_at = time.monotonic()
+        _metrics["verifications"] += 1
+        _metrics["last_verified_at"] = time.time()
+        _metrics["last_verify_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+def health():
+    """Connection settings and verification counters of the shared driver."""
+    with _lock:
+        return {
+            "uri": os.getenv("NEO4J_URI"),
+            "driver_open": _driver is not None,
+            "verified": _verified_at is not None and time.monotonic() - _verified_at < NEO4J_VERIFY_TTL,
+            "max_connection_pool_size": NEO4J_MAX_CONNECTION_POOL_SIZE,
+            "verify_ttl": NEO4J_VERIFY_TTL,
+            **_metrics,
+        }
+
+def close_driver():
+    global _driver, _verified_at
+    with _lock:
+        if _driver is not None:
+            _driver.close()
+        _driver = None
+        _verified_at = None
+
+
+atexit.register(close_driver)
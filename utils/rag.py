@@ -1,20 +1,35 @@
 import os
+import random
+import asyncio
+import hashlib
+import functools
+import contextlib
+import contextvars
+from dataclasses import asdict, replace
 import numpy as np
-import streamlit as st
 from dotenv import load_dotenv
-from lightrag import LightRAG, QueryParam
+from openai import RateLimitError, APIConnectionError, APITimeoutError
+from lightrag import LightRAG, QueryParam, operate
+from lightrag.kg import STORAGES, STORAGE_IMPLEMENTATIONS
 from lightrag.kg.shared_storage import initialize_pipeline_status
-from lightrag.llm.openai import openai_embed, openai_complete_if_cache
-from lightrag.utils import EmbeddingFunc, setup_logger
-from utils.common import select_graph_storage
-from raganything import RAGAnything, RAGAnythingConfig
-from utils.common import ModalType
+from lightrag.llm.openai import openai_embed, openai_complete_if_cache, InvalidResponseError
+from lightrag.operate import get_keywords_from_query
+from lightrag.utils import EmbeddingFunc, TokenTracker, setup_logger
+from utils import tracing, mode_router, community_reports
+from utils.config import ModalType, AUTO_MODE, ANN_VECTOR_STORAGE, hot_dataset_configs
+from utils.rag_pool import RagPool
+from utils.embedding_cache import EmbeddingCache
+from utils.llm_client import llm_client, estimate_tokens
+from utils.answer_cache import AnswerCache, get_index_version, bump_index_version
+from utils.index_manifest import load_manifest
+from utils.ingest import list_text_files, sync_text_files, sync_multimodal_files
 
 # 環境変数をロード
 load_dotenv()
 
 # 定数の設定
 DATA_DIR = "./data"
+MULTIMODAL_EXTENSIONS = [".jpeg", ".jpg", ".png", ".pdf", ".pptx", ".docx"]
 API_KEY = os.getenv("API_KEY")
 BASE_URL = os.getenv("API_HOST", "https://generativelanguage.googleapis.com/v1beta/openai")
 LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-flash")
@@ -23,60 +38,197 @@ MAX_TOKENS = int(os.getenv("MAX_TOKENS", 4096))
 EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 768))
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 512))
 MAX_ASYNC = int(os.getenv("MAX_ASYNC", 1))
+LLM_MAX_ASYNC = int(os.getenv("LLM_MAX_ASYNC", MAX_ASYNC))
+EMBEDDING_MAX_ASYNC = int(os.getenv("EMBEDDING_MAX_ASYNC", MAX_ASYNC))
+MAX_PARALLEL_INSERT = int(os.getenv("MAX_PARALLEL_INSERT", 2))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", 5))
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", 300))
+DEFAULT_QUERY = "この文章を読むとどのような知見が得られるか簡潔にまとめてください。"
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InvalidResponseError)
+GRAPH_TRACED_METHODS = [
+    "get_node", "get_edge", "get_node_edges", "node_degree", "edge_degree",
+    "get_nodes_batch", "node_degrees_batch", "edge_degrees_batch", "get_edges_batch", "get_nodes_edges_batch",
+    "upsert_node", "upsert_edge",
+]
 
 setup_logger("lightrag", level="INFO")
 
-# LLMモデル関数の定義
-async def llm_model_func(prompt, system_prompt=None, history_messages=[], **kwargs) -> str:
+# 近似最近傍検索のベクトルストレージをLightRAGに登録する（選ばれたときだけfaissを読み込む）
+STORAGES[ANN_VECTOR_STORAGE] = "utils.ann_storage"
+if ANN_VECTOR_STORAGE not in STORAGE_IMPLEMENTATIONS["VECTOR_STORAGE"]["implementations"]:
+    STORAGE_IMPLEMENTATIONS["VECTOR_STORAGE"]["implementations"].append(ANN_VECTOR_STORAGE)
+
+# Retry-Afterヘッダーがあればその秒数、なければ指数バックオフ（ジッター付き）で待機する
+def _rate_limit_delay(error, attempt):
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(60, 2 ** attempt) * (1 + random.random())
+
+# レート制限（429）や一時的な接続エラーの時にバックオフして再試行する
+# 待機はllm_client.call()の外で行うため、待っている間は同時実行数の枠を他の呼び出しに譲る
+def retry_on_rate_limit(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+            try:
+                return await func(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt == RATE_LIMIT_MAX_RETRIES:
+                    raise
+                delay = _rate_limit_delay(e, attempt)
+                reason = "Rate limited" if isinstance(e, RateLimitError) else type(e).__name__
+                print(f"{reason} by {BASE_URL}, retrying in {delay:.1f}s ({attempt + 1}/{RATE_LIMIT_MAX_RETRIES})")
+                await asyncio.sleep(delay)
+    return wrapper
+
+# 呼び出し元ごとのトークン使用量（track_token_usage()の中で行われたLLM/埋め込み呼び出しを集計する）
+_token_tracker = contextvars.ContextVar("token_tracker", default=None)
+
+@contextlib.contextmanager
+def track_token_usage():
     """
-    async with semaphore:
-        return await openai_complete_if_cache(
-            LLM_MODEL,
-            prompt,
-            system_prompt=system_prompt,
-            history_messages=history_messages,
-            api_key=API_KEY,
-            base_url=BASE_URL,
-            **kwargs
-        )
+    Collect the token usage reported by the API for the LLM and vision calls
+    made in this context, including the calls LightRAG runs on its queue
+    workers. Embedding calls are counted when the caller sends the batch
+    itself (requests merged by the embedding cache count for the sender).
+    Cached responses cost nothing.
     """
-    return await openai_complete_if_cache(
+    tracker = TokenTracker()
+    token = _token_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _token_tracker.reset(token)
+
+def _with_token_tracker(kwargs):
+    tracker = _token_tracker.get()
+    if tracker is not None:
+        kwargs.setdefault("token_tracker", tracker)
+    return kwargs
+
+# LLM/ビジョン呼び出しを呼び出し元のタスクで計測し、集計先を引数で渡す
+# （LightRAGはLLM呼び出しをキューのワーカータスクで実行するため、コンテキスト変数が引き継がれない）
+def _traced_call(name):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            kwargs = _with_token_tracker(kwargs)
+            stage = "keywords" if kwargs.get("keyword_extraction") else name
+            span = tracing.start_span(stage)
+            if span is None:
+                return await func(*args, **kwargs)
+            kwargs["token_tracker"] = span.count_tokens(kwargs.get("token_tracker"))
+            try:
+                with tracing.activate(span):
+                    result = await func(*args, **kwargs)
+            except BaseException as e:
+                span.fail(e)
+                raise
+            # ストリーミングの応答は読み終えるまでをスパンに含める
+            if hasattr(result, "__aiter__"):
+                return tracing.finish_after(span, result)
+            span.finish()
+            return result
+        return wrapper
+    return decorator
+
+# 埋め込み呼び出しの計測（トークン数は概算）
+def _traced_embedding(func):
+    @functools.wraps(func)
+    async def wrapper(texts, *args, **kwargs):
+        with tracing.span("embedding", texts=len(texts), estimated_tokens=estimate_tokens(*texts)):
+            return await func(texts, *args, **kwargs)
+    return wrapper
+
+# ストレージの呼び出しを計測する（LightRAGの検索・挿入処理から直接呼ばれるメソッドを包む）
+def _trace_storages(rag):
+    # クエリの埋め込みはtext_chunksの埋め込み関数で事前に計算される
+    for storage in [rag.text_chunks, rag.entities_vdb, rag.relationships_vdb, rag.chunks_vdb]:
+        if storage.embedding_func is not None:
+            storage.embedding_func = replace(storage.embedding_func, func=_traced_embedding(storage.embedding_func.func))
+    for storage in [rag.entities_vdb, rag.relationships_vdb, rag.chunks_vdb]:
+        storage.query = tracing.traced("vector_retrieval")(storage.query)
+        storage.upsert = tracing.traced("vector_upsert")(storage.upsert)
+    graph = rag.chunk_entity_relation_graph
+    for name in GRAPH_TRACED_METHODS:
+        if hasattr(graph, name):
+            setattr(graph, name, tracing.traced("graph")(getattr(graph, name)))
+
+# LightRAGのコンテキスト構築（検索結果の絞り込み、チャンクの統合、プロンプト用の整形）を計測する
+operate._build_query_context = tracing.traced("context")(operate._build_query_context)
+
+# レート制限の計算に使うプロンプトのトークン数の概算
+def _prompt_tokens(prompt, kwargs):
+    messages = kwargs.get("messages") or kwargs.get("history_messages") or []
+    contents = [message.get("content") for message in messages if message]
+    return estimate_tokens(prompt, kwargs.get("system_prompt"), *contents)
+
+# LightRAGのOpenAI関数はtenacityで包まれており、同時実行数の枠を持ったまま待機して再試行するうえ、
+# 失敗するとRetryErrorで包んで送出する。再試行はretry_on_rate_limitで行うので包まれる前の関数を呼ぶ
+_complete_once = openai_complete_if_cache.__wrapped__
+_embed_once = openai_embed.func.__wrapped__
+
+# LLM/ビジョンの呼び出し（共有HTTPクライアントと同時実行数・レート制限を使う）
+@retry_on_rate_limit
+async def complete(prompt, **kwargs):
+    tokens = _prompt_tokens(prompt, kwargs)
+    return await llm_client.call(lambda: _complete_once(
       LLM_MODEL,
       prompt,
-      system_prompt=system_prompt,
-      history_messages=history_messages,
       api_key=API_KEY,
       base_url=BASE_URL,
+      openai_client_configs=llm_client.client_configs(),
+      **_with_token_tracker(kwargs)
+    ), tokens=tokens)
+
+# LLMモデル関数の定義
+async def llm_model_func(prompt, system_prompt=None, history_messages=[], **kwargs) -> str:
+    return await complete(
+      prompt,
+      system_prompt=system_prompt,
+      history_messages=history_messages,
       **kwargs
     )
 
-# 埋め込み関数の定義
-async def embedding_func(texts: list[str]) -> np.ndarray:
-    return await openai_embed(
+# openai_embedはtext-embedding-3-small（1536次元）用のEmbeddingFuncで包まれているため、
+# 次元数の検証はinitialize_ragのEmbeddingFuncに任せて中身の関数を直接呼ぶ
+@retry_on_rate_limit
+async def _embed_remote(texts: list[str]) -> np.ndarray:
+    return await llm_client.call(lambda: _embed_once(
         texts,
         model=EMBEDDING_MODEL,
         api_key=API_KEY,
         base_url=BASE_URL,
-    )
+        max_token_size=MAX_TOKENS,
+        client_configs=llm_client.client_configs(),
+        **_with_token_tracker({}),
+    ), tokens=estimate_tokens(*texts))
+
+# 埋め込み結果のキャッシュ（同時に発生した埋め込み要求はまとめてAPIに送る）
+embedding_cache = EmbeddingCache(_embed_remote, EMBEDDING_MODEL, EMBEDDING_DIM)
 
+# 埋め込み関数の定義
+async def embedding_func(texts: list[str]) -> np.ndarray:
+    return await embedding_cache.embed(texts)
+
+@_traced_call("vision")
 async def vision_model_func(
         prompt, system_prompt=None,
         history_messages=[], image_data=None,
         messages=None, **kwargs):
     if messages:
-        return await openai_complete_if_cache(
-            LLM_MODEL,
+        return await complete(
             "",
             system_prompt=None,
             history_messages=[],
             messages=messages,
-            api_key=API_KEY,
-            base_url=BASE_URL,
             **kwargs,
         )
     elif image_data:
-        return await openai_complete_if_cache(
-            LLM_MODEL,
+        return await complete(
             "",
             system_prompt=None,
             history_messages=[],
@@ -97,8 +249,6 @@ async def vision_model_func(
                 if image_data
                 else {"role": "user", "content": prompt},
             ],
-            api_key=API_KEY,
-            base_url=BASE_URL,
             **kwargs,
         )
     else:
@@ -110,16 +260,17 @@ async def vision_model_func(
         )
 
 # RAGオブジェクトの初期化
-async def initialize_rag():
-    graph_storage = select_graph_storage()
-    working_dir = st.session_state.working_dir
-    language = st.session_state.language
-
+async def initialize_rag(working_dir, language, graph_storage, vector_storage):
+    # LightRAGの共有ストレージはworkspace単位のため、同じプロセスで複数のデータセットを扱うと
+    # 内容が混ざる。データセット名をworkspaceにして分離する（保存先は従来通り working_dir 直下）
+    working_dir = os.path.normpath(working_dir)
     rag = LightRAG(
-        working_dir=working_dir,
+        working_dir=os.path.dirname(working_dir) or ".",
+        workspace=os.path.basename(working_dir),
         llm_model_func=llm_model_func,
-        llm_model_max_async=MAX_ASYNC,
-        embedding_func_max_async=MAX_ASYNC,
+        llm_model_max_async=LLM_MAX_ASYNC,
+        embedding_func_max_async=EMBEDDING_MAX_ASYNC,
+        max_parallel_insert=MAX_PARALLEL_INSERT,
         chunk_token_size=CHUNK_SIZE,
         embedding_func=EmbeddingFunc(
             embedding_dim=EMBEDDING_DIM,
@@ -127,18 +278,24 @@ async def initialize_rag():
             func=embedding_func
         ),
         graph_storage=graph_storage,
+        vector_storage=vector_storage,
         addon_params={
             "language": language,
             "entity_types": ["organization", "person", "geo", "event", "category", "product"],
         },
     )
+    rag.llm_model_func = _traced_call("llm")(rag.llm_model_func)
+    _trace_storages(rag)
     await rag.initialize_storages()
-    await initialize_pipeline_status()
+    await initialize_pipeline_status(workspace=rag.workspace)
     return rag
 
-def initialize_rag_anything(rag):
+def initialize_rag_anything(rag, working_dir):
+    # raganything（MinerUを含む）は読み込みに時間がかかるため、マルチモーダル処理で初めて使うときにインポートする
+    from raganything import RAGAnything, RAGAnythingConfig
+
     config = RAGAnythingConfig(
-       working_dir=st.session_state.working_dir,
+       working_dir=working_dir,
        parser="mineru",
        parse_method="auto",
        enable_image_processing=True,
@@ -153,62 +310,244 @@ def initialize_rag_anything(rag):
     )
     return rag_anything
 
+class LazyRagAnything:
+    """RAGAnything for `rag`, created on first attribute access (text-only use never imports raganything)."""
+
+    def __init__(self, rag, working_dir):
+        self._rag = rag
+        self._working_dir = working_dir
+        self._instance = None
+
+    def __getattr__(self, name):
+        if self._instance is None:
+            with tracing.span("storage_init", component="raganything"):
+                self._instance = initialize_rag_anything(self._rag, self._working_dir)
+        return getattr(self._instance, name)
+
+# プールに保持するRAGインスタンスの生成
+async def create_rag_instances(working_dir, language, graph_storage, vector_storage):
+    with tracing.span("storage_init", component="lightrag", graph_storage=graph_storage, vector_storage=vector_storage):
+        rag = await initialize_rag(working_dir, language, graph_storage, vector_storage)
+    return rag, LazyRagAnything(rag, working_dir)
+
+# プロセス全体で共有するRAGインスタンスのプール
+rag_pool = RagPool(create_rag_instances)
+# 検索結果のキャッシュ
+answer_cache = AnswerCache()
+_hot_preload = None
+
+# RAG_HOT_DATASETSのデータセットをバックグラウンドで読み込んでおく（プロセスごとに一度だけ）
+def preload_hot_datasets(default_language="Japanese"):
+    """Start loading the RAG_HOT_DATASETS instances into `rag_pool`. Returns the concurrent Future."""
+    global _hot_preload
+    if _hot_preload is None:
+        keys = []
+        for config in hot_dataset_configs(default_language):
+            if os.path.isdir(config.working_dir):
+                keys.append(config.pool_key)
+            else:
+                print(f"Hot dataset `{config.working_dir}` has no index yet, skipping preload.")
+        _hot_preload = rag_pool.submit(rag_pool.preload(keys))
+    return _hot_preload
+
+# グローバル検索用のコミュニティレポートを更新する（内容が変わったコミュニティだけLLMで作り直す）
+async def _refresh_community_reports(config, lightrag):
+    if not community_reports.COMMUNITY_REPORTS:
+        return None
+    with tracing.span("community_reports") as span:
+        try:
+            counts = await community_reports.refresh_reports(config.working_dir, lightrag.llm_model_func, config.language)
+        except Exception as e:
+            # レポートがなくてもLightRAGのグローバル検索で回答できるので、インデックス作成は失敗させない
+            print(f"Community report refresh failed: {e}")
+            counts = None
+        if span is not None and counts is not None:
+            span.set(**counts)
+    return counts
+
+async def _make_index(config, text_files, data_dir=DATA_DIR, trace=None):
+  working_dir = config.working_dir
+  with tracing.record("make_index", trace, dataset=working_dir, graph_storage=config.graph_storage, vector_storage=config.vector_storage) as trace:
+    manifest = load_manifest(working_dir)
+    async with rag_pool.borrow(*config.pool_key) as (lightrag, rag):
+      with tracing.span("sync_text", files=len(text_files)):
+        text_summary = await sync_text_files(lightrag, working_dir, text_files, manifest)
+      with tracing.span("sync_multimodal"):
+        multimodal_summary = await sync_multimodal_files(
+          rag,
+          working_dir,
+          data_dir,
+          MULTIMODAL_EXTENSIONS,
+          manifest,
+        )
+      # 前回失敗したドキュメントを再処理する
+      with tracing.span("process_queue"):
+        await lightrag.apipeline_process_enqueue_documents()
+      reports_summary = await _refresh_community_reports(config, lightrag)
+    summary = {key: text_summary[key] + multimodal_summary[key] for key in text_summary}
+    trace.root.set(**summary)
+    if reports_summary is not None:
+      summary["community_reports"] = reports_summary
+    if summary["added"] or summary["removed"]:
+      # 同じデータセットを参照する他のインスタンスとキャッシュ済みの回答は古くなるので破棄する
+      await rag_pool.invalidate(working_dir, keep=config.pool_key)
+      bump_index_version(working_dir)
+      answer_cache.invalidate(working_dir)
+    return summary
+
 # インデックス作成関数の定義
-async def make_index(filepath):
-    lightrag = None
+async def make_index(config, dataset, data_dir=DATA_DIR, trace=None):
+    """
+    Index <data_dir>/<dataset>.txt, the .txt files under <data_dir>/<dataset>/
+    and the multimodal documents under data_dir into `config.working_dir`.
+
+    Only segments and files whose content hash changed since the last run are
+    parsed and inserted, and documents that disappeared are deleted from the
+    index (see utils.index_manifest). Multimodal documents are parsed in a
+    process pool of PARSE_WORKERS processes.
+
+    Returns the summary counts (added, removed, unchanged, failed); raises
+    FileNotFoundError when the dataset has no text file. The per-stage timing
+    is recorded into `trace` (a utils.tracing.Trace) when given.
+    """
+    text_files = list_text_files(data_dir, dataset)
+    if not text_files:
+        raise FileNotFoundError(f"`{data_dir}/{dataset}.txt`または`{data_dir}/{dataset}/`にテキストファイルが見つかりません。")
+    return await rag_pool.run(_make_index(config, text_files, data_dir, trace))
+
+# キャッシュキーに使うモーダル名（画像入力の場合は画像のハッシュを含める）
+def _cache_modal(modal, img_base64):
+    if img_base64:
+        return f"{modal.value}:{hashlib.sha256(img_base64.encode('utf-8')).hexdigest()}"
+    return modal.value
+
+# キーワード抽出を一度だけ行い、テキスト/マルチモーダル両方の検索で共有する
+async def _shared_keywords(rag, query, mode):
+    if mode == "naive":
+        return {}
     try:
-      lightrag = await initialize_rag()
-      rag = initialize_rag_anything(lightrag)
-      input_filepath = os.path.join(DATA_DIR, f"{filepath}.txt")
-      st.info(f"インデックスを作成中です。しばらくお待ちください... {input_filepath}")
-      with open(input_filepath) as f:
-        content = f.read()
-      lightrag.insert(content)
-      await rag.process_folder_complete(
-        folder_path=DATA_DIR,
-        output_dir=st.session_state.working_dir,
-        file_extensions=[".jpeg", ".jpg", ".png", ".pdf", ".pptx", ".docx"],
-        recursive=True,
-        max_workers=1,
-      )
-      st.success("インデックスの作成が完了しました。")
+        hl_keywords, ll_keywords = await get_keywords_from_query(
+            query, QueryParam(mode=mode), asdict(rag), rag.llm_response_cache
+        )
     except Exception as e:
-      st.error(f"インデックスの作成に失敗しました: {e}")
-    finally:
-      if lightrag:
-        await lightrag.finalize_storages()
+        print(f"Keyword extraction failed, each branch extracts its own: {e}")
+        return {}
+    return {"hl_keywords": hl_keywords, "ll_keywords": ll_keywords}
 
-# 検索関数の定義
-async def search(mode, query="この文章を読むとどのような知見が得られるか簡潔にまとめてください。", modal=ModalType.TEXT_ONLY, img_base64=None):
+# タイムアウト付きで検索を実行し、失敗してもメッセージを返す
+async def _run_branch(label, coro):
+    try:
+        return await asyncio.wait_for(coro, QUERY_TIMEOUT), True
+    except asyncio.TimeoutError:
+        return f"{label} search timed out after {QUERY_TIMEOUT:.0f} seconds.", False
+    except Exception as e:
+        return f"{label} search failed: {e}", False
+
+# aqueryと同じ検索を行い、回答と一緒に検索で取得したエンティティ名を返す
+async def _aquery_with_entities(rag, query, param):
+    result = await rag.aquery_llm(query, param=param)
+    entities = [entity["entity_name"] for entity in (result.get("data") or {}).get("entities", []) if entity.get("entity_name")]
+    llm_response = result.get("llm_response", {})
+    if llm_response.get("is_streaming"):
+        return llm_response.get("response_iterator"), entities
+    return llm_response.get("content", ""), entities
+
+# テキストのみの検索（globalモードは事前計算したコミュニティレポートがあればそれを使う）
+async def _text_query(config, rag, mode, query, stream=False):
+    reports = None
+    if mode == "global" and community_reports.COMMUNITY_REPORTS:
+        reports = community_reports.fresh_reports(config.working_dir, config.language)
+    if reports is None:
+        return await _aquery_with_entities(rag, query, QueryParam(mode=mode, stream=stream))
+    with tracing.span("community_search", reports=len(reports["reports"])):
+        return await community_reports.global_search(query, reports, rag.llm_model_func, config.language, stream=stream)
+
+# テキスト検索とマルチモーダル検索を並行に実行
+async def _query_both(rag, rag_anything, query, mode):
+    keywords = await _shared_keywords(rag, query, mode)
+    (text, text_ok), (msg_multimodal, multimodal_ok) = await asyncio.gather(
+        _run_branch("Text Only", _aquery_with_entities(rag, query, QueryParam(mode=mode, **keywords))),
+        _run_branch("Multimodal", rag_anything.aquery(
+            query=query,
+            mode=mode,
+            vlm_enhanced=True,
+            **keywords,
+        )),
+    )
+    msg, entities = text if text_ok else (text, [])
+    return msg, msg_multimodal, entities, text_ok and multimodal_ok
+
+# 回答キャッシュの検索（キャッシュへの保存に使う引数も返す）
+async def _lookup_answer_cache(working_dir, mode, query, modal, img_base64):
+    cache_args = {
+        "dataset": working_dir,
+        "mode": mode,
+        "modal": _cache_modal(modal, img_base64),
+        "query": query,
+        "version": get_index_version(working_dir),
+        "embedding": None,
+    }
+    with tracing.span("answer_cache") as span:
+        if answer_cache.similarity > 0 and not img_base64:
+            cache_args["embedding"] = (await embedding_func([query]))[0]
+        cached = answer_cache.get(**cache_args)
+        if span is not None:
+            span.set(hit=cached is not None)
+    if cached is not None:
+        print(f"[Answer cache hit] {query}")
+    return cached, cache_args
+
+# autoモードの振り分け（LLMは使わず、質問の手がかり語と知識グラフのエンティティ名から決める）
+async def _route_mode(config, query, retrieval):
+    async def load_names():
+        async with rag_pool.borrow(*config.pool_key) as (rag, _):
+            return await rag.chunk_entity_relation_graph.get_all_labels()
+
+    with tracing.span("route") as span:
+        matcher = await mode_router.entity_matcher(config.pool_key, get_index_version(config.working_dir), load_names)
+        decision = mode_router.route(query, matcher)
+        if span is not None:
+            span.set(mode=decision.mode, reason=decision.reason)
+            span.trace.root.set(routed_mode=decision.mode)
+    mode_router.log_decision(config.working_dir, query, decision, span.trace.trace_id if span is not None else None)
+    retrieval["mode"] = decision.mode
+    return decision.mode
+
+async def _search(config, mode, query, modal, img_base64, retrieval=None, trace=None):
     """
-    Perform mix search (Knowledge Graph + Vector Retrieval)
-    Mix mode combines knowledge graph and vector search:
-    - Uses both structured (KG) and unstructured (vector) information
-    - Provides comprehensive answers by analyzing relationships and context
-    - Supports image content through HTML img tags
-    - Allows control over retrieval depth via top_k parameter
+    Answer the query on the pool's loop. When `retrieval` is a dict, the names
+    of the entities retrieved for the answer are stored in
+    `retrieval["entities"]` (empty for multimodal-only answers) and the mode
+    chosen for "auto" in `retrieval["mode"]`. The stages are timed into
+    `trace` (a new one when None).
     """
+    retrieval = {} if retrieval is None else retrieval
+    with tracing.record("search", trace, dataset=config.working_dir, mode=mode, modal=modal.value):
+        if mode == AUTO_MODE:
+            mode = await _route_mode(config, query, retrieval)
+        return await _answer(config, mode, query, modal, img_base64, retrieval)
+
+async def _answer(config, mode, query, modal, img_base64, retrieval):
+    cached, cache_args = await _lookup_answer_cache(config.working_dir, mode, query, modal, img_base64)
+    if cached is not None:
+        retrieval["entities"] = answer_cache.entities(**cache_args) or []
+        return cached
 
-    rag = None
     msg = ""
     msg_multimodal = ""
-    try:
-        rag = await initialize_rag()
-        rag_anything = initialize_rag_anything(rag)
-
+    entities = []
+    cacheable = True
+    async with rag_pool.borrow(*config.pool_key) as (rag, rag_anything):
         if modal == ModalType.TEXT_ONLY:
-            msg = rag.query(query, param=QueryParam(mode=mode))
+            msg, entities = await _text_query(config, rag, mode, query)
         elif modal == ModalType.MULTIMODAL:
-            msg_multimodal = rag_anything.query(
+            msg_multimodal = await rag_anything.aquery(
                 query=query,
                 mode=mode,
                 vlm_enhanced=True,
             )
         elif modal == ModalType.MULTIMODAL_INPUT:
-            if not img_base64:
-                st.error("Please upload an image for Multimodal Input mode.")
-                return "Error: No image provided for Multimodal Input mode."
-            msg = rag_anything.query_with_multimodal(
+            msg = await rag_anything.aquery_with_multimodal(
                 query,
                 multimodal_content=[{
                     "type": "image",
@@ -219,30 +558,103 @@ async def search(mode, query="この文章を読むとどのような知見が
                 mode=mode,
             )
         elif modal == ModalType.BOTH:
-            msg = rag.query(query, param=QueryParam(mode=mode))
-            msg_multimodal = rag_anything.query(
-                query=query,
-                mode=mode,
-                vlm_enhanced=True,
-            )
-        else:
-            st.error(f"Invalid modal type: {modal}")
-            return f"Error: Invalid modal type: {modal}"
+            msg, msg_multimodal, entities, cacheable = await _query_both(rag, rag_anything, query, mode)
+    retrieval["entities"] = entities
+
+    print("="*100)
+    print(f"\nquestion: {query}")
+    print(f"[Mode: {mode} Search]")
+    print("-"*30)
+    print("")
+    print(msg)
+    if modal == ModalType.MULTIMODAL:
+        msg = msg_multimodal
+    elif modal == ModalType.BOTH:
+        msg = f"#### Text Only\n{msg}\n\n#### Multimodal\n{msg_multimodal}"
+    if cacheable:
+        with tracing.span("answer_cache", store=True):
+            answer_cache.put(answer=msg, entities=entities, **cache_args)
+    return msg
+
+# ストリーミング検索（テキストのみの検索でトークンを逐次返す）
+async def _search_stream(config, mode, query, modal, img_base64, retrieval=None, trace=None):
+    retrieval = {} if retrieval is None else retrieval
+    if modal != ModalType.TEXT_ONLY:
+        # マルチモーダル検索はストリーミングに対応していないため、回答全体を一度に返す
+        yield await _search(config, mode, query, modal, img_base64, retrieval, trace)
+        return
 
+    # yieldの後は別のタスク（コンテキスト）で再開されるため、それ以降のスパンは親を明示する
+    with tracing.record("search", trace, dataset=config.working_dir, mode=mode, modal=modal.value, stream=True) as trace:
+        if mode == AUTO_MODE:
+            mode = await _route_mode(config, query, retrieval)
+        cached, cache_args = await _lookup_answer_cache(config.working_dir, mode, query, modal, img_base64)
+        if cached is not None:
+            retrieval["entities"] = answer_cache.entities(**cache_args) or []
+            yield cached
+            return
+
+        chunks = []
+        async with rag_pool.borrow(*config.pool_key) as (rag, _):
+            response, entities = await _text_query(config, rag, mode, query, stream=True)
+            retrieval["entities"] = entities
+            with tracing.span("generate", parent=trace.root) as span:
+                if isinstance(response, str):
+                    chunks.append(response)
+                    yield response
+                else:
+                    async for chunk in response:
+                        chunks.append(chunk)
+                        yield chunk
+                if span is not None:
+                    span.set(chunks=len(chunks))
+
+        msg = "".join(chunks)
         print("="*100)
         print(f"\nquestion: {query}")
         print(f"[Mode: {mode} Search]")
         print("-"*30)
         print("")
         print(msg)
-        if modal == ModalType.MULTIMODAL:
-            msg = msg_multimodal
-        elif modal == ModalType.BOTH:
-            msg = f"#### Text Only\n{msg}\n\n#### Multimodal\n{msg_multimodal}"
-    except Exception as e:
-        st.error(f"Search failed: {e}")
-        msg = f"Search failed: {e}"
-    finally:
-        if rag:
-            await rag.finalize_storages()
-    return msg
+        with tracing.span("answer_cache", parent=trace.root, store=True):
+            answer_cache.put(answer=msg, entities=entities, **cache_args)
+
+
+# 検索関数の定義
+async def search(config, mode, query=DEFAULT_QUERY, modal=ModalType.TEXT_ONLY, img_base64=None, stream=False, retrieval=None, trace=None):
+    """
+    Perform mix search (Knowledge Graph + Vector Retrieval)
+    Mix mode combines knowledge graph and vector search:
+    - Uses both structured (KG) and unstructured (vector) information
+    - Provides comprehensive answers by analyzing relationships and context
+    - Supports image content through HTML img tags
+    - Allows control over retrieval depth via top_k parameter
+
+    With mode "auto" the mode is chosen per query by utils.mode_router (no
+    LLM call) and reported in `retrieval["mode"]`.
+
+    The LightRAG/RAGAnything instances for `config` are borrowed from the
+    process-wide `rag_pool`, so storages are only loaded on the first query
+    for a dataset.
+
+    With `stream=True` an async iterator of answer chunks is returned instead
+    of the answer string (like `LightRAG.aquery` with `QueryParam(stream=True)`).
+    Only Text Only answers are streamed token by token; other modals yield the
+    whole answer as a single chunk.
+
+    When `retrieval` is a dict, the entities retrieved for the answer are
+    stored in `retrieval["entities"]` (see visualize_neighborhood). Raises
+    ValueError for an invalid modal or a missing image.
+
+    The time spent in each stage (storage init, keyword extraction, vector
+    retrieval, graph lookups, context building, LLM/vision/embedding calls with
+    their token counts) is recorded into `trace` (a utils.tracing.Trace) when
+    given, and always exported to TRACE_FILE and the /metrics histograms.
+    """
+    if modal == ModalType.MULTIMODAL_INPUT and not img_base64:
+        raise ValueError("No image provided for Multimodal Input mode.")
+    if not isinstance(modal, ModalType):
+        raise ValueError(f"Invalid modal type: {modal}")
+    if stream:
+        return rag_pool.stream(_search_stream(config, mode, query, modal, img_base64, retrieval, trace))
+    return await rag_pool.run(_search(config, mode, query, modal, img_base64, retrieval, trace))
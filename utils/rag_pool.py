@@ -0,0 +1,239 @@
+import os
+import time
+import atexit
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from utils import tracing
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+RAG_POOL_MEMORY_MB = int(os.getenv("RAG_POOL_MEMORY_MB", 2048))
+RAG_POOL_IDLE_SECONDS = int(os.getenv("RAG_POOL_IDLE_SECONDS", 1800))
+RAG_POOL_SWEEP_SECONDS = int(os.getenv("RAG_POOL_SWEEP_SECONDS", 60))
+
+
+@dataclass
+class PoolEntry:
+    key: tuple
+    rag: object
+    rag_anything: object
+    size_bytes: int
+    last_used: float = field(default_factory=time.monotonic)
+    in_use: int = 0
+    load_seconds: float = 0.0
+    stale: bool = False
+
+
+# ワーキングディレクトリのストレージファイルの合計サイズ（常駐メモリ量の目安）
+def estimate_storage_size(working_dir):
+    total = 0
+    if not os.path.isdir(working_dir):
+        return total
+    for entry in os.scandir(working_dir):
+        if entry.is_file():
+            total += entry.stat().st_size
+    return total
+
+
+class RagPool:
+    """
+    Process-wide pool of initialized LightRAG/RAGAnything instances.
+
+    Instances are keyed by (working_dir, language, graph_storage, vector_storage) and live on a
+    dedicated event loop thread, because LightRAG storages and locks are bound to
+    the loop that created them while Streamlit runs every rerun on a new loop.
+    Callers hand coroutines to `run()`, which executes them on the pool loop.
+
+    Loaded instances stay resident until they are idle for `idle_seconds` or
+    the estimated size of all entries exceeds the memory budget, in which case
+    the least recently used ones are finalized. Keys loaded with `preload()`
+    (the hot datasets) never expire and are evicted for memory last.
+    """
+
+    def __init__(self, factory, memory_budget_mb=RAG_POOL_MEMORY_MB, idle_seconds=RAG_POOL_IDLE_SECONDS):
+        self._factory = factory
+        self._memory_budget = memory_budget_mb * 1024 * 1024
+        self._idle_seconds = idle_seconds
+        self._entries = OrderedDict()
+        self._key_locks = {}
+        self._pinned = set()
+        self._loop = None
+        self._thread = None
+        self._sweeper = None
+        self._thread_lock = threading.Lock()
+
+    # プール専用のイベントループを起動
+    def _ensure_loop(self):
+        with self._thread_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="rag-pool", daemon=True)
+                self._thread.start()
+                self._sweeper = asyncio.run_coroutine_threadsafe(self._sweep_periodically(), self._loop)
+                atexit.register(self.close)
+        return self._loop
+
+    def submit(self, coro):
+        """Schedule a coroutine on the pool loop and return a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    async def run(self, coro):
+        """Await a coroutine executed on the pool loop from any other event loop."""
+        loop = self._ensure_loop()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    async def stream(self, agen):
+        """Iterate an async generator running on the pool loop from any other event loop."""
+        loop = self._ensure_loop()
+        if asyncio.get_running_loop() is loop:
+            async for item in agen:
+                yield item
+            return
+        try:
+            while True:
+                try:
+                    item = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(agen.__anext__(), loop))
+                except StopAsyncIteration:
+                    break
+                yield item
+        finally:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(agen.aclose(), loop))
+
+    @asynccontextmanager
+    async def borrow(self, working_dir, language, graph_storage, vector_storage):
+        """Borrow (rag, rag_anything) for the key. Must be used on the pool loop."""
+        key = (working_dir, language, graph_storage, vector_storage)
+        lock = self._key_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                start = time.perf_counter()
+                rag, rag_anything = await self._factory(working_dir, language, graph_storage, vector_storage)
+                entry = PoolEntry(key, rag, rag_anything, estimate_storage_size(working_dir))
+                entry.load_seconds = time.perf_counter() - start
+                self._entries[key] = entry
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(key)
+        try:
+            await self._evict()
+            yield entry.rag, entry.rag_anything
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            entry.size_bytes = estimate_storage_size(working_dir)
+            if entry.stale and entry.in_use == 0:
+                await self._close(entry)
+
+    async def preload(self, keys):
+        """Load the instances for `keys` ahead of the first query and keep them resident. Must run on the pool loop."""
+        for key in keys:
+            self._pinned.add(key)
+            try:
+                async with self.borrow(*key):
+                    pass
+            except Exception as e:
+                self._pinned.discard(key)
+                print(f"Failed to preload RAG instance {key}: {e}")
+
+    async def invalidate(self, working_dir, keep=None):
+        """
+        Drop every entry for working_dir (except `keep`) after its index was
+        rebuilt. Entries still in use are finalized when they are returned.
+        """
+        for key in [k for k in self._entries if k[0] == working_dir and k != keep]:
+            entry = self._entries[key]
+            if entry.in_use:
+                # 次の借用では新しいインスタンスを作り、使用中のものは最後の利用者が返したときに破棄する
+                entry.stale = True
+                del self._entries[key]
+            else:
+                await self._finalize(key)
+
+    # アイドル時間とメモリ予算に基づいてエントリを破棄
+    async def _evict(self):
+        now = time.monotonic()
+        for key, entry in list(self._entries.items()):
+            if entry.in_use == 0 and key not in self._pinned and now - entry.last_used > self._idle_seconds:
+                await self._finalize(key)
+        total = sum(entry.size_bytes for entry in self._entries.values())
+        # 使われていない順に破棄する（ホットデータセットは他をすべて破棄しても予算を超える場合だけ）
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[0] in self._pinned):
+            if total <= self._memory_budget:
+                break
+            if entry.in_use == 0:
+                total -= entry.size_bytes
+                await self._finalize(key)
+
+    async def _finalize(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            await self._close(entry)
+
+    async def _close(self, entry):
+        key = entry.key
+        # 同じキーで読み込み中・再作成済みでなければロックも破棄する（キーごとのロックが増え続けないように）
+        lock = self._key_locks.get(key)
+        if lock is not None and not lock.locked() and key not in self._entries:
+            del self._key_locks[key]
+        try:
+            with tracing.span("finalize", working_dir=key[0]):
+                await entry.rag.finalize_storages()
+        except Exception as e:
+            print(f"Failed to finalize RAG instance {key}: {e}")
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(RAG_POOL_SWEEP_SECONDS)
+            await self._evict()
+
+    def stats(self):
+        """The resident (warm) instances, most recently used first."""
+        entries = list(self._entries.items())
+        return {
+            "entries": [
+                {
+                    "working_dir": key[0],
+                    "language": key[1],
+                    "graph_storage": key[2],
+                    "vector_storage": key[3],
+                    "size_mb": round(entry.size_bytes / 1024 / 1024, 2),
+                    "idle_seconds": round(time.monotonic() - entry.last_used, 1),
+                    "in_use": entry.in_use,
+                    "hot": key in self._pinned,
+                    "load_seconds": round(entry.load_seconds, 2),
+                }
+                for key, entry in reversed(entries)
+            ],
+            "memory_used_mb": round(sum(entry.size_bytes for _, entry in entries) / 1024 / 1024, 2),
+            "memory_budget_mb": self._memory_budget // 1024 // 1024,
+        }
+
+    def close(self):
+        """Finalize all pooled instances and stop the pool loop."""
+        if self._loop is None or not self._loop.is_running():
+            return
+
+        async def _close_all():
+            self._sweeper.cancel()
+            for key in list(self._entries):
+                await self._finalize(key)
+            # LightRAGが起動したワーカータスクなどが残っていればループ停止前に終了させる
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(_close_all(), self._loop).result(timeout=60)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
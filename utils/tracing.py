@@ -0,0 +1,271 @@
+# 検索とインデックス作成のステージごとの計測（スパンの入れ子、トレースの出力、OpenMetricsの集計）
+import os
+import json
+import time
+import uuid
+import bisect
+import functools
+import threading
+import contextlib
+import contextvars
+from dotenv import load_dotenv
+
+# 環境変数をロード
+load_dotenv()
+
+# 定数の設定
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 1000))
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+TOKEN_KEYS = ["prompt_tokens", "completion_tokens", "total_tokens"]
+
+# 現在のスパン（新しいスパンの親になる）
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed stage. Also a TokenTracker: `add_usage` counts tokens on the span."""
+
+    def __init__(self, trace, name, parent, attributes):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.end = None
+        self.children_seconds = 0.0
+        self.forward = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_usage(self, counts):
+        for key in TOKEN_KEYS:
+            self.attributes[key] = self.attributes.get(key, 0) + counts.get(key, 0)
+        self.trace._add_tokens(self.name, counts)
+        if self.forward is not None:
+            self.forward.add_usage(counts)
+
+    def count_tokens(self, tracker=None):
+        """Use the span as the token tracker of an API call, passing the usage on to `tracker`."""
+        self.forward = tracker
+        return self
+
+    def fail(self, error):
+        self.set(error=f"{type(error).__name__}: {error}")
+        self.finish()
+
+    def finish(self):
+        if self.end is not None:
+            return
+        self.end = time.perf_counter()
+        duration = self.end - self.start
+        if self.parent is not None:
+            self.parent.children_seconds += duration
+        self.trace._add_span(self, duration)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "parent": self.parent.name if self.parent is not None else None,
+            "start_ms": round((self.start - self.trace.root.start) * 1000, 2),
+            "duration_ms": round(((self.end or time.perf_counter()) - self.start) * 1000, 2),
+            **self.attributes,
+        }
+
+
+class Trace:
+    """Spans of one search or indexing run. Pass one to search()/make_index() to read it afterwards."""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.operation = None
+        self.root = None
+        self.started_at = None
+        self.spans = []
+        self.dropped_spans = 0
+        self.stages = {}
+
+    def start(self, operation, **attributes):
+        self.operation = operation
+        self.started_at = time.time()
+        self.root = Span(self, operation, None, attributes)
+        return self
+
+    def finish(self, error=None):
+        if error is not None:
+            self.root.set(error=error)
+        if self.root.end is None:
+            self.root.finish()
+            export(self)
+
+    @property
+    def duration_ms(self):
+        return round((self.root.end - self.root.start) * 1000, 2) if self.root and self.root.end else None
+
+    def _add_span(self, span, duration):
+        stage = self.stages.setdefault(span.name, {"calls": 0, "total_ms": 0.0, "self_ms": 0.0})
+        stage["calls"] += 1
+        stage["total_ms"] += duration * 1000
+        # 入れ子のスパンの時間を除いた、そのステージ自身の時間
+        stage["self_ms"] += max(0.0, duration - span.children_seconds) * 1000
+        if span is self.root:
+            return
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+
+    def _add_tokens(self, name, counts):
+        stage = self.stages.setdefault(name, {"calls": 0, "total_ms": 0.0, "self_ms": 0.0})
+        for key in TOKEN_KEYS:
+            stage[key] = stage.get(key, 0) + counts.get(key, 0)
+
+    def stage_rows(self):
+        """Per-stage totals, slowest (by self time) first."""
+        rows = [
+            {"stage": name, **{key: round(value, 2) if isinstance(value, float) else value for key, value in stage.items()}}
+            for name, stage in self.stages.items()
+        ]
+        return sorted(rows, key=lambda row: row["self_ms"], reverse=True)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "operation": self.operation,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "attributes": self.root.attributes if self.root else {},
+            "stages": self.stage_rows(),
+            "spans": [span.to_dict() for span in self.spans],
+            "dropped_spans": self.dropped_spans,
+        }
+
+
+@contextlib.contextmanager
+def activate(span):
+    """Make `span` the parent of the spans opened in this context."""
+    previous = _current_span.get()
+    _current_span.set(span)
+    try:
+        yield span
+    finally:
+        # 非同期ジェネレーターではyieldをまたぐと別のコンテキストになるため、resetではなく元の値を設定し直す
+        _current_span.set(previous)
+
+@contextlib.contextmanager
+def record(operation, trace=None, **attributes):
+    """Trace `operation` into `trace` (a new Trace when None) and export it when the block ends."""
+    trace = (trace or Trace()).start(operation, **attributes)
+    error = None
+    try:
+        with activate(trace.root):
+            yield trace
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        trace.finish(error)
+
+def start_span(name, parent=None, **attributes):
+    """A child span of `parent` (default: the current span) that the caller finishes. None outside a trace."""
+    parent = parent or _current_span.get()
+    if parent is None or parent.trace.root.end is not None:
+        return None
+    return Span(parent.trace, name, parent, attributes)
+
+@contextlib.contextmanager
+def span(name, parent=None, **attributes):
+    """Time the block as a child of `parent` (default: the current span). Yields None outside a trace."""
+    child = start_span(name, parent, **attributes)
+    if child is None:
+        yield None
+        return
+    try:
+        with activate(child):
+            yield child
+    except BaseException as e:
+        child.fail(e)
+        raise
+    finally:
+        child.finish()
+
+async def finish_after(span, iterator):
+    """Yield from `iterator` and finish `span` when it is exhausted or closed."""
+    try:
+        async for chunk in iterator:
+            yield chunk
+    except Exception as e:
+        span.fail(e)
+        raise
+    finally:
+        span.finish()
+
+def traced(name):
+    """Decorator: time every call of an async function as a `name` span."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# 完了したトレースの集計（OpenMetrics形式で公開する）
+_metrics_lock = threading.Lock()
+_stage_histograms = {}
+_token_counters = {}
+_file_lock = threading.Lock()
+
+def _observe(key, seconds):
+    histogram = _stage_histograms.setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0})
+    index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    if index < len(LATENCY_BUCKETS):
+        histogram["buckets"][index] += 1
+    histogram["count"] += 1
+    histogram["sum"] += seconds
+
+def export(trace):
+    """Add a finished trace to the metrics and append it to TRACE_FILE."""
+    with _metrics_lock:
+        _observe((trace.operation, trace.operation), trace.duration_ms / 1000)
+        for name, stage in trace.stages.items():
+            if name != trace.operation:
+                _observe((trace.operation, name), stage["self_ms"] / 1000)
+            for key in TOKEN_KEYS[:2]:
+                if stage.get(key):
+                    counter_key = (trace.operation, name, key.split("_")[0])
+                    _token_counters[counter_key] = _token_counters.get(counter_key, 0) + stage[key]
+    if TRACE_FILE:
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+        with _file_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+def _labels(**labels):
+    return ",".join(f'{key}="{str(value)}"' for key, value in labels.items())
+
+def openmetrics():
+    """The aggregated stage latencies and token counts in the OpenMetrics text format."""
+    lines = [
+        "# TYPE graphrag_stage_seconds histogram",
+        "# UNIT graphrag_stage_seconds seconds",
+        "# HELP graphrag_stage_seconds Time spent in each stage per operation, excluding nested stages (stage=operation is the whole operation).",
+    ]
+    with _metrics_lock:
+        for (operation, stage), histogram in sorted(_stage_histograms.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                cumulative += count
+                lines.append(f"graphrag_stage_seconds_bucket{{{_labels(operation=operation, stage=stage, le=bound)}}} {cumulative}")
+            lines.append(f"graphrag_stage_seconds_bucket{{{_labels(operation=operation, stage=stage, le='+Inf')}}} {histogram['count']}")
+            lines.append(f"graphrag_stage_seconds_sum{{{_labels(operation=operation, stage=stage)}}} {histogram['sum']:.6f}")
+            lines.append(f"graphrag_stage_seconds_count{{{_labels(operation=operation, stage=stage)}}} {histogram['count']}")
+        lines += [
+            "# TYPE graphrag_tokens counter",
+            "# HELP graphrag_tokens Tokens reported by the API per operation and stage.",
+        ]
+        for (operation, stage, kind), value in sorted(_token_counters.items()):
+            lines.append(f"graphrag_tokens_total{{{_labels(operation=operation, stage=stage, kind=kind)}}} {value}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
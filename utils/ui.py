@@ -0,0 +1,100 @@
+import streamlit as st
+from utils import rag
+from utils.tracing import Trace
+from utils.config import RagConfig, ModalType
+from utils.common import select_graph_storage
+
+# Streamlitのセッションステートから検索・インデックス作成の設定を作る
+def session_config():
+    return RagConfig(
+        working_dir=st.session_state.working_dir,
+        language=st.session_state.language,
+        graph_storage=select_graph_storage(),
+    )
+
+# 処理時間の内訳（ステージごとの時間とトークン数）を折りたたみ表示する
+def show_timing(trace):
+    if trace is None or trace.duration_ms is None:
+        return
+    routed_mode = trace.root.attributes.get("routed_mode")
+    title = f"処理時間: {trace.duration_ms / 1000:.2f}秒" + (f"（autoモード: {routed_mode}）" if routed_mode else "")
+    with st.expander(title):
+        st.dataframe(trace.stage_rows(), hide_index=True, use_container_width=True)
+        st.caption(f"trace_id: {trace.trace_id}（self_msは入れ子のステージを除いた時間。並行実行されたステージは重複して数えられる）")
+
+# 読み込み済みのデータセット（切り替えてもストレージの初期化が不要）をサイドバーに表示する
+def show_warm_datasets():
+    rag.preload_hot_datasets()
+    stats = rag.rag_pool.stats()
+    with st.sidebar.expander(f"Warm Datasets ({len(stats['entries'])})"):
+        st.caption(f"メモリ使用量の目安: {stats['memory_used_mb']} / {stats['memory_budget_mb']} MB（超えると使われていない順に破棄）")
+        if stats["entries"]:
+            st.dataframe(
+                [
+                    {key: entry[key] for key in ["working_dir", "language", "hot", "size_mb", "idle_seconds", "load_seconds"]}
+                    for entry in stats["entries"]
+                ],
+                hide_index=True,
+                use_container_width=True,
+            )
+
+# インデックス作成（結果と失敗を画面に表示する）
+async def make_index(filepath):
+    trace = Trace()
+    try:
+        st.info("インデックスを作成中です。しばらくお待ちください...")
+        summary = await rag.make_index(session_config(), filepath, trace=trace)
+    except FileNotFoundError as e:
+        st.error(str(e))
+        return
+    except Exception as e:
+        st.error(f"インデックスの作成に失敗しました: {e}")
+        show_timing(trace)
+        return
+    st.success(
+        "インデックスの作成が完了しました。"
+        f"(追加: {summary['added']}, 削除: {summary['removed']}, 変更なし: {summary['unchanged']})"
+    )
+    if summary["failed"]:
+        st.warning(f"{summary['failed']}件のドキュメントの処理に失敗しました。ログを確認してください。")
+    show_timing(trace)
+
+async def _single_message(msg):
+    yield msg
+
+async def _stream_with_error_handling(chunks, retrieval, trace):
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except Exception as e:
+        st.error(f"Search failed: {e}")
+        yield f"Search failed: {e}"
+    st.session_state.retrieved_entities = retrieval.get("entities", [])
+    st.session_state.last_trace = trace
+
+# 検索（エラーは画面に表示して、回答の代わりにメッセージを返す）
+async def search(mode, query=rag.DEFAULT_QUERY, modal=ModalType.TEXT_ONLY, img_base64=None, stream=False):
+    """
+    utils.rag.search for the dataset selected in the session. The entities
+    retrieved for the answer are kept in `st.session_state.retrieved_entities`
+    (see visualize_neighborhood) and its timing in `st.session_state.last_trace`
+    (see show_timing).
+    """
+    retrieval = {}
+    trace = Trace()
+    st.session_state.last_trace = None
+    try:
+        answer = await rag.search(session_config(), mode, query, modal, img_base64, stream, retrieval, trace)
+    except ValueError as e:
+        st.error(str(e))
+        msg = f"Error: {e}"
+        return _single_message(msg) if stream else msg
+    except Exception as e:
+        st.error(f"Search failed: {e}")
+        msg = f"Search failed: {e}"
+        return _single_message(msg) if stream else msg
+    if stream:
+        return _stream_with_error_handling(answer, retrieval, trace)
+    st.session_state.retrieved_entities = retrieval.get("entities", [])
+    st.session_state.last_trace = trace
+    return answer